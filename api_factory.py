@@ -1,25 +1,64 @@
+import asyncio
 from api_base import APIBase
 from gpt_image_api import GptImageAPI
 from flux_api import FluxAPI
 from kling_api import KlingAPI
-from pika_api import PikaAPI
+from pika_api import AsyncPikaAPI, PikaAPI
 from api_params import GptImageParams, FluxParams, KlingParams
+from http_session import SharedSession, shared_session
+from genapi_poller import GenApiPoller, genapi_poller
+from callback_server import CallbackReceiver, callback_receiver
+from pika_token_store import PikaTokenStore, pika_token_store
+from pika_status import PikaStatusAggregator, pika_status_aggregator
+from rate_limiter import RateLimiters, rate_limiters
+from credential_pool import CredentialPools, credential_pools
+from submission_ledger import SubmissionLedger, submission_ledger
+from hedging import HedgePolicies, HedgedImageAPI, hedge_policies
+from result_cache import ResultCache, CachedImageAPI, result_cache as shared_result_cache
 
 class APIFactory:
-    def __init__(self):
+    def __init__(self, http_session: SharedSession = None, poller: GenApiPoller = None,
+                 callbacks: CallbackReceiver = None, token_store: PikaTokenStore = None,
+                 status_aggregator: PikaStatusAggregator = None, result_cache: ResultCache = None,
+                 limiters: RateLimiters = None, credentials: CredentialPools = None,
+                 submissions: SubmissionLedger = None, hedging: HedgePolicies = None):
+        self.http_session = http_session or shared_session
+        self.poller = poller or genapi_poller
+        self.callbacks = callbacks or callback_receiver
+        self.token_store = token_store or pika_token_store
+        self.status_aggregator = status_aggregator or pika_status_aggregator
+        self.result_cache = result_cache or shared_result_cache
+        self.limiters = limiters or rate_limiters
+        self.credentials = credentials or credential_pools
+        self.submissions = submissions or submission_ledger
+        self.hedging = hedging or hedge_policies
+        # Синхронные клиенты Pika по аккаунтам: у каждого свой поток с event loop, поэтому они не пересоздаются
+        self._sync_clients: dict[str, PikaAPI] = {}
         self.api_classes = {
             "gpt_image": GptImageAPI,
             "flux": FluxAPI,
             "kling": KlingAPI,
-            "pika": PikaAPI
+            "pika": AsyncPikaAPI,
+            "pika_sync": PikaAPI
         }
         self.param_classes = {
             "gpt_image": GptImageParams,
             "flux": FluxParams,
             "kling": KlingParams
         }
+        self.genapi_clients = {"gpt_image", "flux", "kling"}
+        # Клиенты, результаты которых кэшируются в ResultCache или хеджируются, и имена их сетей в gen-api
+        self.cached_clients = {"gpt_image": "gpt-image-1", "flux": "flux"}
+        # Пул учётных данных, из которого клиент получает ключ или аккаунт
+        self.credential_providers = {
+            "gpt_image": "genapi",
+            "flux": "genapi",
+            "kling": "genapi",
+            "pika": "pika",
+            "pika_sync": "pika"
+        }
 
-    def get_api(self, api_name: str, params: dict = None) -> APIBase:
+    async def get_api(self, api_name: str, params: dict = None, job=None) -> APIBase:
         api_class = self.api_classes.get(api_name)
         if not api_class:
             raise ValueError(f"API {api_name} не поддерживается")
@@ -29,5 +68,44 @@ class APIFactory:
             api_params = param_class(**params)
         else:
             api_params = param_class() if param_class else None
-            
-        return api_class(params=api_params)
\ No newline at end of file
+
+        # Задание арендует ключ провайдера на всё время выполнения; без задания — основной ключ
+        provider = self.credential_providers.get(api_name)
+        credential = None
+        if provider:
+            if job is not None:
+                credential = await job.credentials.lease(provider)
+            else:
+                credential = self.credentials.get(provider).primary
+
+        if api_name in self.genapi_clients:
+            api = api_class(params=api_params, http_session=self.http_session, poller=self.poller,
+                            callbacks=self.callbacks, limiters=self.limiters, api_key=credential.secret,
+                            submissions=self.submissions)
+            network = self.cached_clients.get(api_name)
+            # Хеджирование внутри кэша: дубликат отправляется только при промахе
+            if network and self.hedging.enabled(network):
+                api = HedgedImageAPI(api, network, self.hedging)
+            if network and self.result_cache.enabled:
+                return CachedImageAPI(api, network, self.result_cache,
+                                      artifacts=job.artifacts if job is not None else None)
+            return api
+        if api_name == "pika":
+            email, password = credential.secret
+            return api_class(email, password, params=api_params, http_session=self.http_session, token_store=self.token_store,
+                             status_aggregator=self.status_aggregator, limiters=self.limiters,
+                             submissions=self.submissions)
+        if api_name == "pika_sync":
+            # Синхронная обёртка работает в своём event loop: общие объекты бота ей не передаются
+            email, password = credential.secret
+            api = self._sync_clients.get(email)
+            if api is None:
+                api = api_class(email, password, params=api_params)
+                self._sync_clients[email] = api
+            return api
+        return api_class(params=api_params, http_session=self.http_session)
+
+    async def close(self) -> None:
+        for api in self._sync_clients.values():
+            await asyncio.to_thread(api.close)
+        self._sync_clients.clear()
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import logging
+import os
+from download_util import download
+from http_session import SharedSession, shared_session
+from result_cache import ResultCache
+from config import ARTIFACT_SPILL_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+class Artifact:
+    def __init__(self, name: str, size: int, sha256: str, data: bytes = None, path: str = None,
+                 url: str = None):
+        self.name = name
+        self.url = url
+        self.size = size
+        self.sha256 = sha256
+        self.data = data
+        self.path = path
+
+    def __repr__(self) -> str:
+        where = "memory" if self.data is not None else self.path
+        return f"Artifact({self.name!r}, size={self.size}, sha256={self.sha256[:12]}, in={where})"
+
+class _SpillSink:
+    def __init__(self, path: str, threshold: int):
+        self.path = path
+        self.threshold = threshold
+        self.buffer = bytearray()
+        self.file = None
+
+    async def write(self, chunk: bytes, hasher) -> None:
+        if self.file is None and len(self.buffer) + len(chunk) > self.threshold:
+            # Артефакт больше порога — переносим уже полученное на диск и дальше пишем туда
+            self.file = await asyncio.to_thread(open, self.path, "wb")
+            await asyncio.to_thread(self.file.write, bytes(self.buffer))
+            self.buffer = bytearray()
+        if self.file is not None:
+            await asyncio.to_thread(self.file.write, chunk)
+        else:
+            self.buffer += chunk
+        hasher.update(chunk)
+
+    async def reset(self) -> None:
+        await self.close()
+        self.buffer = bytearray()
+        self.file = None
+
+    async def close(self) -> None:
+        if self.file is not None and not self.file.closed:
+            await asyncio.to_thread(self.file.close)
+
+# Хранилище артефактов одного задания: изображения держатся в памяти и отдаются
+# в reply_photo и PikaAPI (image_content) без записи во временные файлы. Артефакты
+# больше ARTIFACT_SPILL_THRESHOLD сбрасываются на диск и удаляются в close().
+class ArtifactStore:
+    def __init__(self, job_id: str, spill_dir: str = "temp", threshold: int = ARTIFACT_SPILL_THRESHOLD,
+                 http_session: SharedSession = None, result_cache: ResultCache = None):
+        self.job_id = job_id
+        self.spill_dir = spill_dir
+        self.threshold = threshold
+        self.http_session = http_session or shared_session
+        self.result_cache = result_cache
+        self._artifacts: dict[str, Artifact] = {}
+
+    def _spill_path(self, name: str) -> str:
+        return os.path.join(self.spill_dir, f"artifact_{self.job_id}_{name}")
+
+    async def download(self, name: str, url: str) -> Artifact:
+        if self.result_cache is not None:
+            data = await self.result_cache.read_content(url)
+            if data is not None:
+                artifact = Artifact(name, len(data), hashlib.sha256(data).hexdigest(), data=data, url=url)
+                self._artifacts[name] = artifact
+                logger.debug(f"Artifact taken from result cache: {artifact}")
+                return artifact
+        os.makedirs(self.spill_dir, exist_ok=True)
+        sink = _SpillSink(self._spill_path(name), self.threshold)
+        size, sha256 = await download(url, sink, http_session=self.http_session)
+        if sink.file is not None:
+            artifact = Artifact(name, size, sha256, path=sink.path, url=url)
+        else:
+            artifact = Artifact(name, size, sha256, data=bytes(sink.buffer), url=url)
+        self._artifacts[name] = artifact
+        logger.debug(f"Artifact stored: {artifact}")
+        return artifact
+
+    def get(self, name: str) -> Artifact | None:
+        return self._artifacts.get(name)
+
+    def find(self, url: str) -> Artifact | None:
+        return next((artifact for artifact in self._artifacts.values() if artifact.url == url), None)
+
+    async def read(self, name: str) -> bytes:
+        artifact = self._artifacts[name]
+        if artifact.data is not None:
+            return artifact.data
+        return await asyncio.to_thread(self._read_file, artifact.path)
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def close(self) -> None:
+        for artifact in self._artifacts.values():
+            if artifact.path and os.path.exists(artifact.path):
+                await asyncio.to_thread(os.remove, artifact.path)
+        self._artifacts.clear()
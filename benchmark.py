@@ -0,0 +1,349 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Нагрузочный прогон конвейера без обращения к настоящим провайдерам: заглушки gen-api, Pika,
+# OpenAI и Telegram Bot API (fake_genapi.py, fake_providers.py) работают в отдельном процессе,
+# чтобы не искажать замеры памяти и дескрипторов, а бот получает синтетические Update через
+# Bot.handle_message от N пользователей одновременно. Каждый пользователь отправляет следующее
+# фото после завершения предыдущего задания. Итог (заданий в час, перцентили задержки,
+# пиковые RSS и число открытых файлов) сохраняется в JSON для сравнения между коммитами.
+# Запуск: python benchmark.py --users 8 --jobs-per-user 3 (нужен key.py; ключи никуда не отправляются)
+
+def _free_port(host: str) -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+def _fake_servers(settings: dict, ports: dict[str, int]) -> dict:
+    from fake_genapi import FakeGenApi
+    from fake_providers import FakePika, FakeOpenAI, FakeTelegram
+    common = {
+        "host": settings["host"], "jitter": settings["jitter"], "distribution": settings["distribution"],
+        "error_rate": settings["error_rate"], "seed": settings["seed"],
+    }
+    return {
+        "genapi": FakeGenApi(port=ports["genapi"], latency=settings["genapi_latency"],
+                             failure_rate=settings["failure_rate"], **common),
+        "pika": FakePika(port=ports["pika"], latency=settings["pika_latency"],
+                         failure_rate=settings["failure_rate"], video_size=settings["video_size"], **common),
+        "openai": FakeOpenAI(port=ports["openai"], latency=settings["openai_latency"],
+                             num_scenes=settings["scenes"], **common),
+        "telegram": FakeTelegram(port=ports["telegram"], latency=settings["telegram_latency"],
+                                 photo_size=settings["photo_size"], **common),
+    }
+
+async def _serve_fakes_async(settings: dict, ports: dict[str, int], ready) -> None:
+    servers = _fake_servers(settings, ports)
+    for server in servers.values():
+        await server.start()
+    ready.set()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for server in servers.values():
+            await server.stop()
+
+def _serve_fakes(settings: dict, ports: dict[str, int], ready) -> None:
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(_serve_fakes_async(settings, ports, ready))
+
+def _environment(args, urls: dict[str, str], workdir: str) -> dict[str, str]:
+    env = {
+        "GENAPI_BASE_URL": urls["genapi"],
+        "OPENAI_BASE_URL": urls["openai"] + "/v1",
+        "PIKA_API_URL": urls["pika"],
+        "PIKA_LIBRARY_URL": urls["pika"] + "/library",
+        "TELEGRAM_FILE_URL": urls["telegram"] + "/file/bot",
+        # Только опрос: заглушка отправляла бы callback на адрес, который бот не слушает
+        "CALLBACK_PUBLIC_URL": "",
+        "METRICS_PORT": "0",
+        "PIKA_TOKEN_CACHE_PATH": os.path.join(workdir, "pika_tokens.json"),
+        "JOB_STORE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "WORKSPACE_ROOT": os.path.join(workdir, "workspaces"),
+        "RESULT_CACHE_DIR": os.path.join(workdir, "results"),
+        "SCENARIO_CACHE_PATH": os.path.join(workdir, "scenarios.json"),
+        "TRACE_LOG_PATH": os.path.join(workdir, "trace.jsonl"),
+        # Ответы заглушек одинаковы для всех заданий, и кэш результатов завысил бы пропускную способность
+        "RESULT_CACHE_TTL": "0" if not args.result_cache else os.getenv("RESULT_CACHE_TTL", str(24 * 3600)),
+        "GENAPI_POLL_FIRST_CHECK": str(args.poll_interval),
+        "GENAPI_POLL_MIN_INTERVAL": str(args.poll_interval),
+        "GENAPI_POLL_DEFAULT_INTERVAL": str(args.poll_interval),
+        "PIKA_STATUS_INTERVAL": str(args.poll_interval),
+        # Каждый пользователь держит в очереди не больше одного задания
+        "JOB_MAX_QUEUE": str(max(args.users, int(os.getenv("JOB_MAX_QUEUE", "50")))),
+        "LOG_LEVEL": args.log_level,
+    }
+    if args.mode:
+        env["SCENE_EXECUTION_MODE"] = args.mode
+    return env
+
+def _seed_pika_tokens(path: str) -> None:
+    # Вход в Pika идёт через браузер, поэтому аккаунтам из key.py заранее выдаются токены заглушки
+    from credential_pool import credential_pools
+    expires_at = time.time() + 24 * 3600
+    session = {"access_token": "benchmark", "user": {"id": "benchmark-user"}, "expires_at": expires_at}
+    token = "base64-" + base64.b64encode(json.dumps(session).encode("utf-8")).decode("ascii")
+    entries = {
+        credential.secret[0]: {"token": token, "expires_at": expires_at}
+        for credential in credential_pools.get("pika").credentials
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+
+def _update_json(job_number: int, user_id: int, photo_size: int) -> dict:
+    file_id = f"bench-photo-{job_number}"
+    return {
+        "update_id": job_number,
+        "message": {
+            "message_id": job_number,
+            "date": int(time.time()),
+            # Отдельный чат на задание: по сообщениям в нём определяется исход задания
+            "chat": {"id": job_number, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"bench{user_id}"},
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1024, "height": 1024,
+                       "file_size": photo_size}],
+            "caption": f"Benchmark job {job_number}",
+        },
+    }
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _open_fds() -> int | None:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return None
+
+def _max_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS — байты
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+class _ResourceSampler:
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self._task = None
+
+    def _sample(self) -> None:
+        self.peak_rss = max(self.peak_rss, _rss_bytes() or 0)
+        self.peak_fds = max(self.peak_fds, _open_fds() or 0)
+
+    async def _run(self) -> None:
+        while True:
+            self._sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._sample()
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def _fetch_json(session: aiohttp.ClientSession, url: str) -> dict:
+    async with session.get(url) as response:
+        return await response.json()
+
+async def _run(args, urls: dict[str, str]) -> dict:
+    # Модули бота читают config при импорте, поэтому импортируются после подготовки окружения
+    from telegram import Bot as TelegramBot, Update
+    from bot import Bot
+    from key import TOKEN
+    from retry_util import retry_stats
+
+    bot = Bot()
+    telegram = TelegramBot(TOKEN, base_url=urls["telegram"] + "/bot", base_file_url=urls["telegram"] + "/file/bot")
+    await telegram.initialize()
+    bot.scheduler.start()
+
+    loop = asyncio.get_running_loop()
+    finished: dict[int, asyncio.Future] = {}
+    process_message = bot.process_message
+
+    async def tracked_process_message(update, job_id: str = None, resumed: bool = False) -> None:
+        try:
+            await process_message(update, job_id=job_id, resumed=resumed)
+        finally:
+            future = finished.get(update.update_id)
+            if future is not None and not future.done():
+                future.set_result(time.monotonic())
+
+    bot.process_message = tracked_process_message
+
+    jobs = []
+    numbers = iter(range(1, args.users * args.jobs_per_user + 1))
+
+    async def user(user_id: int) -> None:
+        for _ in range(args.jobs_per_user):
+            job_number = next(numbers)
+            update = Update.de_json(_update_json(job_number, user_id, args.photo_size), telegram)
+            finished[job_number] = loop.create_future()
+            started = time.monotonic()
+            await bot.handle_message(update, None)
+            job = {"job": job_number, "user": user_id}
+            try:
+                job["latency"] = round(await asyncio.wait_for(finished[job_number], args.job_timeout) - started, 3)
+            except asyncio.TimeoutError:
+                job["outcome"] = "timeout"
+            jobs.append(job)
+
+    sampler = _ResourceSampler()
+    sampler.start()
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+        wall = time.monotonic() - started
+    finally:
+        await sampler.stop()
+        await bot.scheduler.close()
+        await bot.jobs.close()
+        await bot.workspaces.close()
+        await bot.pika_status.close()
+        await bot.poller.close()
+        await bot.http_session.close()
+        for client in bot._openai_clients.values():
+            await client.close()
+        await telegram.shutdown()
+
+    async with aiohttp.ClientSession() as session:
+        providers = {name: await _fetch_json(session, f"{url}/stats") for name, url in urls.items()}
+        chats = await _fetch_json(session, f"{urls['telegram']}/chats")
+    for job in jobs:
+        if "outcome" not in job:
+            sent = chats.get(str(job["job"]), {})
+            job["outcome"] = "succeeded" if sent.get("sendVideo") else "failed"
+
+    latencies = [job["latency"] for job in jobs if "latency" in job]
+    succeeded = sum(1 for job in jobs if job["outcome"] == "succeeded")
+    return {
+        "commit": _commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(time.time() - wall)),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "workdir")},
+        "jobs": len(jobs),
+        "succeeded": succeeded,
+        "failed": sum(1 for job in jobs if job["outcome"] == "failed"),
+        "timed_out": sum(1 for job in jobs if job["outcome"] == "timeout"),
+        "wall_seconds": round(wall, 3),
+        "jobs_per_hour": round(succeeded / wall * 3600, 1) if wall else 0.0,
+        "latency_seconds": {
+            "p50": _percentile(latencies, 0.5),
+            "p95": _percentile(latencies, 0.95),
+            "p99": _percentile(latencies, 0.99),
+            "max": max(latencies, default=None),
+        },
+        "peak_rss_bytes": max(sampler.peak_rss, _max_rss_bytes() or 0) or None,
+        "peak_open_fds": sampler.peak_fds or None,
+        "providers": providers,
+        "bot": {
+            "scheduler": bot.scheduler.stats(),
+            "http": bot.http_session.stats(),
+            "retries": retry_stats(),
+            "tracing": bot.tracer.stats(),
+        },
+        "job_results": sorted(jobs, key=lambda job: job["job"]),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against local provider stand-ins")
+    parser.add_argument("--users", type=int, default=4, help="concurrent users")
+    parser.add_argument("--jobs-per-user", type=int, default=2)
+    parser.add_argument("--mode", choices=["serial", "pipelined", "parallel"], default=None,
+                        help="SCENE_EXECUTION_MODE (default: from the environment)")
+    parser.add_argument("--scenes", type=int, default=4, help="scenes in the stub scenario")
+    parser.add_argument("--genapi-latency", type=float, default=2.0)
+    parser.add_argument("--pika-latency", type=float, default=5.0)
+    parser.add_argument("--openai-latency", type=float, default=1.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--distribution", choices=["uniform", "lognormal", "exponential"], default="uniform")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of gen-api/Pika tasks that fail")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with HTTP 5xx")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--result-cache", action="store_true", help="keep the gpt-image-1/Flux result cache enabled")
+    parser.add_argument("--photo-size", type=int, default=256 * 1024)
+    parser.add_argument("--video-size", type=int, default=1024 * 1024)
+    parser.add_argument("--job-timeout", type=float, default=900)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--workdir", default=None, help="state directory (default: temporary, removed afterwards)")
+    parser.add_argument("--output", default=None, help="result JSON (default: .cache/benchmark/<commit>_<time>.json)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dresser-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    ports = {name: _free_port(args.host) for name in ("genapi", "pika", "openai", "telegram")}
+    urls = {name: f"http://{args.host}:{port}" for name, port in ports.items()}
+
+    ready = multiprocessing.Event()
+    fakes = multiprocessing.Process(target=_serve_fakes, args=(vars(args), ports, ready), daemon=True)
+    fakes.start()
+    try:
+        if not ready.wait(30):
+            raise Exception("Fake provider servers did not start")
+        os.environ.update(_environment(args, urls, workdir))
+        _seed_pika_tokens(os.environ["PIKA_TOKEN_CACHE_PATH"])
+        report = asyncio.run(_run(args, urls))
+    finally:
+        fakes.terminate()
+        fakes.join()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(".cache", "benchmark", f"{report['commit'][:12]}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    latency = report["latency_seconds"]
+    print(f"{report['succeeded']}/{report['jobs']} jobs succeeded in {report['wall_seconds']:.1f}s, "
+          f"{report['jobs_per_hour']} jobs/hour, p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s, "
+          f"peak RSS {(report['peak_rss_bytes'] or 0) / 1024 / 1024:.1f} MiB, peak FDs {report['peak_open_fds']}")
+    print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,5 @@
 import logging
 import asyncio
-import aiohttp
 import re
 import inspect
 from telegram import Update
@@ -9,25 +8,71 @@ from telegram.request import HTTPXRequest
 from telegram.error import TimedOut
 from telegram_wrapper import TelegramHandler
 from api_factory import APIFactory
+from http_session import shared_session
+from job_context import JobContext, new_job_id
+from genapi_poller import genapi_poller
+from callback_server import callback_receiver
+from pika_token_store import pika_token_store
+from pika_status import pika_status_aggregator
+from result_cache import result_cache
+from scenario_cache import scenario_cache
+from job_scheduler import SchedulerFull, job_scheduler
+from retry_util import call_with_retry, retry_stats
+from circuit_breaker import circuit_breakers
+from rate_limiter import rate_limiters
+from credential_pool import credential_pools
+from submission_ledger import submission_ledger
+from hedging import hedge_policies
+from job_store import JobCheckpoints, job_store
+from workspace import workspace_manager
+from metrics import metrics, metrics_server
+from tracing import tracer, digest
+from config import SCENE_EXECUTION_MODE, LOG_LEVEL, OPENAI_BASE_URL, TELEGRAM_FILE_URL
 from key import TOKEN, OPENAI_API_KEY
 from openai import AsyncOpenAI
 import base64
+import json
 import os
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.DEBUG
+    level=LOG_LEVEL,
+    # Модули клиентов API вызывают basicConfig при импорте раньше бота
+    force=True
 )
 logger = logging.getLogger(__name__)
 
 class Bot:
     def __init__(self):
         self.telegram_handler = TelegramHandler()
-        self.api_factory = APIFactory()
+        self.http_session = shared_session
+        self.poller = genapi_poller
+        self.callbacks = callback_receiver
+        self.token_store = pika_token_store
+        self.pika_status = pika_status_aggregator
+        self.result_cache = result_cache
+        self.scenario_cache = scenario_cache
+        self.scheduler = job_scheduler
+        self.circuits = circuit_breakers
+        self.limiters = rate_limiters
+        self.credentials = credential_pools
+        self.submissions = submission_ledger
+        self.hedging = hedge_policies
+        self.jobs = job_store
+        self.workspaces = workspace_manager
+        self.metrics = metrics
+        self.metrics_server = metrics_server
+        self.tracer = tracer
+        self.api_factory = APIFactory(http_session=self.http_session, poller=self.poller, callbacks=self.callbacks,
+                                      token_store=self.token_store, status_aggregator=self.pika_status,
+                                      result_cache=self.result_cache, limiters=self.limiters,
+                                      credentials=self.credentials, submissions=self.submissions,
+                                      hedging=self.hedging)
         self.openai_client = AsyncOpenAI(
             api_key=OPENAI_API_KEY,
-            base_url="https://api.openai.com/v1"
+            base_url=OPENAI_BASE_URL
         )
+        self._openai_clients = {OPENAI_API_KEY: self.openai_client}
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.debug("Получена команда /start")
@@ -35,106 +80,121 @@ class Bot:
             "Привет! Отправь одно или несколько фото с подписью."
         )
 
+    @metrics.track("handle_message", "telegram")
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.debug(f"Получено сообщение: photo={bool(update.message.photo)}, text={update.message.caption}")
         user_id = update.effective_user.id
+        # Задание записывается до постановки в очередь: после перезапуска продолжатся и ожидавшие задания
+        job_id = new_job_id()
+        stored = JobCheckpoints(self.jobs, job_id)
+        await stored.begin(user_id, update.to_json())
+        try:
+            position = self.scheduler.submit(user_id, lambda: self.process_message(update, job_id=job_id))
+        except SchedulerFull as e:
+            await stored.finish()
+            logger.warning(f"Задание пользователя {user_id} отклонено: {e}")
+            await update.message.reply_text("Сейчас слишком много заданий. Попробуйте отправить фото позже.")
+            return
+        if position:
+            await update.message.reply_text(f"Задание поставлено в очередь, позиция: {position}.")
+        logger.info(f"Задание пользователя {user_id} в очереди, позиция {position}, {self.scheduler.stats()}")
+
+    @metrics.track("job", "pipeline")
+    async def process_message(self, update: Update, job_id: str = None, resumed: bool = False) -> None:
+        user_id = update.effective_user.id
+        unavailable = self.circuits.unavailable(["gpt-image-1", "flux", "pika-generate", "pika-library"])
+        if unavailable:
+            # Провайдер заведомо недоступен — не занимаем слот на минуты ожидания таймаутов
+            logger.warning(f"Задание пользователя {user_id} отклонено, недоступны: {unavailable}")
+            # Пользователю сказано повторить позже: задание не должно ожить после перезапуска
+            if job_id is not None:
+                await JobCheckpoints(self.jobs, job_id).finish()
+            await update.message.reply_text("Сервис генерации временно недоступен. Попробуйте позже.")
+            return
         photos = update.message.photo
         user_query = update.message.caption or "Create a video based on these photos"
+        checkpoints = None
+        if resumed:
+            # Продолжение после перезапуска: пройденные этапы и отправленные задачи из хранилища
+            checkpoints = await self.jobs.checkpoints(job_id)
+            self.submissions.restore(job_id, await self.jobs.submissions(job_id))
+        job = JobContext(update, user_id, http_session=self.http_session, result_cache=self.result_cache,
+                         credentials=self.credentials, store=self.jobs, job_id=job_id, checkpoints=checkpoints,
+                         workspaces=self.workspaces, resumed=resumed)
+        trace = self.tracer.start(job.job_id, user_id=user_id, resumed=job.resumed)
 
+        interrupted = False
+        job_error = None
         try:
+            if job.resumed:
+                await update.message.reply_text("Бот был перезапущен, продолжаю обработку ваших фото...")
+            else:
+                # Задание из handle_message уже записано, повторная вставка игнорируется
+                await job.checkpoints.begin(user_id, update.to_json())
+            # Новое задание сначала освобождает место, вытесняя старые каталоги сверх квоты
+            await self.workspaces.enforce_quota()
             photo_groups = {photos[-1]} 
             unique_photos = [photos[-1]]
             logger.info(f"Найдено уникальных фотографий: {len(unique_photos)}")
 
+            scenario_key = self.scenario_cache.make_key(user_query, [photo.file_unique_id for photo in unique_photos])
+            scenario_checkpoint = job.checkpoints.get("scenario")
+            if scenario_checkpoint is not None:
+                cached_scenario = scenario_checkpoint["prompts"], scenario_checkpoint["num_scenes"]
+            else:
+                cached_scenario = await self.scenario_cache.get(scenario_key)
+
             photo_urls = []
             photo_base64_list = []
-            async with aiohttp.ClientSession() as session:
-                for i, photo in enumerate(unique_photos):
-                    logger.debug(f"Получение URL фото {i} для user_id={user_id}, file_unique_id={photo.file_unique_id}")
-                    file = await photo.get_file()
-                    file_path = re.sub(r'^https?://api\.telegram\.org/file/bot[^/]+/', '', file.file_path)
-                    file_path = file_path.lstrip('/')
-                    photo_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
-                    photo_urls.append(photo_url)
-                    logger.info(f"Фото {i} URL: {photo_url} (file_unique_id={photo.file_unique_id})")
-                    
-                    async with session.get(photo_url) as response:
-                        if response.status != 200:
-                            logger.error(f"Не удалось скачать фото {i}: {response.status}")
-                            await update.message.reply_text(
-                                f"Не удалось скачать фото {i} (ошибка {response.status}). Попробуйте другие фото."
-                            )
-                            return
-                        photo_data = await response.read()
-                        photo_base64 = base64.b64encode(photo_data).decode('utf-8')
-                        photo_base64_list.append(f"data:image/jpeg;base64,{photo_base64}")
-                        logger.info(f"Фото {i} успешно закодировано в base64")
-
-            async with aiohttp.ClientSession() as session:
-                for i, photo_url in enumerate(photo_urls):
-                    async with session.head(photo_url) as response:
-                        if response.status != 200:
-                            logger.error(f"Photo {i} URL inaccessible: {response.status}")
-                            await update.message.reply_text(
-                                f"Не удалось получить доступ к фото {i} (ошибка {response.status}). Попробуйте другие фото."
-                            )
-                            return
+            session = await self.http_session.get()
+            for i, photo in enumerate(unique_photos):
+                logger.debug(f"Получение URL фото {i} для user_id={user_id}, file_unique_id={photo.file_unique_id}")
+                file = await photo.get_file()
+                file_path = re.sub(rf'^{re.escape(TELEGRAM_FILE_URL)}[^/]+/', '', file.file_path)
+                file_path = file_path.lstrip('/')
+                photo_url = f"{TELEGRAM_FILE_URL}{TOKEN}/{file_path}"
+                photo_urls.append(photo_url)
+                logger.info(f"Фото {i} URL: {photo_url} (file_unique_id={photo.file_unique_id})")
+                # Фото хранится в артефактах задания: по его байтам считается ключ кэша результатов
+                try:
+                    artifact = await self._download_artifact(job, f"photo_{i}", photo_url)
+                except Exception as e:
+                    logger.error(f"Не удалось скачать фото {i}: {e}")
+                    await update.message.reply_text(
+                        f"Не удалось скачать фото {i}. Попробуйте другие фото."
+                    )
+                    return
+                if cached_scenario is not None:
+                    # base64 нужен только для запроса сценария к o3
+                    continue
+
+                photo_data = await job.artifacts.read(artifact.name)
+                photo_base64 = base64.b64encode(photo_data).decode('utf-8')
+                photo_base64_list.append(f"data:image/jpeg;base64,{photo_base64}")
+                logger.info(f"Фото {i} успешно закодировано в base64")
+
+            for i, photo_url in enumerate(photo_urls):
+                async with session.head(photo_url) as response:
+                    if response.status != 200:
+                        logger.error(f"Photo {i} URL inaccessible: {response.status}")
+                        await update.message.reply_text(
+                            f"Не удалось получить доступ к фото {i} (ошибка {response.status}). Попробуйте другие фото."
+                        )
+                        return
 
             await update.message.reply_text(f"Обрабатываю фото...")
 
             try:
-                response = await self.openai_client.chat.completions.create(
-                    model="o3",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Based on the user's request: '{user_query}', generate prompts for a 20-second video, divided into 1 to 4 distinct scenes (each 5 seconds if 4 scenes, adjust duration proportionally for fewer scenes). The number of scenes should be chosen to best fit a cohesive narrative based on the request and images. For each scene, create two prompts: one for a highly realistic still image and one for a dynamic video clip. Additionally, create a highly detailed prompt for a final still image (final frame). Image prompts should describe detailed, photorealistic scenes with consistent textures (e.g., wood grain, fabric details), lighting (e.g., soft natural light or dramatic shadows), colors (e.g., specific color palettes), and background across all scenes and the final frame unless explicitly requested otherwise. Video prompts should describe dynamic scenes with smooth motion, deliberate camera movement (e.g., pan, zoom, tracking), and immersive atmosphere, ensuring narrative continuity and consistent visual style. The final frame should be a photorealistic still image that logically concludes the narrative, emphasizing key elements from previous scenes (e.g., a significant object, character, or setting detail) with enhanced realism through detailed textures, lifelike lighting, and subtle imperfections (e.g., slight wear on objects, natural shadows). Ensure smooth transitions between scenes and a logical, visually compelling conclusion with the final frame to form a unified video without abrupt changes in style or setting. Format the response as:\n\nNumber of scenes: [number]\nScene 1 Image prompt: [prompt]\nScene 1 Video prompt: [prompt]\n[Repeat for each scene up to the chosen number]\nFinal Frame Image prompt: [prompt]\n\nExample:\nNumber of scenes: 3\nScene 1 Image prompt: A young woman in a flowing white dress with intricate lace patterns stands in a sunlit lavender field at golden hour, holding a vintage leather book with worn edges. Her hair gently blows in the breeze, and a rustic wooden fence in the background is partially covered with ivy, with soft sunlight casting delicate shadows on the ground.\nScene 1 Video prompt: A young woman in a white lace dress walks through a lavender field at sunset, the camera tracking her as she runs her hands over the flowers, with a vintage book tucked under her arm. The scene shifts to reveal a rustic fence with ivy, as golden light filters through the plants and a gentle breeze moves her hair.\nScene 2 Image prompt: The same woman sits on a weathered wooden bench in the lavender field, reading the vintage book, with soft sunlight filtering through her hair and casting intricate shadows from the ivy-covered fence in the background.\nScene 2 Video prompt: The camera pans around the woman sitting on a bench in the lavender field, reading her book, as a gentle breeze rustles the pages and lavender plants sway in the background, with golden light enhancing the scene’s warmth.\nScene 3 Image prompt: The woman closes the book and looks toward the horizon, with the lavender field stretching into the distance under a golden sky, the fence faintly visible in the background.\nScene 3 Video prompt: The camera follows the woman’s gaze as she closes her book and looks toward the horizon, zooming out to show the expansive lavender field under a golden sunset, with subtle movements of lavender in the breeze.\nFinal Frame Image prompt: ..."
-                                },
-                                *[
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": photo_base64
-                                        }
-                                    }
-                                    for photo_base64 in photo_base64_list
-                                ]
-                            ]
-                        }
-                    ]
-                )
-                scenario = response.choices[0].message.content.strip()
-                logger.debug(f"OpenAI o1 response: {scenario}")
-                
-                prompts = {}
-                lines = [line.strip() for line in scenario.split('\n') if line.strip()]
-                num_scenes = 4  
-                for line in lines:
-                    if line.startswith("Number of scenes:"):
-                        num_scenes = min(int(line.split(":")[1].strip()), 4)
-                        logger.info(f"Model selected {num_scenes} scenes")
-                    for scene in range(1, 5):
-                        if line.startswith(f"Scene {scene} Image prompt:"):
-                            prompts[f"scene_{scene}_image"] = line[len(f"Scene {scene} Image prompt:"):].strip()
-                        elif line.startswith(f"Scene {scene} Video prompt:"):
-                            prompts[f"scene_{scene}_video"] = line[len(f"Scene {scene} Video prompt:"):].strip()
-                    if line.startswith("Final Frame Image prompt:"):
-                        prompts["final_frame_image"] = line[len("Final Frame Image prompt:"):].strip()
-                
-                for scene in range(1, num_scenes + 1):
-                    if f"scene_{scene}_image" not in prompts or f"scene_{scene}_video" not in prompts:
-                        logger.warning(f"Missing prompt for scene {scene}. Using fallback.")
-                        prompts[f"scene_{scene}_image"] = f"A detailed realistic scene {scene} inspired by: {user_query}, maintaining consistent background and style"
-                        prompts[f"scene_{scene}_video"] = f"A dynamic video scene {scene} inspired by: {user_query}, maintaining consistent background and style"
-                if "final_frame_image" not in prompts:
-                    logger.warning("Missing final frame prompt. Using fallback.")
-                    prompts["final_frame_image"] = f"A concluding realistic image inspired by: {user_query}, maintaining consistent background and style"
-                logger.info(f"Generated prompts: {prompts}")
+                if cached_scenario is not None:
+                    prompts, num_scenes = cached_scenario
+                    logger.info(f"Сценарий взят из кэша: {num_scenes} сцен")
+                else:
+                    prompts, num_scenes = await self._request_scenario(job, user_query, photo_base64_list)
+                    await self.scenario_cache.put(scenario_key, prompts, num_scenes)
+                logger.info(f"Generated {len(prompts)} prompts for {num_scenes} scenes")
             except Exception as e:
                 logger.error(f"Ошибка генерации промптов: {e}")
+                job.credentials.report("openai", e)
                 await update.message.reply_text(f"Ошибка генерации промптов: {e}. Использую запасные промпты.")
                 num_scenes = 4  
                 prompts = {}
@@ -142,232 +202,54 @@ class Bot:
                     prompts[f"scene_{scene}_image"] = f"A detailed realistic scene {scene} inspired by: {user_query}, maintaining consistent background and style"
                     prompts[f"scene_{scene}_video"] = f"A dynamic video scene {scene} inspired by: {user_query}, maintaining consistent background and style"
                 prompts["final_frame_image"] = f"A concluding realistic image inspired by: {user_query}, maintaining consistent background and style"
-                logger.info(f"Fallback prompts generated: {prompts}")
-
-            os.makedirs("temp", exist_ok=True)
-
-            previous_enhanced_url = None
-            for scene in range(1, num_scenes + 1):
-                image_prompt = prompts[f"scene_{scene}_image"]
-                await update.message.reply_text(f"Обрабатываю сцену {scene}...")
-
-                generated_image_url = None
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        logger.debug(f"Вызов gpt-image-1 API для сцены {scene}, попытка {attempt + 1}/{max_retries}")
-                        gpt_image_api = self.api_factory.get_api("gpt_image")
-                        image_urls = photo_urls + ([previous_enhanced_url] if previous_enhanced_url else [])
-                        generated_image_url = await gpt_image_api.send_request(
-                            prompt=f"{image_prompt}, maintain consistent background, lighting, and style across all scenes unless explicitly requested otherwise",
-                            image_urls=image_urls,
-                            params={
-                                "size": "1024x1536",
-                                "quality": "high",
-                                "output_format": "png",
-                                "is_sync": False,
-                                "moderation": "auto",
-                                "n": 1
-                            }
-                        )
-                        logger.info(f"Сцена {scene} изображение сгенерировано: {generated_image_url}")
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(generated_image_url) as response:
-                                if response.status != 200:
-                                    raise Exception(f"Failed to download generated image for scene {scene}: {response.status}")
-                                temp_image_path = f"temp/generated_{user_id}_scene_{scene}.png"
-                                with open(temp_image_path, "wb") as f:
-                                    content = await response.read()
-                                    if not content:
-                                        raise ValueError(f"Empty content downloaded for scene {scene}")
-                                    f.write(content)
-                                if not os.path.exists(temp_image_path) or os.path.getsize(temp_image_path) == 0:
-                                    raise FileNotFoundError(f"Generated image file for scene {scene} is missing or empty: {temp_image_path}")
-                        await update.message.reply_photo(
-                            open(temp_image_path, "rb"),
-                            caption=f"Сгенерированное изображение для сцены {scene}"
-                        )
-                        break
-                    except Exception as e:
-                        logger.error(f"Ошибка генерации изображения для сцены {scene}, попытка {attempt + 1}: {e}")
-                        if attempt < max_retries - 1:
-                            await asyncio.sleep(2 ** attempt)
-                            continue
-                        logger.error(f"Не удалось сгенерировать изображение для сцены {scene} после {max_retries} попыток")
-                        await update.message.reply_text(
-                            f"Не удалось сгенерировать изображение для сцены {scene}: {e}. Продолжаю с следующей сценой."
-                        )
-                        break
+                logger.info(f"Fallback prompts generated for {num_scenes} scenes")
+            if scenario_checkpoint is None:
+                await job.checkpoints.save("scenario", {"prompts": prompts, "num_scenes": num_scenes})
 
-                if not generated_image_url:
-                    continue
-
-                try:
-                    logger.debug(f"Вызов Flux API для сцены {scene}")
-                    flux_api = self.api_factory.get_api("flux")
-                    enhanced_image_url = await flux_api.send_request(
-                        prompt=f"Enhance the realism of this image, preserving all background elements, non-clothing details, and textures exactly as they are, maintaining consistent style, lighting, and colors across all scenes",
-                        image_url=generated_image_url,
-                        params={
-                            "width": 1024,
-                            "height": 1536,
-                            "model": "ultra",
-                            "num_inference_steps": 36,
-                            "guidance_scale": 7.5,
-                            "strength": 0.3,
-                            "is_sync": False,
-                            "preserve_background": True
-                        }
-                    )
-                    logger.info(f"Сцена {scene} изображение улучшено: {enhanced_image_url}")
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(enhanced_image_url) as response:
-                            if response.status != 200:
-                                raise Exception(f"Failed to download enhanced image for scene {scene}: {response.status}")
-                            temp_enhanced_path = f"temp/enhanced_{user_id}_scene_{scene}.png"
-                            with open(temp_enhanced_path, "wb") as f:
-                                content = await response.read()
-                                if not content:
-                                    raise ValueError(f"Empty content downloaded for enhanced scene {scene}")
-                                f.write(content)
-                            # Verify file exists and is not empty
-                            if not os.path.exists(temp_enhanced_path) or os.path.getsize(temp_enhanced_path) == 0:
-                                raise FileNotFoundError(f"Enhanced image file for scene {scene} is missing or empty: {temp_enhanced_path}")
-                    await update.message.reply_photo(
-                        open(temp_enhanced_path, "rb"),
-                        caption=f"Улучшенное изображение для сцены {scene}"
-                    )
-                    previous_enhanced_url = enhanced_image_url
-                except Exception as e:
-                    logger.error(f"Ошибка улучшения изображения для сцены {scene}: {e}")
-                    await update.message.reply_text(
-                        f"Ошибка улучшения изображения для сцены {scene}: {e}. Продолжаю с следующей сценой."
-                    )
-                    continue
-
-            await update.message.reply_text("Обрабатываю завершающий кадр...")
-            final_image_prompt = prompts["final_frame_image"]
-            generated_image_url = None
-            for attempt in range(max_retries):
-                try:
-                    logger.debug(f"Вызов gpt-image-1 API для завершающего кадра, попытка {attempt + 1}/{max_retries}")
-                    gpt_image_api = self.api_factory.get_api("gpt_image")
-                    image_urls = photo_urls + ([previous_enhanced_url] if previous_enhanced_url else [])
-                    generated_image_url = await gpt_image_api.send_request(
-                        prompt=f"{final_image_prompt}, maintain consistent background, lighting, and style with previous scenes",
-                        image_urls=image_urls,
-                        params={
-                            "size": "1024x1536",
-                            "quality": "high",
-                            "output_format": "png",
-                            "is_sync": False,
-                            "moderation": "auto",
-                            "n": 1
-                        }
-                    )
-                    logger.info(f"Завершающий кадр сгенерирован: {generated_image_url}")
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(generated_image_url) as response:
-                            if response.status != 200:
-                                raise Exception(f"Failed to download generated final frame: {response.status}")
-                            temp_image_path = f"temp/generated_{user_id}_final_frame.png"
-                            with open(temp_image_path, "wb") as f:
-                                content = await response.read()
-                                if not content:
-                                    raise ValueError(f"Empty content downloaded for final frame")
-                                f.write(content)
-                            # Verify file exists and is not empty
-                            if not os.path.exists(temp_image_path) or os.path.getsize(temp_image_path) == 0:
-                                raise FileNotFoundError(f"Generated final frame file is missing or empty: {temp_image_path}")
-                    await update.message.reply_photo(
-                        open(temp_image_path, "rb"),
-                        caption="Сгенерированное изображение для завершающего кадра"
-                    )
-                    break
-                except Exception as e:
-                    logger.error(f"Ошибка генерации завершающего кадра, попытка {attempt + 1}: {e}")
-                    if attempt < max_retries - 1:
-                        await asyncio.sleep(2 ** attempt)
-                        continue
-                    logger.error(f"Не удалось сгенерировать завершающий кадр после {max_retries} попыток")
-                    await update.message.reply_text(
-                        f"Не удалось сгенерировать завершающий кадр: {e}."
-                    )
-                    break
-
-            if generated_image_url:
-                try:
-                    logger.debug("Вызов Flux API для завершающего кадра")
-                    flux_api = self.api_factory.get_api("flux")
-                    enhanced_image_url = await flux_api.send_request(
-                        prompt=f"Enhance the realism of this image, preserving all background elements, non-clothing details, and textures exactly as they are, maintaining consistent style, lighting, and colors with previous scenes",
-                        image_url=generated_image_url,
-                        params={
-                            "width": 1024,
-                            "height": 1536,
-                            "model": "ultra",
-                            "num_inference_steps": 36,
-                            "guidance_scale": 7.5,
-                            "strength": 0.3,
-                            "is_sync": False,
-                            "preserve_background": True
-                        }
-                    )
-                    logger.info(f"Завершающий кадр улучшен: {enhanced_image_url}")
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(enhanced_image_url) as response:
-                            if response.status != 200:
-                                raise Exception(f"Failed to download enhanced final frame: {response.status}")
-                            temp_enhanced_path = f"temp/enhanced_{user_id}_final_frame.png"
-                            with open(temp_enhanced_path, "wb") as f:
-                                content = await response.read()
-                                if not content:
-                                    raise ValueError(f"Empty content downloaded for enhanced final frame")
-                                f.write(content)
-                            # Verify file exists and is not empty
-                            if not os.path.exists(temp_enhanced_path) or os.path.getsize(temp_enhanced_path) == 0:
-                                raise FileNotFoundError(f"Enhanced final frame file is missing or empty: {temp_enhanced_path}")
-                    await update.message.reply_photo(
-                        open(temp_enhanced_path, "rb"),
-                        caption="Улучшенное изображение для завершающего кадра"
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка улучшения завершающего кадра: {e}")
-                    await update.message.reply_text(
-                        f"Ошибка улучшения завершающего кадра: {e}."
-                    )
+            mode = SCENE_EXECUTION_MODE
+            started_at = asyncio.get_running_loop().time()
+            with self.tracer.span("scenes", mode=mode, num_scenes=num_scenes):
+                if mode == "parallel":
+                    enhanced_urls = await self._run_scenes_parallel(job, prompts, num_scenes, photo_urls)
+                elif mode == "pipelined":
+                    enhanced_urls = await self._run_scenes_pipelined(job, prompts, num_scenes, photo_urls)
+                else:
+                    mode = "serial"
+                    enhanced_urls = await self._run_scenes_serial(job, prompts, num_scenes, photo_urls)
+            elapsed = asyncio.get_running_loop().time() - started_at
+            logger.info(f"Сцены обработаны в режиме {mode} за {elapsed:.1f} с: {enhanced_urls}")
+            await update.message.reply_text(
+                f"Изображения готовы (режим: {mode}, {elapsed:.0f} с)."
+            )
 
             await update.message.reply_text("Генерирую видео...")
             logger.debug("Вызов Pika API для генерации видео")
-            pika_api = self.api_factory.get_api("pika")
+            pika_api = await self.api_factory.get_api("pika", job=job)
             
-            # Prepare image paths and prompts
-            image_paths = []
+            # Изображения для видео берутся из памяти задания в порядке сцен
+            image_content = []
             frame_prompts = []
             for scene in range(1, num_scenes + 1):
-                enhanced_path = f"temp/enhanced_{user_id}_scene_{scene}.png"
-                if os.path.exists(enhanced_path) and os.path.getsize(enhanced_path) > 0:
-                    image_paths.append(enhanced_path)
+                if job.artifacts.get(f"enhanced_scene_{scene}"):
+                    image_content.append(await job.artifacts.read(f"enhanced_scene_{scene}"))
                     frame_prompts.append(prompts.get(f"scene_{scene}_video", user_query))
                 else:
-                    logger.warning(f"Enhanced image for scene {scene} not found or empty at {enhanced_path}")
-            
-            final_frame_path = f"temp/enhanced_{user_id}_final_frame.png"
-            if os.path.exists(final_frame_path) and os.path.getsize(final_frame_path) > 0:
-                image_paths.append(final_frame_path)
+                    logger.warning(f"Enhanced image for scene {scene} is missing")
+
+            if job.artifacts.get("enhanced_final_frame"):
+                image_content.append(await job.artifacts.read("enhanced_final_frame"))
             else:
-                logger.warning(f"Final frame image not found or empty at {final_frame_path}")
-            
+                logger.warning("Final frame image is missing")
+
             # Validate inputs
-            if len(image_paths) < 2:
-                logger.error(f"Недостаточно изображений для генерации видео: found {len(image_paths)} images")
+            if len(image_content) < 2:
+                logger.error(f"Недостаточно изображений для генерации видео: found {len(image_content)} images")
                 await update.message.reply_text("Недостаточно изображений для генерации видео. Требуется хотя бы два изображения.")
-                self.telegram_handler.cleanup_temp_files(user_id)
                 return
 
             # Align parameters with testpika.py
             total_duration = num_scenes*5
-            num_transitions = len(image_paths) - 1
+            num_transitions = len(image_content) - 1
             frame_durations = [total_duration // num_transitions] * num_transitions
 
             pika_params = {
@@ -389,67 +271,341 @@ class Bot:
                 }
             }
             
-            logger.debug(f"Calling PikaAPI.send_request with image_paths={image_paths}, prompt={user_query}, params={pika_params}")
+            logger.debug(f"Calling PikaAPI.send_request with {len(image_content)} images")
+            self.tracer.annotate(video_params=digest(pika_params))
             video_path = None
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    # Ensure files are accessible
-                    for path in image_paths:
-                        if not os.path.exists(path):
-                            raise FileNotFoundError(f"Image file not found: {path}")
-                        with open(path, "rb") as f:
-                            content = f.read()
-                            if not content:
-                                raise ValueError(f"Image file is empty: {path}")
-                    
-                    # Run synchronous PikaAPI.send_request in a thread
-                    video_path = await asyncio.to_thread(
-                        pika_api.send_request,
-                        image_paths=image_paths,
-                        prompt=user_query,
-                        params=pika_params,
-                        output_path=f"temp/final_video_{user_id}.mp4"
+            try:
+                # Повторы генерации выполняет политика retry_util внутри PikaAPI
+                video_path = await pika_api.send_request(
+                    image_content=image_content,
+                    prompt=user_query,
+                    params=pika_params,
+                    output_path=job.workspace.file("final_video.mp4"),
+                    submission_key=(job.job_id, "video")
+                )
+                logger.info(f"Видео сгенерировано: {video_path}")
+                job.credentials.report("pika")
+
+                # Verify the video file exists
+                if not video_path or not isinstance(video_path, str) or not os.path.exists(video_path) or os.path.getsize(video_path) == 0:
+                    raise ValueError(f"Invalid or empty video path returned: {video_path}")
+
+                # Send the video to the user
+                with open(video_path, "rb") as video_file, self.metrics.timer("telegram_upload", "telegram"):
+                    await update.message.reply_video(
+                        video_file,
+                        caption="Сгенерированное видео на основе ваших фото и запроса!"
                     )
-                    logger.info(f"Видео сгенерировано на попытке {attempt + 1}: {video_path}")
-                    
-                    # Verify the video file exists
-                    if not video_path or not isinstance(video_path, str) or not os.path.exists(video_path) or os.path.getsize(video_path) == 0:
-                        raise ValueError(f"Invalid or empty video path returned: {video_path}")
-                    
-                    # Send the video to the user
-                    with open(video_path, "rb") as video_file:
-                        await update.message.reply_video(
-                            video_file,
-                            caption="Сгенерированное видео на основе ваших фото и запроса!"
-                        )
-                    break
-                except Exception as e:
-                    logger.error(f"Ошибка генерации видео на попытке {attempt + 1}/{max_retries}: {e}", exc_info=True)
-                    if attempt < max_retries - 1:
-                        logger.info(f"Повторная попытка через {2 ** attempt} секунд...")
-                        await asyncio.sleep(2 ** attempt)
-                    else:
-                        logger.error(f"Не удалось сгенерировать видео после {max_retries} попыток")
-                        await update.message.reply_text(f"Не удалось сгенерировать видео: {e}")
-                        break
-                finally:
-                    await asyncio.sleep(3)
-                    logger.debug(f"Очистка временных файлов для user_id={user_id}")
-                    for retry in range(2):
-                        try:
-                            self.telegram_handler.cleanup_temp_files(user_id)
-                            break
-                        except PermissionError as e:
-                            logger.warning(f"Не удалось удалить файлы на попытке {retry + 1}: {e}")
-                            await asyncio.sleep(5)
-                        except Exception as e:
-                            logger.error(f"Ошибка очистки: {e}")
-                            break
+                self.metrics.inc("bot_bytes_total", os.path.getsize(video_path), direction="upload", target="telegram")
+            except Exception as e:
+                logger.error(f"Ошибка генерации видео: {e}", exc_info=True)
+                self.tracer.fail(e)
+                job.credentials.report("pika", e)
+                await update.message.reply_text(f"Не удалось сгенерировать видео: {e}")
 
+        except asyncio.CancelledError as e:
+            # Бот останавливается: задание продолжится после перезапуска с последнего этапа
+            interrupted = True
+            job_error = e
+            raise
         except Exception as e:
+            job_error = e
             logger.error(f"Ошибка обработки: {e}", exc_info=True)
             await update.message.reply_text(f"Произошла ошибка: {e}")
+        finally:
+            self.tracer.finish(trace, job_error)
+            if not interrupted:
+                await job.checkpoints.finish()
+            job.credentials.release()
+            self.submissions.forget_job(job.job_id)
+            await job.artifacts.close()
+            # Каталог задания удаляется в фоне, не задерживая освобождение слота
+            self.workspaces.release(job.workspace)
+            logger.info(f"Статистика HTTP-соединений: {self.http_session.stats()}")
+            logger.info(f"Статистика кэша результатов: {self.result_cache.stats()}")
+            logger.info(f"Статистика кэша сценариев: {self.scenario_cache.stats()}")
+            logger.info(f"Статистика повторов: {retry_stats()}")
+            logger.info(f"Отправленные задачи: {self.submissions.stats()}")
+            logger.info(f"Хеджирование запросов: {self.hedging.stats()}")
+            logger.info(f"Состояние предохранителей: {self.circuits.states()}")
+            logger.info(f"Ожидание ограничителей запросов: {self.limiters.stats()}")
+            logger.info(f"Пулы учётных данных: {self.credentials.stats()}")
+            logger.info(f"Рабочие каталоги: {self.workspaces.stats()}")
+            logger.info(f"Ожидание в очереди пользователя {user_id}: {self.scheduler.wait_stats().get(user_id)}")
+
+    def _openai_client(self, api_key: str) -> AsyncOpenAI:
+        client = self._openai_clients.get(api_key)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, base_url=OPENAI_BASE_URL)
+            self._openai_clients[api_key] = client
+        return client
+
+    @metrics.track("scenario", "openai")
+    async def _request_scenario(self, job: JobContext, user_query: str,
+                                photo_base64_list: list[str]) -> tuple[dict, int]:
+        credential = await job.credentials.lease("openai")
+        async with self.limiters.limit("openai", credential.secret):
+            response = await self._openai_client(credential.secret).chat.completions.create(
+                model="o3",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": f"Based on the user's request: '{user_query}', generate prompts for a 20-second video, divided into 1 to 4 distinct scenes (each 5 seconds if 4 scenes, adjust duration proportionally for fewer scenes). The number of scenes should be chosen to best fit a cohesive narrative based on the request and images. For each scene, create two prompts: one for a highly realistic still image and one for a dynamic video clip. Additionally, create a highly detailed prompt for a final still image (final frame). Image prompts should describe detailed, photorealistic scenes with consistent textures (e.g., wood grain, fabric details), lighting (e.g., soft natural light or dramatic shadows), colors (e.g., specific color palettes), and background across all scenes and the final frame unless explicitly requested otherwise. Video prompts should describe dynamic scenes with smooth motion, deliberate camera movement (e.g., pan, zoom, tracking), and immersive atmosphere, ensuring narrative continuity and consistent visual style. The final frame should be a photorealistic still image that logically concludes the narrative, emphasizing key elements from previous scenes (e.g., a significant object, character, or setting detail) with enhanced realism through detailed textures, lifelike lighting, and subtle imperfections (e.g., slight wear on objects, natural shadows). Ensure smooth transitions between scenes and a logical, visually compelling conclusion with the final frame to form a unified video without abrupt changes in style or setting. Format the response as:\n\nNumber of scenes: [number]\nScene 1 Image prompt: [prompt]\nScene 1 Video prompt: [prompt]\n[Repeat for each scene up to the chosen number]\nFinal Frame Image prompt: [prompt]\n\nExample:\nNumber of scenes: 3\nScene 1 Image prompt: A young woman in a flowing white dress with intricate lace patterns stands in a sunlit lavender field at golden hour, holding a vintage leather book with worn edges. Her hair gently blows in the breeze, and a rustic wooden fence in the background is partially covered with ivy, with soft sunlight casting delicate shadows on the ground.\nScene 1 Video prompt: A young woman in a white lace dress walks through a lavender field at sunset, the camera tracking her as she runs her hands over the flowers, with a vintage book tucked under her arm. The scene shifts to reveal a rustic fence with ivy, as golden light filters through the plants and a gentle breeze moves her hair.\nScene 2 Image prompt: The same woman sits on a weathered wooden bench in the lavender field, reading the vintage book, with soft sunlight filtering through her hair and casting intricate shadows from the ivy-covered fence in the background.\nScene 2 Video prompt: The camera pans around the woman sitting on a bench in the lavender field, reading her book, as a gentle breeze rustles the pages and lavender plants sway in the background, with golden light enhancing the scene’s warmth.\nScene 3 Image prompt: The woman closes the book and looks toward the horizon, with the lavender field stretching into the distance under a golden sky, the fence faintly visible in the background.\nScene 3 Video prompt: The camera follows the woman’s gaze as she closes her book and looks toward the horizon, zooming out to show the expansive lavender field under a golden sunset, with subtle movements of lavender in the breeze.\nFinal Frame Image prompt: ..."
+                            },
+                            *[
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": photo_base64
+                                    }
+                                }
+                                for photo_base64 in photo_base64_list
+                            ]
+                        ]
+                    }
+                ]
+            )
+        scenario = response.choices[0].message.content.strip()
+        self.tracer.annotate(response=digest(scenario))
+
+        prompts = {}
+        lines = [line.strip() for line in scenario.split('\n') if line.strip()]
+        num_scenes = 4  
+        for line in lines:
+            if line.startswith("Number of scenes:"):
+                num_scenes = min(int(line.split(":")[1].strip()), 4)
+                logger.info(f"Model selected {num_scenes} scenes")
+            for scene in range(1, 5):
+                if line.startswith(f"Scene {scene} Image prompt:"):
+                    prompts[f"scene_{scene}_image"] = line[len(f"Scene {scene} Image prompt:"):].strip()
+                elif line.startswith(f"Scene {scene} Video prompt:"):
+                    prompts[f"scene_{scene}_video"] = line[len(f"Scene {scene} Video prompt:"):].strip()
+            if line.startswith("Final Frame Image prompt:"):
+                prompts["final_frame_image"] = line[len("Final Frame Image prompt:"):].strip()
+
+        for scene in range(1, num_scenes + 1):
+            if f"scene_{scene}_image" not in prompts or f"scene_{scene}_video" not in prompts:
+                logger.warning(f"Missing prompt for scene {scene}. Using fallback.")
+                prompts[f"scene_{scene}_image"] = f"A detailed realistic scene {scene} inspired by: {user_query}, maintaining consistent background and style"
+                prompts[f"scene_{scene}_video"] = f"A dynamic video scene {scene} inspired by: {user_query}, maintaining consistent background and style"
+        if "final_frame_image" not in prompts:
+            logger.warning("Missing final frame prompt. Using fallback.")
+            prompts["final_frame_image"] = f"A concluding realistic image inspired by: {user_query}, maintaining consistent background and style"
+        return prompts, num_scenes
+
+    def _frame_names(self, scene: int | None) -> tuple[str, str]:
+        if scene is None:
+            return "final_frame", "завершающего кадра"
+        return f"scene_{scene}", f"сцены {scene}"
+
+    async def _generate_frame(self, job: JobContext, scene: int | None,
+                              prompt: str, image_urls: list[str]) -> str | None:
+        frame, label = self._frame_names(scene)
+        if scene is None:
+            prompt = f"{prompt}, maintain consistent background, lighting, and style with previous scenes"
+        else:
+            prompt = f"{prompt}, maintain consistent background, lighting, and style across all scenes unless explicitly requested otherwise"
+
+        generated_image_url = job.checkpoints.get(f"generated_{frame}")
+        if generated_image_url:
+            logger.info(f"Изображение для {label} восстановлено из контрольной точки: {generated_image_url}")
+            return generated_image_url
+
+        with self.tracer.span("generate_frame", frame=frame):
+            try:
+                logger.debug(f"Вызов gpt-image-1 API для {label}")
+                gpt_image_api = await self.api_factory.get_api("gpt_image", job=job)
+                generated_image_url = await gpt_image_api.send_request(
+                    prompt=prompt,
+                    image_urls=image_urls,
+                    params={
+                        "size": "1024x1536",
+                        "quality": "high",
+                        "output_format": "png",
+                        "is_sync": False,
+                        "moderation": "auto",
+                        "n": 1
+                    },
+                    submission_key=(job.job_id, f"generated_{frame}")
+                )
+                logger.info(f"Изображение для {label} сгенерировано: {generated_image_url}")
+                await job.checkpoints.save(f"generated_{frame}", generated_image_url)
+                artifact = await self._download_artifact(job, f"generated_{frame}", generated_image_url)
+                await self._send_photo(job, artifact.name, f"Сгенерированное изображение для {label}")
+                return generated_image_url
+            except Exception as e:
+                logger.error(f"Не удалось сгенерировать изображение для {label}: {e}")
+                self.tracer.fail(e)
+                job.credentials.report("genapi", e)
+                await job.update.message.reply_text(
+                    f"Не удалось сгенерировать изображение для {label}: {e}."
+                )
+        return None
+
+    async def _download_artifact(self, job: JobContext, name: str, url: str):
+        # Результат уже оплачен у провайдера: сбой скачивания не должен терять сцену
+        return await call_with_retry(lambda: job.artifacts.download(name, url), "download")
+
+    async def _send_photo(self, job: JobContext, artifact_name: str, caption: str) -> None:
+        photo = await job.artifacts.read(artifact_name)
+        with self.metrics.timer("telegram_upload", "telegram"):
+            await call_with_retry(lambda: job.update.message.reply_photo(photo, caption=caption), "telegram")
+        self.metrics.inc("bot_bytes_total", len(photo), direction="upload", target="telegram")
+
+    async def _enhance_frame(self, job: JobContext, scene: int | None,
+                             generated_image_url: str) -> str | None:
+        frame, label = self._frame_names(scene)
+        consistency = "with previous scenes" if scene is None else "across all scenes"
+        with self.tracer.span("enhance_frame", frame=frame):
+            try:
+                enhanced_image_url = job.checkpoints.get(f"enhanced_{frame}")
+                if enhanced_image_url:
+                    # Для видео нужно само изображение, поэтому скачиваем его заново
+                    logger.info(f"Изображение для {label} восстановлено из контрольной точки: {enhanced_image_url}")
+                    await self._download_artifact(job, f"enhanced_{frame}", enhanced_image_url)
+                    return enhanced_image_url
+
+                logger.debug(f"Вызов Flux API для {label}")
+                flux_api = await self.api_factory.get_api("flux", job=job)
+                enhanced_image_url = await flux_api.send_request(
+                    prompt=f"Enhance the realism of this image, preserving all background elements, non-clothing details, and textures exactly as they are, maintaining consistent style, lighting, and colors {consistency}",
+                    image_url=generated_image_url,
+                    params={
+                        "width": 1024,
+                        "height": 1536,
+                        "model": "ultra",
+                        "num_inference_steps": 36,
+                        "guidance_scale": 7.5,
+                        "strength": 0.3,
+                        "is_sync": False,
+                        "preserve_background": True
+                    },
+                    submission_key=(job.job_id, f"enhanced_{frame}")
+                )
+                logger.info(f"Изображение для {label} улучшено: {enhanced_image_url}")
+                await job.checkpoints.save(f"enhanced_{frame}", enhanced_image_url)
+                artifact = await self._download_artifact(job, f"enhanced_{frame}", enhanced_image_url)
+                await self._send_photo(job, artifact.name, f"Улучшенное изображение для {label}")
+                return enhanced_image_url
+            except Exception as e:
+                logger.error(f"Ошибка улучшения изображения для {label}: {e}")
+                self.tracer.fail(e)
+                job.credentials.report("genapi", e)
+                await job.update.message.reply_text(
+                    f"Ошибка улучшения изображения для {label}: {e}."
+                )
+                return None
+
+    async def _process_frame(self, job: JobContext, scene: int | None,
+                             prompt: str, image_urls: list[str]) -> str | None:
+        generated_image_url = await self._generate_frame(job, scene, prompt, image_urls)
+        if not generated_image_url:
+            return None
+        return await self._enhance_frame(job, scene, generated_image_url)
+
+    async def _run_scenes_serial(self, job: JobContext, prompts: dict,
+                                 num_scenes: int, photo_urls: list[str]) -> dict:
+        # Каждая сцена опирается на улучшенное изображение предыдущей
+        enhanced_urls = {}
+        previous_enhanced_url = None
+        for scene in range(1, num_scenes + 1):
+            await job.update.message.reply_text(f"Обрабатываю сцену {scene}...")
+            image_urls = photo_urls + ([previous_enhanced_url] if previous_enhanced_url else [])
+            enhanced_urls[scene] = await self._process_frame(
+                job, scene, prompts[f"scene_{scene}_image"], image_urls
+            )
+            previous_enhanced_url = enhanced_urls[scene] or previous_enhanced_url
+
+        await job.update.message.reply_text("Обрабатываю завершающий кадр...")
+        image_urls = photo_urls + ([previous_enhanced_url] if previous_enhanced_url else [])
+        enhanced_urls[None] = await self._process_frame(
+            job, None, prompts["final_frame_image"], image_urls
+        )
+        return enhanced_urls
+
+    async def _run_scenes_pipelined(self, job: JobContext, prompts: dict,
+                                    num_scenes: int, photo_urls: list[str]) -> dict:
+        # Генерация следующей сцены опирается на сгенерированное (не улучшенное) изображение
+        # предыдущей, поэтому Flux для сцены k выполняется в фоне, пока генерируется сцена k+1
+        enhance_tasks = {}
+        previous_generated_url = None
+        async with asyncio.TaskGroup() as tg:
+            for scene in range(1, num_scenes + 1):
+                await job.update.message.reply_text(f"Обрабатываю сцену {scene}...")
+                image_urls = photo_urls + ([previous_generated_url] if previous_generated_url else [])
+                generated_image_url = await self._generate_frame(
+                    job, scene, prompts[f"scene_{scene}_image"], image_urls
+                )
+                if not generated_image_url:
+                    continue
+                enhance_tasks[scene] = tg.create_task(
+                    self._enhance_frame(job, scene, generated_image_url)
+                )
+                previous_generated_url = generated_image_url
+
+            await job.update.message.reply_text("Обрабатываю завершающий кадр...")
+            image_urls = photo_urls + ([previous_generated_url] if previous_generated_url else [])
+            generated_image_url = await self._generate_frame(
+                job, None, prompts["final_frame_image"], image_urls
+            )
+            if generated_image_url:
+                enhance_tasks[None] = tg.create_task(
+                    self._enhance_frame(job, None, generated_image_url)
+                )
+
+        enhanced_urls = {scene: None for scene in range(1, num_scenes + 1)}
+        enhanced_urls[None] = None
+        for scene, task in enhance_tasks.items():
+            enhanced_urls[scene] = task.result()
+        return enhanced_urls
+
+    async def _run_scenes_parallel(self, job: JobContext, prompts: dict,
+                                   num_scenes: int, photo_urls: list[str]) -> dict:
+        # Все сцены и завершающий кадр запускаются одновременно и опираются только на фото пользователя
+        await job.update.message.reply_text(f"Обрабатываю {num_scenes} сцен и завершающий кадр параллельно...")
+        tasks = {}
+        async with asyncio.TaskGroup() as tg:
+            for scene in range(1, num_scenes + 1):
+                tasks[scene] = tg.create_task(self._process_frame(
+                    job, scene, prompts[f"scene_{scene}_image"], photo_urls
+                ))
+            tasks[None] = tg.create_task(self._process_frame(
+                job, None, prompts["final_frame_image"], photo_urls
+            ))
+        return {scene: task.result() for scene, task in tasks.items()}
+
+    async def _resume_jobs(self, application: Application) -> None:
+        # Задания, прерванные остановкой или падением бота, снова ставятся в очередь
+        try:
+            stored_jobs = await self.jobs.unfinished()
+        except Exception as e:
+            logger.error(f"Не удалось прочитать незавершённые задания: {e}")
+            return
+        for stored in stored_jobs:
+            update = Update.de_json(json.loads(stored.update_json), application.bot)
+            try:
+                self.scheduler.submit(
+                    stored.user_id,
+                    lambda update=update, job_id=stored.job_id: self.process_message(update, job_id=job_id, resumed=True)
+                )
+            except SchedulerFull as e:
+                logger.warning(f"Задание {stored.job_id} не продолжено: {e}")
+                break
+            # Попытка засчитывается только заданию, которое действительно поставлено в очередь
+            await self.jobs.mark_resumed(stored.job_id)
+            logger.info(f"Задание {stored.job_id} пользователя {stored.user_id} продолжено после перезапуска")
+
+    def _collect_metrics(self) -> list[tuple[str, float, dict]]:
+        scheduler = self.scheduler.stats()
+        return [
+            ("bot_queue_depth", scheduler["queued"], {}),
+            ("bot_jobs_running", scheduler["running"], {}),
+            ("bot_inflight_tasks", self.poller.stats()["in_flight"], {"provider": "genapi"}),
+            ("bot_inflight_tasks", self.pika_status.stats()["in_flight"], {"provider": "pika"}),
+        ]
 
     async def main(self) -> None:
         logger.debug("Инициализация приложения Telegram")
@@ -463,23 +619,37 @@ class Bot:
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(MessageHandler(filters.PHOTO, self.handle_message))
 
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Попытка инициализации Telegram бота, попытка {attempt + 1}/{max_retries}")
-                await application.initialize()
-                break
-            except TimedOut as e:
-                logger.error(f"Ошибка таймаута при инициализации: {e}")
-                if attempt < max_retries - 1:
-                    delay = 2 ** attempt
-                    logger.info(f"Повторная попытка через {delay} секунд...")
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error("Не удалось инициализировать бота после всех попыток")
-                    raise Exception("Не удалось запустить бота: превышен лимит попыток подключения к Telegram API")
+        try:
+            logger.info("Инициализация Telegram бота")
+            await call_with_retry(application.initialize, "telegram")
+        except TimedOut as e:
+            logger.error(f"Не удалось инициализировать бота после всех попыток: {e}")
+            raise Exception("Не удалось запустить бота: превышен лимит попыток подключения к Telegram API")
         
+        await self.callbacks.start()
+        self.metrics.add_collector(self._collect_metrics)
+        await self.metrics_server.start()
+        self.token_store.start_refresher()
+        self.scheduler.start()
+        self.workspaces.start_sweeper()
+        await self._resume_jobs(application)
         await application.start()
         await application.updater.start_polling()
         logger.info("Bot polling started")
-        await asyncio.Event().wait()
\ No newline at end of file
+        try:
+            await asyncio.Event().wait()
+        finally:
+            logger.info("Остановка бота")
+            await application.updater.stop()
+            await application.stop()
+            await application.shutdown()
+            await self.scheduler.close()
+            await self.api_factory.close()
+            await self.jobs.close()
+            await self.workspaces.close()
+            await self.callbacks.stop()
+            await self.metrics_server.stop()
+            await self.token_store.close()
+            await self.pika_status.close()
+            await self.poller.close()
+            await self.http_session.close()
\ No newline at end of file
@@ -0,0 +1,81 @@
+import logging
+import uuid
+from aiohttp import web
+from genapi_poller import GenApiPoller, genapi_poller
+from config import CALLBACK_PUBLIC_URL, CALLBACK_HOST, CALLBACK_PORT
+
+logger = logging.getLogger(__name__)
+
+# Встроенный HTTP-сервер для callback от gen-api. Каждая задача получает свой адрес
+# /genapi/callback/{token}; после отправки задачи клиент привязывает token к request_id,
+# и пришедший результат завершает future в GenApiPoller без опроса.
+class CallbackReceiver:
+    def __init__(self, poller: GenApiPoller = None, public_url: str = CALLBACK_PUBLIC_URL,
+                 host: str = CALLBACK_HOST, port: int = CALLBACK_PORT):
+        self.poller = poller or genapi_poller
+        self.public_url = public_url.rstrip("/")
+        self.host = host
+        self.port = port
+        self._tokens: dict[str, str | None] = {}
+        self._unbound: dict[str, dict] = {}
+        self._runner = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.public_url) and self._runner is not None
+
+    def new_callback(self) -> tuple[str, str]:
+        token = uuid.uuid4().hex
+        self._tokens[token] = None
+        return token, f"{self.public_url}/genapi/callback/{token}"
+
+    def bind(self, token: str, request_id: str) -> None:
+        if token not in self._tokens:
+            return
+        self._tokens[token] = request_id
+        data = self._unbound.pop(token, None)
+        if data is not None:
+            self.poller.resolve(request_id, data)
+
+    def release(self, token: str) -> None:
+        self._tokens.pop(token, None)
+        self._unbound.pop(token, None)
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        if token not in self._tokens:
+            logger.warning(f"Callback for unknown token {token}")
+            return web.Response(status=404)
+        try:
+            data = await request.json()
+        except Exception as e:
+            logger.error(f"Invalid callback payload for token {token}: {e}")
+            return web.Response(status=400)
+
+        request_id = self._tokens[token]
+        if request_id is None:
+            # Результат пришёл раньше, чем клиент получил request_id
+            self._unbound[token] = data
+        else:
+            self.poller.resolve(request_id, data)
+        return web.json_response({"ok": True})
+
+    async def start(self) -> None:
+        if not self.public_url or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_post("/genapi/callback/{token}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Callback receiver listening on {self.host}:{self.port}, public url {self.public_url}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        self._tokens.clear()
+        self._unbound.clear()
+
+callback_receiver = CallbackReceiver()
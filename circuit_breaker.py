@@ -0,0 +1,130 @@
+import logging
+import time
+from collections import deque
+from config import (
+    CB_WINDOW, CB_MIN_CALLS, CB_FAILURE_RATIO, CB_SLOW_RATIO, CB_SLOW_CALL_SECONDS,
+    CB_OPEN_SECONDS, CB_HALF_OPEN_PROBES,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+# Автомат состояний для одного эндпоинта провайдера. В скользящем окне считаются
+# ошибки и медленные вызовы; при превышении порогов цепь размыкается и вызовы сразу
+# получают CircuitOpenError. Через open_seconds пропускается пробный вызов
+# (half-open): успех замыкает цепь, ошибка снова размыкает.
+class CircuitBreaker:
+    def __init__(self, name: str, window: float = CB_WINDOW, min_calls: int = CB_MIN_CALLS,
+                 failure_ratio: float = CB_FAILURE_RATIO, slow_ratio: float = CB_SLOW_RATIO,
+                 slow_call_seconds: float = None, open_seconds: float = CB_OPEN_SECONDS,
+                 half_open_probes: int = CB_HALF_OPEN_PROBES):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_ratio = slow_ratio
+        self.slow_call_seconds = slow_call_seconds if slow_call_seconds is not None else CB_SLOW_CALL_SECONDS.get(name)
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._calls: deque[tuple[float, bool, bool]] = deque()
+        self._probes = 0
+        self._stats = {"rejected": 0, "opened": 0}
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+            self._stats["opened"] += 1
+        elif state == CLOSED:
+            self._calls.clear()
+        self._probes = 0
+
+    def before_call(self) -> None:
+        if self.state == OPEN:
+            retry_in = self.opened_at + self.open_seconds - time.monotonic()
+            if retry_in > 0:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, retry_in)
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self._stats["rejected"] += 1
+                raise CircuitOpenError(self.name, 0)
+            self._probes += 1
+
+    def record(self, failed: bool, latency: float) -> None:
+        slow = self.slow_call_seconds is not None and latency > self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self._transition(OPEN if failed or slow else CLOSED)
+            return
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        self._trim(now)
+        calls = len(self._calls)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+        slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+        if failures / calls >= self.failure_ratio or slow_calls / calls >= self.slow_ratio:
+            logger.error(f"Circuit {self.name} trips: {failures}/{calls} failed, {slow_calls}/{calls} slow")
+            self._transition(OPEN)
+
+    def release_probe(self) -> None:
+        # Пробный вызов завершился ошибкой, не говорящей о здоровье провайдера
+        if self.state == HALF_OPEN and self._probes:
+            self._probes -= 1
+
+    def info(self) -> dict:
+        now = time.monotonic()
+        self._trim(now)
+        info = {
+            "state": self.state,
+            "calls": len(self._calls),
+            "failures": sum(1 for _, failed, _ in self._calls if failed),
+            "slow": sum(1 for _, _, slow in self._calls if slow),
+            **self._stats,
+        }
+        if self.state == OPEN:
+            info["retry_in"] = round(max(self.opened_at + self.open_seconds - now, 0), 1)
+        return info
+
+class CircuitBreakers:
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            self._breakers[name] = breaker
+        return breaker
+
+    def unavailable(self, names: list[str]) -> list[str]:
+        return [
+            name for name in names
+            if name in self._breakers and self._breakers[name].state == OPEN
+            and self._breakers[name].info().get("retry_in", 0) > 0
+        ]
+
+    def states(self) -> dict[str, dict]:
+        return {name: breaker.info() for name, breaker in self._breakers.items()}
+
+circuit_breakers = CircuitBreakers()
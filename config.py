@@ -0,0 +1,183 @@
+import os
+
+# Режим обработки сцен: "serial" — сцены строго по очереди с опорой на предыдущую,
+# "pipelined" — следующая сцена опирается на сгенерированное изображение предыдущей, а Flux работает в фоне,
+# "parallel" — все сцены и завершающий кадр одновременно с опорой только на фото пользователя
+SCENE_EXECUTION_MODE = os.getenv("SCENE_EXECUTION_MODE", "serial")
+
+# Общий пул HTTP-соединений (http_session.SharedSession)
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+
+# Общий опрос задач gen-api (genapi_poller.GenApiPoller), секунды
+GENAPI_POLL_FIRST_CHECK = float(os.getenv("GENAPI_POLL_FIRST_CHECK", "2"))
+GENAPI_POLL_MIN_INTERVAL = float(os.getenv("GENAPI_POLL_MIN_INTERVAL", "2"))
+GENAPI_POLL_MAX_INTERVAL = float(os.getenv("GENAPI_POLL_MAX_INTERVAL", "15"))
+GENAPI_POLL_DEFAULT_INTERVAL = float(os.getenv("GENAPI_POLL_DEFAULT_INTERVAL", "5"))
+GENAPI_POLL_CALLBACK_FALLBACK_INTERVAL = float(os.getenv("GENAPI_POLL_CALLBACK_FALLBACK_INTERVAL", "60"))
+
+# Базовый адрес gen-api (можно указать локальную заглушку fake_genapi.py)
+GENAPI_BASE_URL = os.getenv("GENAPI_BASE_URL", "https://api.gen-api.ru")
+# Адреса OpenAI, Pika и файлов Telegram (benchmark.py подставляет локальные заглушки из fake_providers.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+PIKA_API_URL = os.getenv("PIKA_API_URL", "https://api.pika.art")
+PIKA_LIBRARY_URL = os.getenv("PIKA_LIBRARY_URL", "https://pika.art/library")
+TELEGRAM_FILE_URL = os.getenv("TELEGRAM_FILE_URL", "https://api.telegram.org/file/bot")
+
+# Приём callback от gen-api (callback_server.CallbackReceiver). Пустой CALLBACK_PUBLIC_URL
+# отключает callback, и задачи завершаются только опросом
+CALLBACK_PUBLIC_URL = os.getenv("CALLBACK_PUBLIC_URL", "")
+CALLBACK_HOST = os.getenv("CALLBACK_HOST", "0.0.0.0")
+CALLBACK_PORT = int(os.getenv("CALLBACK_PORT", "8080"))
+
+# Кэш токенов Pika (pika_token_store.PikaTokenStore); обновление за PIKA_TOKEN_REFRESH_MARGIN секунд до истечения
+PIKA_TOKEN_CACHE_PATH = os.getenv("PIKA_TOKEN_CACHE_PATH", ".cache/pika_tokens.json")
+PIKA_TOKEN_REFRESH_MARGIN = float(os.getenv("PIKA_TOKEN_REFRESH_MARGIN", "300"))
+PIKA_TOKEN_DEFAULT_TTL = float(os.getenv("PIKA_TOKEN_DEFAULT_TTL", "3600"))
+
+# Пакетный опрос статусов Pika (pika_status.PikaStatusAggregator): интервал тика и лимит попыток на видео
+PIKA_STATUS_INTERVAL = float(os.getenv("PIKA_STATUS_INTERVAL", "10"))
+PIKA_STATUS_MAX_ATTEMPTS = int(os.getenv("PIKA_STATUS_MAX_ATTEMPTS", "30"))
+
+# Потоковые загрузки (download_util.download_to_file)
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+DOWNLOAD_MAX_SIZE = int(os.getenv("DOWNLOAD_MAX_SIZE", str(500 * 1024 * 1024)))
+DOWNLOAD_RESUME_ATTEMPTS = int(os.getenv("DOWNLOAD_RESUME_ATTEMPTS", "3"))
+
+# Артефакты задания больше порога (байт) хранятся на диске, а не в памяти (artifact_store.ArtifactStore)
+ARTIFACT_SPILL_THRESHOLD = int(os.getenv("ARTIFACT_SPILL_THRESHOLD", str(16 * 1024 * 1024)))
+
+
+# Кэш результатов gpt-image-1 и Flux (result_cache.ResultCache); RESULT_CACHE_TTL=0 отключает кэш
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", ".cache/results")
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", str(24 * 3600)))
+# Сколько живут ссылки gen-api на результаты: из кэша выдаются только ссылки не старше половины этого срока
+RESULT_URL_LIFETIME = float(os.getenv("RESULT_URL_LIFETIME", str(24 * 3600)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Кэш сценариев o3 (scenario_cache.ScenarioCache); SCENARIO_CACHE_TTL=0 отключает кэш
+SCENARIO_CACHE_PATH = os.getenv("SCENARIO_CACHE_PATH", ".cache/scenarios.json")
+SCENARIO_CACHE_MAX_ENTRIES = int(os.getenv("SCENARIO_CACHE_MAX_ENTRIES", "500"))
+SCENARIO_CACHE_TTL = float(os.getenv("SCENARIO_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Очередь заданий (job_scheduler.JobScheduler): всего одновременно, на пользователя и максимум ожидающих
+JOB_MAX_CONCURRENT = int(os.getenv("JOB_MAX_CONCURRENT", "4"))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", "1"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "50"))
+
+# Справедливое распределение очереди между пользователями (deficit round robin).
+# JOB_USER_WEIGHTS — веса пользователей вида "user_id:вес,user_id:вес" (например, для платных тарифов);
+# задание, ожидающее дольше JOB_STARVATION_TIMEOUT секунд, запускается вне очереди
+JOB_USER_WEIGHTS = {
+    int(user_id): float(weight)
+    for user_id, weight in (item.split(":") for item in os.getenv("JOB_USER_WEIGHTS", "").split(",") if item.strip())
+}
+JOB_DEFAULT_WEIGHT = float(os.getenv("JOB_DEFAULT_WEIGHT", "1"))
+JOB_STARVATION_TIMEOUT = float(os.getenv("JOB_STARVATION_TIMEOUT", "900"))
+
+# Политика повторов (retry_util): число попыток, экспоненциальная задержка с джиттером,
+# предел Retry-After и бюджет повторов на провайдера за окно RETRY_BUDGET_WINDOW секунд.
+# RETRY_PROVIDER_ATTEMPTS переопределяет число попыток: "pika:2,kling-elements:2"
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_PROVIDER_ATTEMPTS = {
+    provider.strip(): int(attempts)
+    for provider, attempts in (item.split(":") for item in os.getenv("RETRY_PROVIDER_ATTEMPTS", "").split(",") if item.strip())
+}
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+RETRY_MAX_RETRY_AFTER = float(os.getenv("RETRY_MAX_RETRY_AFTER", "120"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN = int(os.getenv("RETRY_BUDGET_MIN", "5"))
+RETRY_BUDGET_WINDOW = float(os.getenv("RETRY_BUDGET_WINDOW", "60"))
+
+# Предохранители эндпоинтов провайдеров (circuit_breaker): окно в секундах, минимум вызовов
+# для решения, доли ошибок и медленных вызовов для размыкания, пауза до пробного вызова.
+# CB_SLOW_CALL_SECONDS — порог «медленного» вызова по эндпоинтам
+CB_WINDOW = float(os.getenv("CB_WINDOW", "300"))
+CB_MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "5"))
+CB_FAILURE_RATIO = float(os.getenv("CB_FAILURE_RATIO", "0.5"))
+CB_SLOW_RATIO = float(os.getenv("CB_SLOW_RATIO", "0.8"))
+CB_OPEN_SECONDS = float(os.getenv("CB_OPEN_SECONDS", "60"))
+CB_HALF_OPEN_PROBES = int(os.getenv("CB_HALF_OPEN_PROBES", "1"))
+CB_SLOW_CALL_SECONDS = {
+    name.strip(): float(seconds)
+    for name, seconds in (
+        item.split(":") for item in os.getenv(
+            "CB_SLOW_CALL_SECONDS", "gpt-image-1:400,flux:400,kling-elements:3000,pika-generate:60,pika-library:30"
+        ).split(",") if item.strip()
+    )
+}
+
+# Ограничение запросов к провайдерам (rate_limiter): "провайдер=запросов_в_секунду:всплеск:одновременно".
+# Отдельный ограничитель заводится на каждый ключ API / аккаунт провайдера
+RATE_LIMITS = {
+    provider.strip(): (float(rate), int(burst), int(concurrency))
+    for provider, (rate, burst, concurrency) in (
+        (item.split("=")[0], item.split("=")[1].split(":")) for item in os.getenv(
+            "RATE_LIMITS",
+            "genapi=2:5:10,genapi-status=10:20:20,openai=1:3:4,pika-generate=0.5:2:2,pika-library=2:4:2"
+        ).split(",") if item.strip()
+    )
+}
+RATE_LIMIT_DEFAULT = (5.0, 10, 10)
+
+# Пулы учётных данных (credential_pool): выбор ключа "least_loaded" или "round_robin",
+# сколько заданий одновременно на один ключ/аккаунт провайдера и пауза для ключа после 401/403/429
+CREDENTIAL_STRATEGY = os.getenv("CREDENTIAL_STRATEGY", "least_loaded")
+CREDENTIAL_MAX_JOBS = {
+    provider.strip(): int(jobs)
+    for provider, jobs in (
+        item.split(":") for item in os.getenv("CREDENTIAL_MAX_JOBS", "genapi:4,openai:4,pika:2").split(",") if item.strip()
+    )
+}
+CREDENTIAL_COOLDOWN = float(os.getenv("CREDENTIAL_COOLDOWN", "60"))
+# Хеджирование задач gpt-image-1 и Flux (hedging): если задача не завершилась за HEDGE_PERCENTILE
+# последних HEDGE_SAMPLES задержек (при не меньше HEDGE_MIN_SAMPLES замерах), отправляется дубликат
+# и берётся первый результат. Дубликатов не больше HEDGE_BUDGET_RATIO от запросов за HEDGE_BUDGET_WINDOW
+# секунд. Брошенную задачу ещё до HEDGE_OBSERVE_SECONDS опрашиваем, чтобы оценить выигрыш.
+# HEDGE_NETWORKS: "gpt-image-1,flux"; пусто — хеджирование выключено
+HEDGE_NETWORKS = [network.strip() for network in os.getenv("HEDGE_NETWORKS", "").split(",") if network.strip()]
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_SAMPLES = int(os.getenv("HEDGE_SAMPLES", "200"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_BUDGET_WINDOW = float(os.getenv("HEDGE_BUDGET_WINDOW", "3600"))
+HEDGE_OBSERVE_SECONDS = float(os.getenv("HEDGE_OBSERVE_SECONDS", "600"))
+
+# Хранилище заданий (job_store): SQLite с контрольными точками этапов. При запуске бота
+# незавершённые задания не старше JOB_RESUME_MAX_AGE секунд продолжаются с последнего
+# пройденного этапа, но не больше JOB_RESUME_MAX_ATTEMPTS раз
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", ".cache/jobs.sqlite3")
+JOB_RESUME_MAX_AGE = float(os.getenv("JOB_RESUME_MAX_AGE", "86400"))
+JOB_RESUME_MAX_ATTEMPTS = int(os.getenv("JOB_RESUME_MAX_ATTEMPTS", "3"))
+
+# Рабочие каталоги заданий (workspace): у каждого задания свой каталог в WORKSPACE_ROOT,
+# удаляемый в фоне после завершения. Общий объём ограничен WORKSPACE_QUOTA_BYTES: при превышении
+# удаляются давно не использованные каталоги без активного задания. Раз в WORKSPACE_SWEEP_INTERVAL
+# секунд удаляются оставшиеся после падений файлы старше WORKSPACE_ORPHAN_AGE секунд
+WORKSPACE_ROOT = os.getenv("WORKSPACE_ROOT", "temp")
+WORKSPACE_QUOTA_BYTES = int(os.getenv("WORKSPACE_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+WORKSPACE_SWEEP_INTERVAL = float(os.getenv("WORKSPACE_SWEEP_INTERVAL", "600"))
+WORKSPACE_ORPHAN_AGE = float(os.getenv("WORKSPACE_ORPHAN_AGE", "3600"))
+
+# Метрики (metrics): эндпоинт Prometheus http://METRICS_HOST:METRICS_PORT/metrics, запускается
+# из Bot.main; METRICS_PORT=0 отключает. Границы корзин гистограмм задержек в секундах
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+METRICS_LATENCY_BUCKETS = tuple(
+    float(bound) for bound in os.getenv(
+        "METRICS_LATENCY_BUCKETS", "0.1,0.5,1,2.5,5,10,30,60,120,300,600,1200,1800"
+    ).split(",")
+)
+
+# Уровень общего текстового лога; тела запросов и ответов в него не пишутся
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Трассировка заданий (tracing): JSON-строки в TRACE_LOG_PATH (пусто — stderr). Спаны пишутся
+# для доли TRACE_SAMPLE_RATE заданий, сводка с хронологией — для всех. Не больше TRACE_MAX_SPANS
+# спанов на задание, остальные суммируются по имени; тела обрезаются до TRACE_BODY_PREVIEW символов
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "64"))
+TRACE_BODY_PREVIEW = int(os.getenv("TRACE_BODY_PREVIEW", "200"))
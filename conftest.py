@@ -0,0 +1,14 @@
+import asyncio
+import inspect
+import pytest
+
+# Тесты вида async def выполняются в собственном event loop; зависший тест падает по таймауту
+ASYNC_TEST_TIMEOUT = 10
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(asyncio.wait_for(pyfuncitem.obj(**arguments), ASYNC_TEST_TIMEOUT))
+    return True
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import logging
+import time
+import key
+from retry_util import APIError
+from config import CREDENTIAL_STRATEGY, CREDENTIAL_MAX_JOBS, CREDENTIAL_COOLDOWN
+
+logger = logging.getLogger(__name__)
+
+class Credential:
+    def __init__(self, provider: str, secret, name: str):
+        self.provider = provider
+        self.secret = secret
+        self.name = name
+        self.in_use = 0
+        self.leases = 0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.last_error = None
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def info(self) -> dict:
+        return {
+            "in_use": self.in_use,
+            "leases": self.leases,
+            "failures": self.failures,
+            "healthy": self.healthy,
+            "last_error": self.last_error,
+        }
+
+# Пул учётных данных одного провайдера. Задание берёт наименее загруженный (или
+# следующий по кругу) здоровый ключ; на ключ одновременно не больше max_jobs заданий.
+# Ключ, получивший 401/403/429, выводится из выдачи на cooldown секунд.
+class CredentialPool:
+    def __init__(self, provider: str, credentials: list[Credential], strategy: str = CREDENTIAL_STRATEGY,
+                 max_jobs: int = None, cooldown: float = CREDENTIAL_COOLDOWN):
+        if not credentials:
+            raise ValueError(f"No credentials configured for {provider}")
+        self.provider = provider
+        self.credentials = credentials
+        self.strategy = strategy
+        self.max_jobs = max_jobs or CREDENTIAL_MAX_JOBS.get(provider, 4)
+        self.cooldown = cooldown
+        self._next = 0
+        self._condition = None
+        self._wakeups: set[asyncio.Task] = set()
+
+    @property
+    def primary(self) -> Credential:
+        return self.credentials[0]
+
+    def _pick(self) -> Credential | None:
+        available = [c for c in self.credentials if c.in_use < self.max_jobs]
+        if not available:
+            return None
+        # Если все ключи на паузе, лучше попробовать ключ, чем стоять
+        healthy = [c for c in available if c.healthy] or available
+        if self.strategy == "round_robin":
+            for offset in range(len(self.credentials)):
+                candidate = self.credentials[(self._next + offset) % len(self.credentials)]
+                if candidate in healthy:
+                    self._next = (self.credentials.index(candidate) + 1) % len(self.credentials)
+                    return candidate
+        return min(healthy, key=lambda c: (c.in_use, c.leases))
+
+    async def lease(self) -> Credential:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            credential = self._pick()
+            while credential is None:
+                await self._condition.wait()
+                credential = self._pick()
+            credential.in_use += 1
+            credential.leases += 1
+            return credential
+
+    def release(self, credential: Credential) -> None:
+        credential.in_use -= 1
+        if self._condition is not None:
+            # Ссылка на задачу держится до её завершения, иначе сборщик мусора может её удалить
+            task = asyncio.get_running_loop().create_task(self._wake())
+            self._wakeups.add(task)
+            task.add_done_callback(self._wakeups.discard)
+
+    async def _wake(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    def report(self, credential: Credential, error: Exception = None) -> None:
+        if error is None:
+            credential.failures = 0
+            return
+        cause = error
+        while cause is not None and not isinstance(cause, APIError):
+            cause = cause.__cause__ or cause.__context__
+        if cause is not None and cause.status in (401, 403, 429):
+            credential.failures += 1
+            credential.last_error = str(cause)
+            delay = cause.retry_after or self.cooldown
+            credential.unhealthy_until = time.monotonic() + delay
+            logger.warning(f"{self.provider} credential {credential.name} paused for {delay:.0f}s: {cause}")
+
+    def stats(self) -> dict[str, dict]:
+        return {credential.name: credential.info() for credential in self.credentials}
+
+def _fingerprint(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:8]
+
+def _configured_pools() -> dict[str, CredentialPool]:
+    # В key.py можно задать списки GENAPI_API_KEYS, OPENAI_API_KEYS и PIKA_ACCOUNTS
+    # [(email, password), ...]; без них используются одиночные ключи
+    genapi_keys = list(getattr(key, "GENAPI_API_KEYS", None) or [key.GENAPI_API_KEY])
+    openai_keys = list(getattr(key, "OPENAI_API_KEYS", None) or [key.OPENAI_API_KEY])
+    pika_accounts = list(getattr(key, "PIKA_ACCOUNTS", None) or [(key.PIKA_EMAIL, key.PIKA_PASSWORD)])
+    return {
+        "genapi": CredentialPool("genapi", [Credential("genapi", k, _fingerprint(k)) for k in genapi_keys]),
+        "openai": CredentialPool("openai", [Credential("openai", k, _fingerprint(k)) for k in openai_keys]),
+        "pika": CredentialPool("pika", [Credential("pika", account, account[0]) for account in pika_accounts]),
+    }
+
+class CredentialPools:
+    def __init__(self, pools: dict[str, CredentialPool] = None):
+        self.pools = pools if pools is not None else _configured_pools()
+
+    def get(self, provider: str) -> CredentialPool:
+        return self.pools[provider]
+
+    def stats(self) -> dict[str, dict]:
+        return {provider: pool.stats() for provider, pool in self.pools.items()}
+
+# Учётные данные, арендованные одним заданием: по одному ключу на провайдера,
+# выдаются при первом обращении и возвращаются в пул в конце задания
+class JobCredentials:
+    def __init__(self, pools: CredentialPools):
+        self.pools = pools
+        self._leased: dict[str, Credential] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def lease(self, provider: str) -> Credential:
+        credential = self._leased.get(provider)
+        if credential is not None:
+            return credential
+        # Параллельные сцены одного задания дожидаются одной аренды, а не занимают
+        # в пуле лишние места (при заполненном пуле это была бы взаимная блокировка)
+        async with self._locks.setdefault(provider, asyncio.Lock()):
+            credential = self._leased.get(provider)
+            if credential is None:
+                credential = await self.pools.get(provider).lease()
+                self._leased[provider] = credential
+                logger.debug(f"Leased {provider} credential {credential.name}")
+        return credential
+
+    def report(self, provider: str, error: Exception = None) -> None:
+        credential = self._leased.get(provider)
+        if credential is not None:
+            self.pools.get(provider).report(credential, error)
+
+    def release(self) -> None:
+        for provider, credential in self._leased.items():
+            self.pools.get(provider).release(credential)
+        self._leased.clear()
+
+credential_pools = CredentialPools()
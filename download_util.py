@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+import logging
+from urllib.parse import urlsplit
+import aiohttp
+from http_session import SharedSession, shared_session
+from metrics import metrics
+from retry_util import APIError, parse_retry_after
+from config import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_SIZE, DOWNLOAD_RESUME_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+# status задан, если сервер ответил ошибкой: по нему retry_util решает, есть ли смысл повторять
+class DownloadError(APIError):
+    pass
+
+class DownloadResult:
+    def __init__(self, path: str, size: int, sha256: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def __repr__(self) -> str:
+        return f"DownloadResult(path={self.path!r}, size={self.size}, sha256={self.sha256[:12]})"
+
+class FileSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    async def write(self, chunk: bytes, hasher) -> None:
+        if self._file is None:
+            self._file = await asyncio.to_thread(open, self.path, "wb")
+        await asyncio.to_thread(self._write_chunk, self._file, hasher, chunk)
+
+    @staticmethod
+    def _write_chunk(f, hasher, chunk: bytes) -> None:
+        f.write(chunk)
+        hasher.update(chunk)
+
+    async def reset(self) -> None:
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+    async def close(self) -> None:
+        await self.reset()
+
+# Потоковая загрузка в sink (FileSink или буфер ArtifactStore): данные пишутся блоками
+# по мере получения, размер и sha256 считаются на лету, поэтому память не зависит от
+# размера файла. При обрыве соединения загрузка продолжается через HTTP Range.
+async def download(url: str, sink, http_session: SharedSession = None, headers: dict = None,
+                   chunk_size: int = DOWNLOAD_CHUNK_SIZE, max_size: int = DOWNLOAD_MAX_SIZE,
+                   resume_attempts: int = DOWNLOAD_RESUME_ATTEMPTS) -> tuple[int, str]:
+    http_session = http_session or shared_session
+    hasher = hashlib.sha256()
+    written = 0
+    try:
+        for attempt in range(resume_attempts + 1):
+            request_headers = dict(headers or {})
+            if written:
+                request_headers["Range"] = f"bytes={written}-"
+            try:
+                session = await http_session.get()
+                async with session.get(url, headers=request_headers) as response:
+                    if written and response.status == 416:
+                        # Всё уже получено до обрыва
+                        break
+                    if written and response.status == 200:
+                        # Сервер не поддерживает Range — начинаем заново
+                        logger.warning(f"Range not supported for {url}, restarting download")
+                        await sink.reset()
+                        hasher = hashlib.sha256()
+                        written = 0
+                    elif response.status not in (200, 206):
+                        raise DownloadError(f"Failed to download {url}: {response.status}", status=response.status,
+                                            retry_after=parse_retry_after(response.headers.get("Retry-After")))
+
+                    if response.content_length is not None and written + response.content_length > max_size:
+                        raise DownloadError(f"Download of {url} exceeds max size {max_size} bytes")
+
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        if written + len(chunk) > max_size:
+                            raise DownloadError(f"Download of {url} exceeds max size {max_size} bytes")
+                        await sink.write(chunk, hasher)
+                        written += len(chunk)
+                break
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= resume_attempts:
+                    raise DownloadError(f"Failed to download {url} after {attempt + 1} attempts: {e}")
+                logger.warning(f"Download of {url} interrupted at {written} bytes, resuming: {e}")
+                await asyncio.sleep(2 ** attempt)
+    finally:
+        await sink.close()
+
+    if written == 0:
+        raise ValueError(f"Empty content downloaded from {url}")
+    metrics.inc("bot_bytes_total", written, direction="download", target=urlsplit(url).hostname or "unknown")
+    return written, hasher.hexdigest()
+
+async def download_to_file(url: str, path: str, http_session: SharedSession = None, headers: dict = None,
+                           **kwargs) -> DownloadResult:
+    size, sha256 = await download(url, FileSink(path), http_session=http_session, headers=headers, **kwargs)
+    return DownloadResult(path, size, sha256)
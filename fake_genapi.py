@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import logging
+import aiohttp
+from aiohttp import web
+from fake_providers import FakeServer, PNG_PIXEL
+
+logger = logging.getLogger(__name__)
+
+# Локальная заглушка gen-api: POST /api/v1/networks/{network} создаёт задачу, которая
+# завершается через случайное время; GET /api/v1/request/get/{id} возвращает её статус,
+# а при наличии callback_url результат отправляется туда POST-запросом. Доля failure_rate задач
+# завершается статусом error, доля error_rate запросов получает HTTP 503.
+# Запуск: GENAPI_BASE_URL=http://127.0.0.1:8090 и python fake_genapi.py --port 8090
+class FakeGenApi(FakeServer):
+    name = "gen-api"
+
+    def __init__(self, port: int = 8090, latency: float = 5.0, **kwargs):
+        super().__init__(port=port, latency=latency, **kwargs)
+        self.tasks: dict[str, dict] = {}
+        self.stats.update({"submits": 0, "polls": 0, "callbacks_sent": 0, "downloads": 0})
+        self._background = set()
+
+    async def _submit(self, request: web.Request) -> web.Response:
+        overloaded = self._overloaded()
+        if overloaded is not None:
+            return overloaded
+        network = request.match_info["network"]
+        payload = await request.json()
+        request_id = str(next(self._ids))
+        loop = asyncio.get_running_loop()
+        task = {
+            "network": network,
+            "payload": payload,
+            "done_at": loop.time() + self._sample_latency(),
+            "failed": self.random.random() < self.failure_rate,
+        }
+        self.tasks[request_id] = task
+        self.stats["submits"] += 1
+        if payload.get("callback_url"):
+            background = loop.create_task(self._send_callback(request_id, payload["callback_url"]))
+            self._background.add(background)
+            background.add_done_callback(self._background.discard)
+        return web.json_response({"request_id": request_id, "status": "starting"})
+
+    def _result(self, request_id: str) -> dict:
+        task = self.tasks.get(request_id)
+        if task is None:
+            return {"request_id": request_id, "status": "error", "error": "Unknown request"}
+        if asyncio.get_running_loop().time() < task["done_at"]:
+            return {"request_id": request_id, "status": "processing"}
+        if task["failed"]:
+            return {"request_id": request_id, "status": "error", "error": "Simulated failure"}
+        return {
+            "request_id": request_id,
+            "status": "success",
+            "result": [f"{self.base_url}/files/{request_id}.png"],
+        }
+
+    async def _get(self, request: web.Request) -> web.Response:
+        self.stats["polls"] += 1
+        overloaded = self._overloaded()
+        if overloaded is not None:
+            return overloaded
+        return web.json_response(self._result(request.match_info["request_id"]))
+
+    async def _send_callback(self, request_id: str, callback_url: str) -> None:
+        task = self.tasks[request_id]
+        await asyncio.sleep(max(0.0, task["done_at"] - asyncio.get_running_loop().time()))
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(callback_url, json=self._result(request_id)) as response:
+                    self.stats["callbacks_sent"] += 1
+                    logger.debug(f"Callback for {request_id} delivered: {response.status}")
+        except Exception as e:
+            logger.warning(f"Callback for {request_id} failed: {e}")
+
+    async def _file(self, request: web.Request) -> web.Response:
+        self.stats["downloads"] += 1
+        return web.Response(body=PNG_PIXEL, content_type="image/png")
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_post("/api/v1/networks/{network}", self._submit)
+        app.router.add_get("/api/v1/request/get/{request_id}", self._get)
+        app.router.add_get("/files/{name}", self._file)
+
+    async def stop(self) -> None:
+        for background in list(self._background):
+            background.cancel()
+        await super().stop()
+
+
+async def _serve(args) -> None:
+    server = FakeGenApi(host=args.host, port=args.port, latency=args.latency,
+                        jitter=args.jitter, failure_rate=args.failure_rate, seed=args.seed,
+                        distribution=args.distribution, error_rate=args.error_rate)
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the gen-api task endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=5.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--distribution", choices=["uniform", "lognormal", "exponential"], default="uniform")
+    parser.add_argument("--seed", type=int, default=None)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,236 @@
+import abc
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Маленький PNG 1x1, который заглушка отдаёт вместо сгенерированных изображений
+PNG_PIXEL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c6360000002000001e221bc330000000049454e44ae426082"
+)
+
+# Задержка заглушки: "uniform" — latency ± jitter (доля), "lognormal" — медиана latency и
+# стандартное отклонение логарифма jitter (длинный хвост), "exponential" — среднее latency
+def sample_latency(rng: random.Random, latency: float, jitter: float, distribution: str = "uniform") -> float:
+    if distribution == "lognormal":
+        return latency * math.exp(rng.gauss(0, jitter))
+    if distribution == "exponential":
+        return rng.expovariate(1 / latency) if latency > 0 else 0.0
+    return max(0.0, latency * (1 + rng.uniform(-jitter, jitter)))
+
+# Общая часть локальных заглушек: HTTP-сервер, задержка по распределению sample_latency
+# и доля error_rate запросов, получающих HTTP-ошибку. Статистика доступна по GET /stats.
+class FakeServer(abc.ABC):
+    name = "fake"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 1.0, jitter: float = 0.5,
+                 distribution: str = "uniform", failure_rate: float = 0.0, error_rate: float = 0.0,
+                 seed: int = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.failure_rate = failure_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "errors": 0}
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _sample_latency(self) -> float:
+        return sample_latency(self.random, self.latency, self.jitter, self.distribution)
+
+    def _overloaded(self, status: int = 503) -> web.Response | None:
+        self.stats["requests"] += 1
+        if self.random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": "Simulated overload"}, status=status)
+        return None
+
+    async def _stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    @abc.abstractmethod
+    def routes(self, app: web.Application) -> None:
+        pass
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.routes(app)
+        app.router.add_get("/stats", self._stats)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Fake {self.name} listening on {self.base_url}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+# Заглушка Pika: POST /generate/v2 запускает видео, которое будет готово через случайное время,
+# POST /library возвращает статусы пачкой в формате ответа server action, а GET /files/{id}.mp4
+# отдаёт видео размера video_size. Доля failure_rate видео завершается статусом failed.
+class FakePika(FakeServer):
+    name = "pika"
+
+    def __init__(self, video_size: int = 1024 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.video_size = video_size
+        self.videos: dict[str, dict] = {}
+        self.stats.update({"generations": 0, "library_requests": 0, "bytes_received": 0, "downloads": 0})
+
+    async def _generate(self, request: web.Request) -> web.Response:
+        overloaded = self._overloaded()
+        if overloaded is not None:
+            return overloaded
+        form = await request.post()
+        self.stats["bytes_received"] += sum(
+            len(field.file.read()) for field in form.values() if isinstance(field, web.FileField)
+        )
+        video_id = f"video-{next(self._ids)}"
+        self.videos[video_id] = {
+            "done_at": time.monotonic() + self._sample_latency(),
+            "failed": self.random.random() < self.failure_rate,
+        }
+        self.stats["generations"] += 1
+        return web.json_response({"success": True, "data": {"id": video_id}})
+
+    def _video(self, video_id: str) -> dict:
+        video = self.videos.get(video_id)
+        if video is None:
+            return {"id": video_id, "status": "error"}
+        if time.monotonic() < video["done_at"]:
+            return {"id": video_id, "status": "queued"}
+        if video["failed"]:
+            return {"id": video_id, "status": "failed"}
+        return {"id": video_id, "status": "finished", "sharingUrl": f"{self.base_url}/files/{video_id}.mp4"}
+
+    async def _library(self, request: web.Request) -> web.Response:
+        overloaded = self._overloaded()
+        if overloaded is not None:
+            return overloaded
+        self.stats["library_requests"] += 1
+        body = json.loads(await request.text())
+        results = [{"id": video_id, "videos": [self._video(video_id)]} for video_id in body[0]["ids"]]
+        text = '0:["$@1",["bench",null]]\n1:' + json.dumps({"data": {"results": results}}) + "\n"
+        return web.Response(text=text, content_type="text/x-component")
+
+    async def _file(self, request: web.Request) -> web.Response:
+        self.stats["downloads"] += 1
+        return web.Response(body=bytes(self.video_size), content_type="video/mp4")
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_post("/generate/v2", self._generate)
+        app.router.add_post("/library", self._library)
+        app.router.add_get("/files/{name}", self._file)
+
+# Заглушка OpenAI: POST /v1/chat/completions отвечает сценарием из num_scenes сцен
+# в формате, который разбирает Bot._request_scenario. Ошибки — HTTP 500.
+class FakeOpenAI(FakeServer):
+    name = "openai"
+
+    def __init__(self, num_scenes: int = 4, **kwargs):
+        super().__init__(**kwargs)
+        self.num_scenes = num_scenes
+        self.stats.update({"completions": 0})
+
+    def _scenario(self) -> str:
+        lines = [f"Number of scenes: {self.num_scenes}"]
+        for scene in range(1, self.num_scenes + 1):
+            lines.append(f"Scene {scene} Image prompt: Benchmark still image for scene {scene}")
+            lines.append(f"Scene {scene} Video prompt: Benchmark camera move for scene {scene}")
+        lines.append("Final Frame Image prompt: Benchmark final frame")
+        return "\n".join(lines)
+
+    async def _completions(self, request: web.Request) -> web.Response:
+        overloaded = self._overloaded(status=500)
+        if overloaded is not None:
+            return overloaded
+        body = await request.json()
+        await asyncio.sleep(self._sample_latency())
+        self.stats["completions"] += 1
+        return web.json_response({
+            "id": f"chatcmpl-{next(self._ids)}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "o3"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self._scenario()},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_post("/v1/chat/completions", self._completions)
+
+# Заглушка Telegram Bot API: методы /bot{token}/{method}, которые вызывает бот
+# (getMe, getFile, sendMessage, sendPhoto, sendVideo), и скачивание фото по /file/bot{token}/...
+# Для каждого чата считаются отправленные сообщения, фото и видео — по ним benchmark.py
+# определяет исход задания.
+class FakeTelegram(FakeServer):
+    name = "telegram"
+
+    def __init__(self, photo_size: int = 256 * 1024, **kwargs):
+        super().__init__(**kwargs)
+        self.photo_size = photo_size
+        self.chats: dict[str, dict[str, int]] = {}
+        self.stats.update({"bytes_received": 0, "downloads": 0})
+
+    @staticmethod
+    def _message(message_id: int, chat_id: int) -> dict:
+        return {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        overloaded = self._overloaded(status=502)
+        if overloaded is not None and method != "getMe":
+            return overloaded
+        params = await request.post()
+        await asyncio.sleep(self._sample_latency())
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+        elif method == "getFile":
+            file_id = params.get("file_id", "")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": self.photo_size,
+                      "file_path": f"photos/{file_id}.jpg"}
+        elif method in ("sendMessage", "sendPhoto", "sendVideo"):
+            chat_id = int(params.get("chat_id", 0))
+            chat = self.chats.setdefault(str(chat_id), {"sendMessage": 0, "sendPhoto": 0, "sendVideo": 0})
+            chat[method] += 1
+            self.stats["bytes_received"] += sum(
+                len(field.file.read()) for field in params.values() if isinstance(field, web.FileField)
+            )
+            result = self._message(next(self._ids), chat_id)
+        else:
+            return web.json_response({"ok": False, "error_code": 404, "description": f"Unknown method {method}"},
+                                     status=404)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _file(self, request: web.Request) -> web.Response:
+        self.stats["downloads"] += 1
+        # Первые байты — настоящий PNG, чтобы содержимое выглядело как изображение
+        return web.Response(body=PNG_PIXEL + bytes(max(0, self.photo_size - len(PNG_PIXEL))),
+                            content_type="image/jpeg")
+
+    async def _chats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.chats)
+
+    def routes(self, app: web.Application) -> None:
+        app.router.add_route("*", "/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._file)
+        app.router.add_get("/chats", self._chats)
@@ -1,29 +1,49 @@
-import aiohttp
-import asyncio
 import logging
 from api_base import APIBase
 from api_params import FluxParams
+from http_session import SharedSession, shared_session
+from genapi_poller import GenApiPoller, genapi_poller
+from callback_server import CallbackReceiver, callback_receiver
+from rate_limiter import RateLimiters, rate_limiters
+from submission_ledger import SubmissionLedger, submission_ledger
+from metrics import metrics
+from tracing import tracer, digest
 from key import GENAPI_API_KEY
-from retry_util import retry_request
+from retry_util import retry_request, response_error, TaskFailedError
+from config import GENAPI_BASE_URL
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Срок ожидания задачи в GenApiPoller. Таймаут попытки больше на время отправки запроса,
+# чтобы долгую задачу завершал дедлайн poller'а, а не таймаут с повторным опросом
+MAX_POLL_TIME = 600
+REQUEST_TIMEOUT = MAX_POLL_TIME + 120
+
 class FluxAPI(APIBase):
-    def __init__(self, params: FluxParams = None):
+    def __init__(self, params: FluxParams = None, http_session: SharedSession = None, poller: GenApiPoller = None,
+                 callbacks: CallbackReceiver = None, limiters: RateLimiters = None, api_key: str = None,
+                 submissions: SubmissionLedger = None):
         self.params = params or FluxParams()
-        self.base_url = "https://api.gen-api.ru/api/v1/networks/flux"
+        self.http_session = http_session or shared_session
+        self.poller = poller or genapi_poller
+        self.callbacks = callbacks or callback_receiver
+        self.limiters = limiters or rate_limiters
+        self.submissions = submissions or submission_ledger
+        self.base_url = f"{GENAPI_BASE_URL}/api/v1/networks/flux"
         self.headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
-            "Authorization": f"Bearer {GENAPI_API_KEY}"
+            "Authorization": f"Bearer {api_key or GENAPI_API_KEY}"
         }
 
-    @retry_request(max_retries=0, timeout=500, backoff_factor=2)
+    @metrics.track("send_request", "flux")
+    @retry_request(timeout=REQUEST_TIMEOUT, backoff_factor=2, provider="flux", circuit="flux")
     async def send_request(self, **kwargs):
         prompt = kwargs.get("prompt")
         image_url = kwargs.get("image_url")
         params = kwargs.get("params", {})
+        is_sync = params.get("is_sync", self.params.is_sync)
 
         if not prompt:
             logger.error(f"Prompt is required: prompt={prompt}")
@@ -38,26 +58,37 @@ class FluxAPI(APIBase):
             "guidance_scale": params.get("guidance_scale", self.params.guidance_scale),
             "strength": params.get("strength", self.params.strength),
             "translate_input": params.get("translate_input", self.params.translate_input),
-            "is_sync": params.get("is_sync", self.params.is_sync)
+            "is_sync": is_sync
         }
         if image_url:
             payload["image"] = image_url
-        if params.get("callback_url", self.params.callback_url):
-            payload["callback_url"] = params.get("callback_url", self.params.callback_url)
+        # Повтор после таймаута или сетевой ошибки продолжает опрос уже созданной задачи
+        submission_key = kwargs.get("submission_key")
+        task_id = None if is_sync else self.submissions.resume(submission_key)
+        callback_url = params.get("callback_url", self.params.callback_url)
+        callback_token = None
+        if not callback_url and not is_sync and not task_id and self.callbacks.enabled:
+            callback_token, callback_url = self.callbacks.new_callback()
+        if callback_url:
+            payload["callback_url"] = callback_url
         if params.get("seed", self.params.seed) is not None:
             payload["seed"] = params.get("seed", self.params.seed)
 
-        logger.debug(f"Sending payload to Flux API: {payload}")
+        tracer.annotate(payload=digest(payload))
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, json=payload, headers=self.headers) as response:
+            if not task_id:
+                session = await self.http_session.get()
+                async with (
+                    self.limiters.limit("genapi", self.headers["Authorization"]),
+                    session.post(self.base_url, json=payload, headers=self.headers) as response,
+                ):
                     if response.status != 200:
                         error_text = await response.text()
-                        logger.error(f"Flux API request failed: {response.status} - {error_text}")
-                        raise Exception(f"Flux API request failed: {response.status}")
+                        logger.error(f"Flux API request failed: {response.status} - {digest(error_text)}")
+                        raise response_error(f"Flux API request failed: {response.status}", response)
                     data = await response.json()
-                    if params.get("is_sync", self.params.is_sync):
+                    if is_sync:
                         image_url = None
                         result = data.get("result")
                         if isinstance(result, list) and result:
@@ -65,7 +96,7 @@ class FluxAPI(APIBase):
                         else:
                             image_url = data.get("output")
                         if not image_url:
-                            logger.error(f"No image_url in synchronous Flux response: {data}")
+                            logger.error(f"No image_url in synchronous Flux response: {digest(data)}")
                             raise Exception("No image_url in synchronous Flux response")
                         return image_url
                     task_id = data.get("request_id")
@@ -73,49 +104,39 @@ class FluxAPI(APIBase):
                         logger.error("No request_id in Flux response")
                         raise Exception("No request_id in Flux response")
                     logger.info(f"Flux task created: {task_id}")
+                    self.submissions.submitted(submission_key, "flux", task_id)
 
-            image_url = await self._poll_status(task_id)
+            if callback_token:
+                self.callbacks.bind(callback_token, task_id)
+            image_url = await self._poll_status(task_id, callback=callback_token is not None)
+            self.submissions.settle(submission_key)
             return image_url
 
         except Exception as e:
+            self.submissions.settle(submission_key, e)
             logger.error(f"Flux API error: {e}")
-            raise Exception(f"Flux API error: {e}")
-
-    @retry_request(max_retries=0, timeout=300, backoff_factor=2)
-    async def _poll_status(self, task_id: str) -> str:
-        status_url = f"https://api.gen-api.ru/api/v1/request/get/{task_id}"
-        max_poll_time = 600
-        start_time = asyncio.get_event_loop().time()
-
-        async with aiohttp.ClientSession() as session:
-            while True:
-                if asyncio.get_event_loop().time() - start_time > max_poll_time:
-                    logger.error(f"Polling timeout for Flux task {task_id}")
-                    raise Exception(f"Polling timeout for Flux task {task_id}")
-
-                async with session.get(status_url, headers=self.headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Failed to check Flux task status: {response.status} - {error_text}")
-                        raise Exception(f"Failed to check Flux task status: {response.status}")
-                    data = await response.json()
-                    status = data.get("status")
-                    logger.info(f"Flux task {task_id} status: {status}")
+            raise Exception(f"Flux API error: {e}") from e
+        finally:
+            if callback_token:
+                self.callbacks.release(callback_token)
 
-                    if status == "success":
-                        image_url = None
-                        result = data.get("result")
-                        if isinstance(result, list) and result:
-                            image_url = result[0]
-                        else:
-                            image_url = data.get("output")
-                        if not image_url:
-                            logger.error(f"No image_url in completed Flux task {task_id}. Full response: {data}")
-                            raise Exception(f"No image_url in completed Flux task {task_id}")
-                        return image_url
-                    elif status == "error":
-                        error = data.get("error", "Unknown error")
-                        logger.error(f"Flux task {task_id} failed: {error}. Full response: {data}")
-                        raise Exception(f"Flux task {task_id} failed: {error}")
+    @metrics.track("poll_status", "flux")
+    async def _poll_status(self, task_id: str, callback: bool = False) -> str:
+        data = await self.poller.wait(task_id, "flux", self.headers, max_poll_time=MAX_POLL_TIME, callback=callback)
+        status = data.get("status")
 
-                await asyncio.sleep(10)
\ No newline at end of file
+        if status == "success":
+            image_url = None
+            result = data.get("result")
+            if isinstance(result, list) and result:
+                image_url = result[0]
+            else:
+                image_url = data.get("output")
+            if not image_url:
+                logger.error(f"No image_url in completed Flux task {task_id}. Response: {digest(data)}")
+                raise Exception(f"No image_url in completed Flux task {task_id}")
+            return image_url
+        elif status == "error":
+            error = data.get("error", "Unknown error")
+            logger.error(f"Flux task {task_id} failed: {error}. Response: {digest(data)}")
+            raise TaskFailedError(f"Flux task {task_id} failed: {error}")
\ No newline at end of file
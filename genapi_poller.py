@@ -0,0 +1,227 @@
+import asyncio
+import logging
+from http_session import SharedSession, shared_session
+from retry_util import PollTimeoutError, classify, response_error
+from rate_limiter import RateLimiters, rate_limiters
+from metrics import metrics
+from tracing import tracer, digest
+from config import (GENAPI_BASE_URL, GENAPI_POLL_FIRST_CHECK, GENAPI_POLL_MIN_INTERVAL, GENAPI_POLL_MAX_INTERVAL,
+                    GENAPI_POLL_DEFAULT_INTERVAL, GENAPI_POLL_CALLBACK_FALLBACK_INTERVAL)
+
+logger = logging.getLogger(__name__)
+
+STATUS_URL = GENAPI_BASE_URL + "/api/v1/request/get/{request_id}"
+
+class _PendingTask:
+    def __init__(self, request_id: str, network: str, headers: dict, future: asyncio.Future,
+                 submitted_at: float, next_check_at: float, deadline: float, callback: bool = False):
+        self.request_id = request_id
+        self.network = network
+        self.headers = headers
+        self.future = future
+        self.submitted_at = submitted_at
+        self.next_check_at = next_check_at
+        self.deadline = deadline
+        self.callback = callback
+        self.polls = 0
+        self.waiters = 0
+        self.last_pending_at = submitted_at
+
+# Один фоновый цикл опрашивает /request/get/{id} для всех незавершённых задач gen-api.
+# Первая проверка делается быстро, дальше интервал подстраивается под наблюдаемое
+# время выполнения задач каждой сети (экспоненциальное скользящее среднее).
+# Задачи с callback_url завершаются через resolve(), а опрос для них — редкий запасной путь.
+class GenApiPoller:
+    def __init__(self, http_session: SharedSession = None, first_check: float = GENAPI_POLL_FIRST_CHECK,
+                 min_interval: float = GENAPI_POLL_MIN_INTERVAL, max_interval: float = GENAPI_POLL_MAX_INTERVAL,
+                 default_interval: float = GENAPI_POLL_DEFAULT_INTERVAL,
+                 callback_fallback_interval: float = GENAPI_POLL_CALLBACK_FALLBACK_INTERVAL, smoothing: float = 0.3,
+                 limiters: RateLimiters = None):
+        self.http_session = http_session or shared_session
+        self.limiters = limiters or rate_limiters
+        self.first_check = first_check
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.callback_fallback_interval = callback_fallback_interval
+        self.smoothing = smoothing
+        self._pending: dict[str, _PendingTask] = {}
+        self._completion_times: dict[str, float] = {}
+        self._early_results: dict[str, dict] = {}
+        self._wakeup = None
+        self._task = None
+        self._stats = {"polls": 0, "completed": 0, "failed": 0, "callbacks": 0}
+
+    async def wait(self, request_id: str, network: str, headers: dict, max_poll_time: float = 600,
+                   callback: bool = False) -> dict:
+        if request_id in self._early_results:
+            self._stats["callbacks"] += 1
+            return self._early_results.pop(request_id)
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        pending = self._pending.get(request_id)
+        if pending is None:
+            first_check = self.callback_fallback_interval if callback else self.first_check
+            pending = _PendingTask(
+                request_id=request_id,
+                network=network,
+                headers=headers,
+                future=loop.create_future(),
+                submitted_at=now,
+                next_check_at=now + first_check,
+                deadline=now + max_poll_time,
+                callback=callback,
+            )
+            self._pending[request_id] = pending
+            self._ensure_running()
+            self._wakeup.set()
+        pending.waiters += 1
+        try:
+            return await asyncio.shield(pending.future)
+        finally:
+            # Число опросов попадает в спан задания, а не в строку лога на каждый опрос
+            tracer.annotate(polls=pending.polls)
+            pending.waiters -= 1
+            # Задачу, которую больше никто не ждёт, перестаём опрашивать
+            if pending.waiters == 0 and not pending.future.done():
+                self._pending.pop(request_id, None)
+                pending.future.cancel()
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def resolve(self, request_id: str, data: dict) -> None:
+        status = data.get("status")
+        logger.info(f"Task {request_id} status: {status} (callback)")
+        if status not in ("success", "error"):
+            return
+        pending = self._pending.get(request_id)
+        if pending is None:
+            # Callback пришёл раньше, чем клиент начал ждать результат
+            if len(self._early_results) >= 1000:
+                self._early_results.pop(next(iter(self._early_results)))
+            self._early_results[request_id] = data
+            return
+        self._stats["callbacks"] += 1
+        if status == "success":
+            now = asyncio.get_running_loop().time()
+            pending.last_pending_at = now
+            self._record_completion(pending, now)
+        self._finish(pending, result=data)
+
+    def _next_interval(self, pending: _PendingTask, now: float) -> float:
+        if pending.callback:
+            return self.callback_fallback_interval
+        expected = self._completion_times.get(pending.network)
+        if expected is None:
+            interval = self.default_interval
+        else:
+            remaining = expected - (now - pending.submitted_at)
+            # До ожидаемого момента завершения спим целиком, после — проверяем чаще
+            interval = remaining if remaining > 0 else expected * 0.1
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _record_completion(self, pending: _PendingTask, now: float) -> None:
+        # Задача завершилась где-то между последней неудачной проверкой и текущей
+        duration = (pending.last_pending_at + now) / 2 - pending.submitted_at
+        previous = self._completion_times.get(pending.network)
+        if previous is None:
+            self._completion_times[pending.network] = duration
+        else:
+            self._completion_times[pending.network] = previous + self.smoothing * (duration - previous)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            now = loop.time()
+            due = [p for p in self._pending.values() if p.next_check_at <= now]
+            if not due:
+                delay = min(p.next_check_at for p in self._pending.values()) - now
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await asyncio.gather(*(self._check(p) for p in due))
+
+    async def _check(self, pending: _PendingTask) -> None:
+        loop = asyncio.get_running_loop()
+        request_id = pending.request_id
+        try:
+            if loop.time() > pending.deadline:
+                logger.error(f"Polling timeout for {pending.network} task {request_id}")
+                raise PollTimeoutError(f"Polling timeout for {pending.network} task {request_id}")
+
+            session = await self.http_session.get()
+            pending.polls += 1
+            self._stats["polls"] += 1
+            metrics.inc("bot_polls_total", provider=pending.network)
+            async with (
+                self.limiters.limit("genapi-status", pending.headers.get("Authorization")),
+                session.get(STATUS_URL.format(request_id=request_id), headers=pending.headers) as response,
+            ):
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Failed to check {pending.network} task status: {response.status} - {digest(error_text)}")
+                    raise response_error(f"Failed to check {pending.network} task status: {response.status}", response)
+                data = await response.json()
+        except Exception as e:
+            retryable, retry_after = classify(e)
+            if retryable:
+                # Сбой проверки статуса не означает сбой задачи — проверяем позже
+                now = loop.time()
+                pending.next_check_at = now + max(self._next_interval(pending, now), retry_after or 0)
+                logger.warning(f"Status check for {pending.network} task {request_id} failed, will retry: {e}")
+                return
+            self._finish(pending, exception=e)
+            return
+
+        status = data.get("status")
+        logger.debug(f"{pending.network} task {request_id} status: {status} (poll {pending.polls})")
+        now = loop.time()
+        if status in ("success", "error"):
+            logger.info(f"{pending.network} task {request_id} finished with status {status} after {pending.polls} polls")
+        if status == "success":
+            self._record_completion(pending, now)
+            self._finish(pending, result=data)
+        elif status == "error":
+            self._finish(pending, result=data)
+        else:
+            pending.last_pending_at = now
+            pending.next_check_at = now + self._next_interval(pending, now)
+
+    def _finish(self, pending: _PendingTask, result: dict = None, exception: Exception = None) -> None:
+        self._pending.pop(pending.request_id, None)
+        if pending.future.done():
+            return
+        if exception is not None:
+            self._stats["failed"] += 1
+            pending.future.set_exception(exception)
+        else:
+            self._stats["completed"] += 1
+            pending.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "in_flight": len(self._pending),
+            "completion_times": dict(self._completion_times),
+        }
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for pending in list(self._pending.values()):
+            if not pending.future.done():
+                pending.future.cancel()
+        self._pending.clear()
+
+genapi_poller = GenApiPoller()
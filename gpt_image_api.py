@@ -1,25 +1,44 @@
-import aiohttp
-import asyncio
 import logging
 from api_base import APIBase
 from api_params import GptImageParams
+from http_session import SharedSession, shared_session
+from genapi_poller import GenApiPoller, genapi_poller
+from callback_server import CallbackReceiver, callback_receiver
+from rate_limiter import RateLimiters, rate_limiters
+from submission_ledger import SubmissionLedger, submission_ledger
+from metrics import metrics
+from tracing import tracer, digest
 from key import GENAPI_API_KEY as GPT_IMAGE_API_KEY
-from retry_util import retry_request
+from retry_util import retry_request, response_error, TaskFailedError
+from config import GENAPI_BASE_URL
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Срок ожидания задачи в GenApiPoller. Таймаут попытки больше на время отправки запроса,
+# чтобы долгую задачу завершал дедлайн poller'а, а не таймаут с повторным опросом
+MAX_POLL_TIME = 600
+REQUEST_TIMEOUT = MAX_POLL_TIME + 120
+
 class GptImageAPI(APIBase):
-    def __init__(self, params: GptImageParams = None):
+    def __init__(self, params: GptImageParams = None, http_session: SharedSession = None, poller: GenApiPoller = None,
+                 callbacks: CallbackReceiver = None, limiters: RateLimiters = None, api_key: str = None,
+                 submissions: SubmissionLedger = None):
         self.params = params or GptImageParams()
-        self.base_url = "https://api.gen-api.ru/api/v1/networks/gpt-image-1"
+        self.http_session = http_session or shared_session
+        self.poller = poller or genapi_poller
+        self.callbacks = callbacks or callback_receiver
+        self.limiters = limiters or rate_limiters
+        self.submissions = submissions or submission_ledger
+        self.base_url = f"{GENAPI_BASE_URL}/api/v1/networks/gpt-image-1"
         self.headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
-            "Authorization": f"Bearer {GPT_IMAGE_API_KEY}"
+            "Authorization": f"Bearer {api_key or GPT_IMAGE_API_KEY}"
         }
 
-    @retry_request(max_retries=0, timeout=500, backoff_factor=2)
+    @metrics.track("send_request", "gpt-image-1")
+    @retry_request(timeout=REQUEST_TIMEOUT, backoff_factor=2, provider="gpt-image-1", circuit="gpt-image-1")
     async def send_request(self, **kwargs):
         prompt = kwargs.get("prompt")
         image_urls = kwargs.get("image_urls", [])
@@ -47,21 +66,34 @@ class GptImageAPI(APIBase):
             "size": params.get("size", self.params.size),
             "image": image_urls or self.params.image
         }
+        # Повтор после таймаута или сетевой ошибки продолжает опрос уже созданной задачи
+        submission_key = kwargs.get("submission_key")
+        request_id = None if is_sync else self.submissions.resume(submission_key)
+        callback_url = params.get("callback_url", self.params.callback_url)
+        callback_token = None
+        if not callback_url and not is_sync and not request_id and self.callbacks.enabled:
+            callback_token, callback_url = self.callbacks.new_callback()
+        if callback_url:
+            payload["callback_url"] = callback_url
 
-        logger.debug(f"Sending payload to gpt-image-1 API: {payload}")
+        tracer.annotate(payload=digest(payload))
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.base_url, json=payload, headers=self.headers) as response:
+            if not request_id:
+                session = await self.http_session.get()
+                async with (
+                    self.limiters.limit("genapi", self.headers["Authorization"]),
+                    session.post(self.base_url, json=payload, headers=self.headers) as response,
+                ):
                     if response.status != 200:
                         error_text = await response.text()
-                        logger.error(f"gpt-image-1 API request failed: {response.status} - {error_text}")
-                        raise Exception(f"gpt-image-1 API request failed: {response.status}")
+                        logger.error(f"gpt-image-1 API request failed: {response.status} - {digest(error_text)}")
+                        raise response_error(f"gpt-image-1 API request failed: {response.status}", response)
                     data = await response.json()
                     if is_sync:
                         image_url = data.get("result", [None])[0] or data.get("output")
                         if not image_url:
-                            logger.error(f"No image_url in synchronous gpt-image-1 response: {data}")
+                            logger.error(f"No image_url in synchronous gpt-image-1 response: {digest(data)}")
                             raise Exception("No image_url in synchronous gpt-image-1 response")
                         return image_url
                     request_id = data.get("request_id")
@@ -69,49 +101,39 @@ class GptImageAPI(APIBase):
                         logger.error("No request_id in gpt-image-1 response")
                         raise Exception("No request_id in gpt-image-1 response")
                     logger.info(f"gpt-image-1 task created: {request_id}")
+                    self.submissions.submitted(submission_key, "gpt-image-1", request_id)
 
-            image_url = await self._poll_status(request_id)
+            if callback_token:
+                self.callbacks.bind(callback_token, request_id)
+            image_url = await self._poll_status(request_id, callback=callback_token is not None)
+            self.submissions.settle(submission_key)
             return image_url
 
         except Exception as e:
+            self.submissions.settle(submission_key, e)
             logger.error(f"gpt-image-1 API error: {e}")
-            raise Exception(f"gpt-image-1 API error: {e}")
-
-    @retry_request(max_retries=0, timeout=500, backoff_factor=2)
-    async def _poll_status(self, request_id: str) -> str:
-        status_url = f"https://api.gen-api.ru/api/v1/request/get/{request_id}"
-        max_poll_time = 600
-        start_time = asyncio.get_event_loop().time()
-
-        async with aiohttp.ClientSession() as session:
-            while True:
-                if asyncio.get_event_loop().time() - start_time > max_poll_time:
-                    logger.error(f"Polling timeout for gpt-image-1 task {request_id}")
-                    raise Exception(f"Polling timeout for gpt-image-1 task {request_id}")
-
-                async with session.get(status_url, headers=self.headers) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"Failed to check gpt-image-1 task status: {response.status} - {error_text}")
-                        raise Exception(f"Failed to check gpt-image-1 task status: {response.status}")
-                    data = await response.json()
-                    status = data.get("status")
-                    logger.info(f"gpt-image-1 task {request_id} status: {status}")
+            raise Exception(f"gpt-image-1 API error: {e}") from e
+        finally:
+            if callback_token:
+                self.callbacks.release(callback_token)
 
-                    if status == "success":
-                        image_url = None
-                        result = data.get("result")
-                        if isinstance(result, list) and result:
-                            image_url = result[0]
-                        else:
-                            image_url = data.get("output")
-                        if not image_url:
-                            logger.error(f"No image_url in completed gpt-image-1 task {request_id}. Full response: {data}")
-                            raise Exception(f"Failed to retrieve image URL for gpt-image-1 task {request_id}. Response missing valid image URL.")
-                        return image_url
-                    elif status == "error":
-                        error = data.get("error", "Unknown error")
-                        logger.error(f"gpt-image-1 task {request_id} failed: {error}. Full response: {data}")
-                        raise Exception(f"gpt-image-1 task {request_id} failed: {error}")
+    @metrics.track("poll_status", "gpt-image-1")
+    async def _poll_status(self, request_id: str, callback: bool = False) -> str:
+        data = await self.poller.wait(request_id, "gpt-image-1", self.headers, max_poll_time=MAX_POLL_TIME, callback=callback)
+        status = data.get("status")
 
-                await asyncio.sleep(10)
\ No newline at end of file
+        if status == "success":
+            image_url = None
+            result = data.get("result")
+            if isinstance(result, list) and result:
+                image_url = result[0]
+            else:
+                image_url = data.get("output")
+            if not image_url:
+                logger.error(f"No image_url in completed gpt-image-1 task {request_id}. Response: {digest(data)}")
+                raise Exception(f"Failed to retrieve image URL for gpt-image-1 task {request_id}. Response missing valid image URL.")
+            return image_url
+        elif status == "error":
+            error = data.get("error", "Unknown error")
+            logger.error(f"gpt-image-1 task {request_id} failed: {error}. Response: {digest(data)}")
+            raise TaskFailedError(f"gpt-image-1 task {request_id} failed: {error}")
\ No newline at end of file
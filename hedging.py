@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from api_base import APIBase
+from config import (
+    HEDGE_NETWORKS, HEDGE_PERCENTILE, HEDGE_SAMPLES, HEDGE_MIN_SAMPLES,
+    HEDGE_BUDGET_RATIO, HEDGE_BUDGET_WINDOW, HEDGE_OBSERVE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Политика хеджирования одной сети: задержка до дубликата — перцентиль недавних
+# задержек задач, число дубликатов ограничено долей от запросов за окно.
+class HedgePolicy:
+    def __init__(self, network: str, percentile: float = HEDGE_PERCENTILE, samples: int = HEDGE_SAMPLES,
+                 min_samples: int = HEDGE_MIN_SAMPLES, budget_ratio: float = HEDGE_BUDGET_RATIO,
+                 budget_window: float = HEDGE_BUDGET_WINDOW):
+        self.network = network
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio
+        self.budget_window = budget_window
+        self._latencies: deque[float] = deque(maxlen=samples)
+        self._requests: deque[float] = deque()
+        self._hedges: deque[float] = deque()
+        self._stats = {
+            "requests": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0,
+            "observed": 0, "latency_saved": 0.0,
+        }
+
+    def record_request(self) -> None:
+        self._requests.append(time.monotonic())
+        self._stats["requests"] += 1
+
+    def record_latency(self, latency: float) -> None:
+        self._latencies.append(latency)
+
+    def hedge_delay(self) -> float | None:
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(self.percentile * (len(latencies) - 1))]
+
+    def allow_hedge(self) -> bool:
+        now = time.monotonic()
+        for events in (self._requests, self._hedges):
+            while events and now - events[0] > self.budget_window:
+                events.popleft()
+        if len(self._hedges) >= self.budget_ratio * len(self._requests):
+            self._stats["budget_denied"] += 1
+            return False
+        self._hedges.append(now)
+        self._stats["hedged"] += 1
+        return True
+
+    def record_win(self) -> None:
+        self._stats["hedge_wins"] += 1
+
+    def record_saved(self, saved: float) -> None:
+        self._stats["observed"] += 1
+        self._stats["latency_saved"] += max(saved, 0.0)
+
+    def stats(self) -> dict:
+        requests = self._stats["requests"]
+        delay = self.hedge_delay()
+        return {
+            **self._stats,
+            "latency_saved": round(self._stats["latency_saved"], 1),
+            "hedge_rate": round(self._stats["hedged"] / requests, 3) if requests else 0.0,
+            "hedge_delay": round(delay, 1) if delay is not None else None,
+        }
+
+class HedgePolicies:
+    def __init__(self, networks: list[str] = None, observe_seconds: float = HEDGE_OBSERVE_SECONDS):
+        self.networks = HEDGE_NETWORKS if networks is None else networks
+        self.observe_seconds = observe_seconds
+        self._policies: dict[str, HedgePolicy] = {}
+        self._observers: set[asyncio.Task] = set()
+
+    def enabled(self, network: str) -> bool:
+        return network in self.networks
+
+    def get(self, network: str) -> HedgePolicy:
+        policy = self._policies.get(network)
+        if policy is None:
+            policy = HedgePolicy(network)
+            self._policies[network] = policy
+        return policy
+
+    def observe(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._observers.add(task)
+        task.add_done_callback(self._observers.discard)
+
+    def stats(self) -> dict[str, dict]:
+        return {network: policy.stats() for network, policy in self._policies.items()}
+
+# Хеджирующая обёртка над клиентом gen-api: если задача не завершилась за hedge_delay,
+# отправляется дубликат (со своим ключом в журнале отправок), используется первый
+# успешный результат, второй вызов отменяется. Брошенную исходную задачу ещё
+# опрашиваем в фоне, чтобы посчитать сэкономленное время.
+class HedgedImageAPI(APIBase):
+    def __init__(self, api: APIBase, network: str, policies: HedgePolicies):
+        self.api = api
+        self.network = network
+        self.policies = policies
+        self.policy = policies.get(network)
+
+    def __getattr__(self, name: str):
+        return getattr(self.api, name)
+
+    async def send_request(self, **kwargs):
+        self.policy.record_request()
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self.api.send_request(**kwargs))
+        delay = self.policy.hedge_delay()
+        if delay is not None:
+            try:
+                await asyncio.wait({primary}, timeout=delay)
+            except asyncio.CancelledError:
+                # asyncio.wait не отменяет ожидаемые задачи: основной запрос не должен остаться сиротой
+                primary.cancel()
+                raise
+        if delay is None or primary.done() or not self.policy.allow_hedge():
+            result = await primary
+            self.policy.record_latency(time.monotonic() - started)
+            return result
+
+        key = kwargs.get("submission_key")
+        hedge_key = (key[0], f"{key[1]}.hedge") if key else None
+        logger.info(f"{self.network} task exceeded {delay:.0f}s, sending hedged duplicate")
+        hedge_started = time.monotonic()
+        hedge = asyncio.ensure_future(self.api.send_request(**{**kwargs, "submission_key": hedge_key}))
+
+        winner = None
+        pending = {primary, hedge}
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+        finally:
+            for task in pending:
+                task.cancel()
+        if winner is None:
+            raise primary.exception()
+
+        finished = time.monotonic()
+        if winner is primary:
+            self.policy.record_latency(finished - started)
+        else:
+            self.policy.record_win()
+            self.policy.record_latency(finished - hedge_started)
+            logger.info(f"{self.network} hedged duplicate won after {finished - started:.0f}s")
+            submission = self.api.submissions.lookup(key)
+            if submission is not None and primary in pending:
+                self.policies.observe(self._observe(submission.request_id, started, finished))
+        return winner.result()
+
+    async def _observe(self, request_id: str, started: float, finished: float) -> None:
+        try:
+            data = await self.api.poller.wait(request_id, self.network, self.api.headers,
+                                              max_poll_time=self.policies.observe_seconds)
+        except Exception as e:
+            # Задача не завершилась за время наблюдения: выигрыш не меньше этого срока
+            logger.debug(f"Abandoned {self.network} task {request_id} not observed to completion: {e}")
+            self.policy.record_saved(self.policies.observe_seconds)
+            return
+        latency = time.monotonic() - started
+        if data.get("status") == "success":
+            self.policy.record_latency(latency)
+        self.policy.record_saved(latency - (finished - started))
+
+hedge_policies = HedgePolicies()
@@ -0,0 +1,77 @@
+import logging
+import aiohttp
+from config import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_DNS_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Один ClientSession на процесс: создаётся лениво в работающем event loop и переиспользуется
+# всеми клиентами API. connections_created в stats() — число новых TCP/TLS-соединений.
+class SharedSession:
+    def __init__(self, limit: int = HTTP_POOL_LIMIT, limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+                 keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT, ttl_dns_cache: int = HTTP_DNS_CACHE_TTL):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self._session = None
+        self._stats = {
+            "requests": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "dns_resolutions": 0,
+            "dns_cache_hits": 0,
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self._stats["requests"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self._stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self._stats["connections_reused"] += 1
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            self._stats["dns_resolutions"] += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self._stats["dns_cache_hits"] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        return trace_config
+
+    async def get(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.ttl_dns_cache,
+                use_dns_cache=True,
+            )
+            # Все клиенты авторизуются заголовками, общий cookie jar не нужен и мешал бы между аккаунтами
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar(),
+                trace_configs=[self._trace_config()],
+            )
+            logger.info(f"Shared HTTP session created (limit={self.limit}, limit_per_host={self.limit_per_host})")
+        return self._session
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info(f"Shared HTTP session closed, stats: {self.stats()}")
+        self._session = None
+
+shared_session = SharedSession()
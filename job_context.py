@@ -0,0 +1,28 @@
+import uuid
+from telegram import Update
+from artifact_store import ArtifactStore
+from http_session import SharedSession
+from result_cache import ResultCache
+from credential_pool import CredentialPools, JobCredentials, credential_pools
+from job_store import JobStore, JobCheckpoints, job_store
+from workspace import WorkspaceManager, workspace_manager
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+# Состояние одного запуска конвейера: исходное сообщение, рабочий каталог, артефакты и контрольные точки.
+# При продолжении задания после перезапуска передаются прежний job_id, resumed и сохранённые этапы
+class JobContext:
+    def __init__(self, update: Update, user_id: int, http_session: SharedSession = None,
+                 result_cache: ResultCache = None, credentials: CredentialPools = None,
+                 store: JobStore = None, job_id: str = None, checkpoints: dict = None,
+                 workspaces: WorkspaceManager = None, resumed: bool = False):
+        self.job_id = job_id or new_job_id()
+        self.resumed = resumed
+        self.update = update
+        self.user_id = user_id
+        self.workspace = (workspaces or workspace_manager).create(self.job_id)
+        self.artifacts = ArtifactStore(self.job_id, spill_dir=self.workspace.path, http_session=http_session,
+                                       result_cache=result_cache)
+        self.credentials = JobCredentials(credentials or credential_pools)
+        self.checkpoints = JobCheckpoints(store or job_store, self.job_id, checkpoints)
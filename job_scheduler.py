@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable
+from config import (
+    JOB_MAX_CONCURRENT, JOB_MAX_PER_USER, JOB_MAX_QUEUE,
+    JOB_USER_WEIGHTS, JOB_DEFAULT_WEIGHT, JOB_STARVATION_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+class SchedulerFull(Exception):
+    pass
+
+class _QueuedJob:
+    def __init__(self, user_id: int, run: Callable[[], Awaitable[None]], enqueued_at: float):
+        self.user_id = user_id
+        self.run = run
+        self.enqueued_at = enqueued_at
+
+# Очередь заданий конвейера с ограничением параллельности: max_concurrent воркеров
+# разбирают очередь, у одного пользователя одновременно выполняется не больше
+# max_per_user заданий, а при заполненной очереди новые задания сразу отклоняются.
+# Порядок между пользователями — deficit round robin с весами из JOB_USER_WEIGHTS:
+# за круг пользователь получает слотов пропорционально весу, поэтому всплеск заданий
+# одного пользователя не задерживает остальных. Задание, прождавшее дольше
+# starvation_timeout, запускается вне очереди.
+class JobScheduler:
+    def __init__(self, max_concurrent: int = JOB_MAX_CONCURRENT, max_per_user: int = JOB_MAX_PER_USER,
+                 max_queue: int = JOB_MAX_QUEUE, weights: dict[int, float] = None,
+                 default_weight: float = JOB_DEFAULT_WEIGHT, starvation_timeout: float = JOB_STARVATION_TIMEOUT):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.weights = JOB_USER_WEIGHTS if weights is None else weights
+        self.default_weight = default_weight
+        self.starvation_timeout = starvation_timeout
+        # Очереди пользователей в порядке обхода круга DRR
+        self._queues: OrderedDict[int, deque[_QueuedJob]] = OrderedDict()
+        self._deficits: dict[int, float] = {}
+        self._running: dict[int, int] = {}
+        self._waits: dict[int, deque[float]] = {}
+        self._condition = None
+        self._workers: list[asyncio.Task] = []
+        self._wakeups: set[asyncio.Task] = set()
+        self._stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "max_queued": 0,
+                       "starvation_promotions": 0}
+
+    def weight(self, user_id: int) -> float:
+        return max(self.weights.get(user_id, self.default_weight), 0.01)
+
+    def _user_ready(self, user_id: int) -> bool:
+        return self._running.get(user_id, 0) < self.max_per_user
+
+    def _idle_workers(self) -> int:
+        return self.max_concurrent - sum(self._running.values())
+
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def submit(self, user_id: int, run: Callable[[], Awaitable[None]]) -> int:
+        # Возвращает примерную позицию в очереди; 0 — задание начнёт выполняться сразу
+        if self.queued() >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise SchedulerFull(f"Job queue is full ({self.max_queue} jobs)")
+        job = _QueuedJob(user_id, run, asyncio.get_running_loop().time())
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._stats["submitted"] += 1
+        self._stats["max_queued"] = max(self._stats["max_queued"], self.queued())
+        position = self._position(job)
+        self._notify()
+        return position
+
+    def _position(self, job: _QueuedJob) -> int:
+        # Оценка по DRR: пока пользователь дождётся своего k-го задания, другой
+        # пользователь успеет получить примерно k * (его вес / наш вес) слотов
+        own = self._queues[job.user_id]
+        user_ahead = len(own) - 1
+        user_busy = self._running.get(job.user_id, 0) + user_ahead >= self.max_per_user
+        rounds = (user_ahead + 1) / self.weight(job.user_id)
+        others_ahead = sum(
+            min(len(queue), int(rounds * self.weight(user_id)))
+            for user_id, queue in self._queues.items() if user_id != job.user_id
+        )
+        if not user_busy and user_ahead + others_ahead < self._idle_workers():
+            return 0
+        return user_ahead + others_ahead + 1
+
+    def _notify(self) -> None:
+        if self._condition is None:
+            return
+        # Ссылка на задачу держится до её завершения, иначе сборщик мусора может её удалить
+        task = asyncio.get_running_loop().create_task(self._wake())
+        self._wakeups.add(task)
+        task.add_done_callback(self._wakeups.discard)
+
+    async def _wake(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _take(self, user_id: int) -> _QueuedJob:
+        queue = self._queues[user_id]
+        job = queue.popleft()
+        if not queue:
+            # Пустая очередь выходит из круга и не копит дефицит
+            del self._queues[user_id]
+            self._deficits.pop(user_id, None)
+        return job
+
+    def _starving_job(self) -> _QueuedJob | None:
+        now = asyncio.get_running_loop().time()
+        oldest = None
+        for user_id, queue in self._queues.items():
+            if self._user_ready(user_id) and now - queue[0].enqueued_at > self.starvation_timeout:
+                if oldest is None or queue[0].enqueued_at < oldest.enqueued_at:
+                    oldest = queue[0]
+        if oldest is not None:
+            self._stats["starvation_promotions"] += 1
+            return self._take(oldest.user_id)
+        return None
+
+    def _next_job(self) -> _QueuedJob | None:
+        job = self._starving_job()
+        if job is not None:
+            return job
+        ready = [user_id for user_id in self._queues if self._user_ready(user_id)]
+        if not ready:
+            return None
+        while True:
+            user_id = next(user_id for user_id in self._queues if self._user_ready(user_id))
+            deficit = self._deficits.get(user_id, 0.0)
+            if deficit < 1:
+                deficit += self.weight(user_id)
+            if deficit >= 1:
+                self._deficits[user_id] = deficit - 1
+                job = self._take(user_id)
+                if user_id in self._queues and self._deficits[user_id] < 1:
+                    self._queues.move_to_end(user_id)
+                return job
+            # Кванта пока не хватает на задание — переходим к следующему пользователю
+            self._deficits[user_id] = deficit
+            self._queues.move_to_end(user_id)
+
+    def start(self) -> None:
+        if self._workers:
+            return
+        self._condition = asyncio.Condition()
+        self._workers = [
+            asyncio.get_running_loop().create_task(self._worker(i)) for i in range(self.max_concurrent)
+        ]
+        logger.info(f"Job scheduler started: {self.max_concurrent} workers, {self.max_per_user} per user")
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            async with self._condition:
+                job = self._next_job()
+                while job is None:
+                    await self._condition.wait()
+                    job = self._next_job()
+                self._running[job.user_id] = self._running.get(job.user_id, 0) + 1
+
+            waited = asyncio.get_running_loop().time() - job.enqueued_at
+            self._waits.setdefault(job.user_id, deque(maxlen=200)).append(waited)
+            logger.info(f"Worker {index} starts job of user {job.user_id} after {waited:.1f}s in queue")
+            try:
+                await job.run()
+                self._stats["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"Job of user {job.user_id} failed: {e}")
+            finally:
+                self._running[job.user_id] -= 1
+                if not self._running[job.user_id]:
+                    del self._running[job.user_id]
+                self._notify()
+
+    @staticmethod
+    def _percentile(values: list[float], q: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def wait_stats(self) -> dict[int, dict]:
+        # Время ожидания в очереди по пользователям (последние 200 заданий каждого)
+        return {
+            user_id: {
+                "jobs": len(waits),
+                "weight": self.weight(user_id),
+                "p50": round(self._percentile(list(waits), 0.5), 2),
+                "p95": round(self._percentile(list(waits), 0.95), 2),
+                "max": round(max(waits), 2),
+            }
+            for user_id, waits in self._waits.items() if waits
+        }
+
+    def stats(self) -> dict:
+        return {**self._stats, "queued": self.queued(), "running": sum(self._running.values()),
+                "users_queued": len(self._queues)}
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues.clear()
+        self._deficits.clear()
+        self._running.clear()
+
+job_scheduler = JobScheduler()
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from config import JOB_STORE_PATH, JOB_RESUME_MAX_AGE, JOB_RESUME_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    update_json TEXT NOT NULL,
+    resumes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    network TEXT NOT NULL,
+    request_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+"""
+
+# Незавершённое задание из хранилища: исходный Update Telegram и пройденные этапы
+class StoredJob:
+    def __init__(self, job_id: str, user_id: int, update_json: str, resumes: int, created_at: float):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.update_json = update_json
+        self.resumes = resumes
+        self.created_at = created_at
+
+# Хранилище состояния заданий в SQLite. Задание записывается при старте вместе с исходным
+# Update, после каждого этапа сохраняется контрольная точка (сценарий, URL сгенерированных
+# и улучшенных кадров), а журнал отправок — id задач gen-api и видео Pika. Завершённое
+# задание удаляется; оставшиеся после падения продолжаются при запуске бота.
+class JobStore:
+    def __init__(self, path: str = JOB_STORE_PATH, max_age: float = JOB_RESUME_MAX_AGE,
+                 max_attempts: int = JOB_RESUME_MAX_ATTEMPTS):
+        self.path = path
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self._connection = None
+        self._lock = threading.Lock()
+        self._writes: set[asyncio.Task] = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                return connection.execute(sql, params).fetchall()
+
+    async def _run(self, sql: str, params: tuple = ()) -> list[tuple]:
+        return await asyncio.to_thread(self._execute, sql, params)
+
+    async def start(self, job_id: str, user_id: int, update_json: str) -> None:
+        now = time.time()
+        await self._run(
+            "INSERT OR IGNORE INTO jobs (job_id, user_id, update_json, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, user_id, update_json, now, now),
+        )
+
+    async def checkpoint(self, job_id: str, stage: str, value) -> None:
+        now = time.time()
+        await self._run(
+            "INSERT OR REPLACE INTO checkpoints (job_id, stage, value, updated_at) VALUES (?, ?, ?, ?)",
+            (job_id, stage, json.dumps(value, ensure_ascii=False), now),
+        )
+        await self._run("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (now, job_id))
+
+    async def checkpoints(self, job_id: str) -> dict:
+        rows = await self._run("SELECT stage, value FROM checkpoints WHERE job_id = ?", (job_id,))
+        return {stage: json.loads(value) for stage, value in rows}
+
+    def save_submission(self, job_id: str, stage: str, network: str, request_id: str, state: str) -> None:
+        # Вызывается из синхронного журнала отправок: запись выполняется в фоне
+        task = asyncio.get_running_loop().create_task(self._run(
+            "INSERT OR REPLACE INTO submissions (job_id, stage, network, request_id, state, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, stage, network, request_id, state, time.time()),
+        ))
+        self._writes.add(task)
+        task.add_done_callback(self._write_done)
+
+    def _write_done(self, task: asyncio.Task) -> None:
+        self._writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Failed to save submission: {task.exception()}")
+
+    async def submissions(self, job_id: str) -> list[tuple[str, str, str, str]]:
+        return await self._run(
+            "SELECT stage, network, request_id, state FROM submissions WHERE job_id = ?", (job_id,)
+        )
+
+    async def finish(self, job_id: str) -> None:
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        for table in ("submissions", "checkpoints", "jobs"):
+            await self._run(f"DELETE FROM {table} WHERE job_id = ?", (job_id,))
+
+    async def unfinished(self) -> list[StoredJob]:
+        # Записи, дописанные в фоне уже после завершения задания
+        for table in ("submissions", "checkpoints"):
+            await self._run(f"DELETE FROM {table} WHERE job_id NOT IN (SELECT job_id FROM jobs)")
+        rows = await self._run(
+            "SELECT job_id, user_id, update_json, resumes, created_at FROM jobs ORDER BY created_at"
+        )
+        jobs = []
+        for row in rows:
+            job = StoredJob(*row)
+            if time.time() - job.created_at > self.max_age or job.resumes >= self.max_attempts:
+                logger.warning(f"Dropping stale job {job.job_id} (resumes={job.resumes})")
+                await self.finish(job.job_id)
+                continue
+            jobs.append(job)
+        return jobs
+
+    async def mark_resumed(self, job_id: str) -> None:
+        await self._run("UPDATE jobs SET resumes = resumes + 1, updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    async def close(self) -> None:
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+# Контрольные точки одного задания: загружаются при продолжении, сохраняются после этапов
+class JobCheckpoints:
+    def __init__(self, store: JobStore, job_id: str, values: dict = None):
+        self.store = store
+        self.job_id = job_id
+        self.values = values or {}
+
+    def get(self, stage: str):
+        return self.values.get(stage)
+
+    async def begin(self, user_id: int, update_json: str) -> None:
+        # Без хранилища задание выполняется как обычно, только не продолжится после перезапуска
+        try:
+            await self.store.start(self.job_id, user_id, update_json)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to record job {self.job_id}: {e}")
+
+    async def finish(self) -> None:
+        try:
+            await self.store.finish(self.job_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to remove finished job {self.job_id}: {e}")
+
+    async def save(self, stage: str, value) -> None:
+        self.values[stage] = value
+        try:
+            await self.store.checkpoint(self.job_id, stage, value)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to checkpoint {stage} for job {self.job_id}: {e}")
+
+job_store = JobStore()
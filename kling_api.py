@@ -1,36 +1,57 @@
-import aiohttp
-import asyncio
 import logging
 from api_base import APIBase
 from api_params import KlingParams
+from http_session import SharedSession, shared_session
+from genapi_poller import GenApiPoller, genapi_poller
+from callback_server import CallbackReceiver, callback_receiver
+from rate_limiter import RateLimiters, rate_limiters
+from submission_ledger import SubmissionLedger, submission_ledger
+from metrics import metrics
+from tracing import tracer, digest
 from key import GENAPI_API_KEY
+from retry_util import retry_request, response_error, TaskFailedError
+from config import GENAPI_BASE_URL
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Срок ожидания задачи в GenApiPoller. Таймаут попытки больше на время отправки запроса,
+# чтобы долгую задачу завершал дедлайн poller'а, а не таймаут с повторным опросом
+MAX_POLL_TIME = 6000
+REQUEST_TIMEOUT = MAX_POLL_TIME + 120
+
 class KlingAPI(APIBase):
-    def __init__(self, params: KlingParams = None):
+    def __init__(self, params: KlingParams = None, http_session: SharedSession = None, poller: GenApiPoller = None,
+                 callbacks: CallbackReceiver = None, limiters: RateLimiters = None, api_key: str = None,
+                 submissions: SubmissionLedger = None):
         self.params = params or KlingParams()
-        self.base_url = "https://api.gen-api.ru/api/v1/networks/kling-elements"
+        self.http_session = http_session or shared_session
+        self.poller = poller or genapi_poller
+        self.callbacks = callbacks or callback_receiver
+        self.limiters = limiters or rate_limiters
+        self.submissions = submissions or submission_ledger
+        self.base_url = f"{GENAPI_BASE_URL}/api/v1/networks/kling-elements"
         self.headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
-            "Authorization": f"Bearer {GENAPI_API_KEY}"
+            "Authorization": f"Bearer {api_key or GENAPI_API_KEY}"
         }
 
     async def validate_image_urls(self, image_urls):
-        async with aiohttp.ClientSession() as session:
-            for url in image_urls:
-                try:
-                    async with session.head(url, headers=self.headers, timeout=5) as response:
-                        if response.status != 200:
-                            logger.warning(f"Image URL inaccessible: {url} (status: {response.status})")
-                            return False
-                except Exception as e:
-                    logger.warning(f"Failed to validate image URL {url}: {e}")
-                    return False
+        session = await self.http_session.get()
+        for url in image_urls:
+            try:
+                async with session.head(url, headers=self.headers, timeout=5) as response:
+                    if response.status != 200:
+                        logger.warning(f"Image URL inaccessible: {url} (status: {response.status})")
+                        return False
+            except Exception as e:
+                logger.warning(f"Failed to validate image URL {url}: {e}")
+                return False
         return True
 
+    @metrics.track("send_request", "kling-elements")
+    @retry_request(timeout=REQUEST_TIMEOUT, backoff_factor=2, provider="kling-elements", circuit="kling-elements")
     async def send_request(self, **kwargs):
         prompt = kwargs.get("prompt")
         image_urls = kwargs.get("image_urls", [])
@@ -58,63 +79,57 @@ class KlingAPI(APIBase):
         if params.get("callback_url"):
             payload["callback_url"] = params.get("callback_url")
 
-        logger.debug(f"Sending payload to Kling API: {payload}")
-
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(self.base_url, json=payload, headers=self.headers) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Kling API request failed: {response.status} - {error_text}")
-                            raise Exception(f"Kling API request failed: {response.status}")
-                        data = await response.json()
-                        request_id = data.get("request_id")
-                        if not request_id:
-                            logger.error("No request_id in Kling response")
-                            raise Exception("No request_id in Kling response")
-                        logger.info(f"Kling task created: {request_id}")
+        tracer.annotate(payload=digest(payload))
 
-                        video_url = await self._poll_status(request_id)
-                        return video_url
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    logger.warning(f"Retrying Kling API request, attempt {attempt + 1}: {e}")
-                    await asyncio.sleep(2 ** attempt)
-                    continue
-                logger.error(f"Kling API request failed after {max_retries} attempts: {e}")
-                raise
-
-    async def _poll_status(self, request_id: str) -> str:
-        status_url = f"https://api.gen-api.ru/api/v1/request/get/{request_id}"
-        max_poll_time = 6000  # 10 minutes
-        start_time = asyncio.get_event_loop().time()
-
-        async with aiohttp.ClientSession() as session:
-            while True:
-                if asyncio.get_event_loop().time() - start_time > max_poll_time:
-                    logger.error(f"Polling timeout for Kling task {request_id}")
-                    raise Exception(f"Polling timeout for Kling task {request_id}")
-
-                async with session.get(status_url, headers=self.headers) as response:
+        # Повтор после таймаута или сетевой ошибки продолжает опрос уже созданной задачи
+        submission_key = kwargs.get("submission_key")
+        request_id = self.submissions.resume(submission_key)
+        callback_token = None
+        if not params.get("callback_url") and not request_id and self.callbacks.enabled:
+            callback_token, payload["callback_url"] = self.callbacks.new_callback()
+        try:
+            if not request_id:
+                session = await self.http_session.get()
+                async with (
+                    self.limiters.limit("genapi", self.headers["Authorization"]),
+                    session.post(self.base_url, json=payload, headers=self.headers) as response,
+                ):
                     if response.status != 200:
                         error_text = await response.text()
-                        logger.error(f"Failed to check Kling task status: {response.status} - {error_text}")
-                        raise Exception(f"Failed to check Kling task status: {response.status}")
+                        logger.error(f"Kling API request failed: {response.status} - {digest(error_text)}")
+                        raise response_error(f"Kling API request failed: {response.status}", response)
                     data = await response.json()
-                    status = data.get("status")
-                    logger.info(f"Kling task {request_id} status: {status}")
+                    request_id = data.get("request_id")
+                    if not request_id:
+                        logger.error("No request_id in Kling response")
+                        raise Exception("No request_id in Kling response")
+                    logger.info(f"Kling task created: {request_id}")
+                    self.submissions.submitted(submission_key, "kling-elements", request_id)
+
+            if callback_token:
+                self.callbacks.bind(callback_token, request_id)
+            video_url = await self._poll_status(request_id, callback=callback_token is not None)
+            self.submissions.settle(submission_key)
+            return video_url
+        except Exception as e:
+            self.submissions.settle(submission_key, e)
+            raise
+        finally:
+            if callback_token:
+                self.callbacks.release(callback_token)
 
-                    if status == "success":
-                        video_url = data.get("output") or (data.get("result")[0] if isinstance(data.get("result"), list) and data.get("result") else None)
-                        if not video_url:
-                            logger.error(f"No video_url in completed Kling task {request_id}. Full response: {data}")
-                            raise Exception(f"No video_url in completed Kling task {request_id}")
-                        return video_url
-                    elif status == "error":
-                        error = data.get("error", "Unknown error")
-                        logger.error(f"Kling task {request_id} failed: {error}. Full response: {data}")
-                        raise Exception(f"Kling task {request_id} failed: {error}")
+    @metrics.track("poll_status", "kling-elements")
+    async def _poll_status(self, request_id: str, callback: bool = False) -> str:
+        data = await self.poller.wait(request_id, "kling-elements", self.headers, max_poll_time=MAX_POLL_TIME, callback=callback)
+        status = data.get("status")
 
-                await asyncio.sleep(10)
\ No newline at end of file
+        if status == "success":
+            video_url = data.get("output") or (data.get("result")[0] if isinstance(data.get("result"), list) and data.get("result") else None)
+            if not video_url:
+                logger.error(f"No video_url in completed Kling task {request_id}. Response: {digest(data)}")
+                raise Exception(f"No video_url in completed Kling task {request_id}")
+            return video_url
+        elif status == "error":
+            error = data.get("error", "Unknown error")
+            logger.error(f"Kling task {request_id} failed: {error}. Response: {digest(data)}")
+            raise TaskFailedError(f"Kling task {request_id} failed: {error}")
\ No newline at end of file
@@ -0,0 +1,142 @@
+import contextlib
+import functools
+import logging
+import time
+from aiohttp import web
+from tracing import tracer
+from config import METRICS_HOST, METRICS_PORT, METRICS_LATENCY_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+_DESCRIPTIONS = {
+    "bot_stage_latency_seconds": ("histogram", "Latency of pipeline stages and provider calls"),
+    "bot_stage_calls_total": ("counter", "Completed calls per stage and provider"),
+    "bot_stage_errors_total": ("counter", "Failed calls per stage and provider"),
+    "bot_polls_total": ("counter", "Status polls sent to providers"),
+    "bot_bytes_total": ("counter", "Bytes downloaded from and uploaded to providers"),
+    "bot_queue_depth": ("gauge", "Jobs waiting in the scheduler queue"),
+    "bot_jobs_running": ("gauge", "Jobs currently being processed"),
+    "bot_inflight_tasks": ("gauge", "Provider tasks currently being polled"),
+}
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in items) + "}"
+
+# Реестр метрик в памяти процесса. Счётчики и гистограммы обновляются на горячем пути,
+# мгновенные значения (очередь, задачи в работе) снимаются коллекторами при каждом запросе /metrics.
+class MetricsRegistry:
+    def __init__(self, buckets: tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, list]] = {}
+        self._collectors = []
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        # [счётчики по корзинам..., сумма, количество]
+        histogram = series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, provider: str):
+        started = time.monotonic()
+        try:
+            # Каждый замер этапа — также спан в трассе текущего задания
+            with tracer.span(stage, provider=provider):
+                yield
+        except Exception:
+            self.inc("bot_stage_errors_total", stage=stage, provider=provider)
+            raise
+        finally:
+            self.observe("bot_stage_latency_seconds", time.monotonic() - started, stage=stage, provider=provider)
+            self.inc("bot_stage_calls_total", stage=stage, provider=provider)
+
+    def track(self, stage: str, provider: str):
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.timer(stage, provider):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_collector(self, collector) -> None:
+        # collector() -> [(имя, значение, {метки}), ...]
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        gauges: dict[str, dict[tuple, float]] = {}
+        for collector in self._collectors:
+            try:
+                for name, value, labels in collector():
+                    gauges.setdefault(name, {})[_labels(labels)] = value
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+
+        lines = []
+        for name, series in [*self._counters.items(), *gauges.items()]:
+            self._header(lines, name)
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in self._histograms.items():
+            self._header(lines, name)
+            for labels, histogram in series.items():
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {round(histogram[-2], 6)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _header(lines: list[str], name: str) -> None:
+        kind, description = _DESCRIPTIONS.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+# Локальный HTTP-эндпоинт /metrics в текстовом формате Prometheus
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def start(self) -> None:
+        if not self.port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics = MetricsRegistry()
+metrics_server = MetricsServer(metrics)
@@ -1,41 +1,60 @@
-import requests
-from playwright.sync_api import sync_playwright
+import asyncio
+import threading
+import aiohttp
+from playwright.async_api import async_playwright
 from key import PIKA_EMAIL, PIKA_PASSWORD
 from api_base import APIBase
+from http_session import SharedSession, shared_session
+from download_util import download_to_file
+from pika_token_store import PikaTokenStore, pika_token_store
+from pika_status import PikaStatusAggregator, pika_status_aggregator
+from retry_util import retry_request, response_error, circuit_guard
+from rate_limiter import RateLimiters, rate_limiters
+from submission_ledger import SubmissionLedger, submission_ledger
+from metrics import metrics
+from tracing import digest
+from config import PIKA_API_URL, PIKA_LIBRARY_URL
 import json
 import base64
-from time import sleep
 from typing import Any, Literal, Union, Optional
 import logging
 logger = logging.getLogger(__name__)
 
-class PikaAPI(APIBase):
-    def __init__(self, email: str = PIKA_EMAIL, password: str = PIKA_PASSWORD, params: Any = ""):
+class AsyncPikaAPI(APIBase):
+    def __init__(self, email: str = PIKA_EMAIL, password: str = PIKA_PASSWORD, params: Any = "", http_session: SharedSession = None,
+                 token_store: PikaTokenStore = None, status_aggregator: PikaStatusAggregator = None,
+                 limiters: RateLimiters = None, submissions: SubmissionLedger = None):
         self.email = email
         self.password = password
+        self.http_session = http_session or shared_session
+        self.token_store = token_store or pika_token_store
+        self.status_aggregator = status_aggregator or pika_status_aggregator
+        self.limiters = limiters or rate_limiters
+        self.submissions = submissions or submission_ledger
         self.token = None
         self.access_token = None
         self.user_id = None
+        self.expires_at = None
 
-    def login(self) -> str:
+    async def login(self) -> str:
         token = ""
-        with sync_playwright() as p:
+        async with async_playwright() as p:
             try:
-                browser = p.chromium.launch(headless=True)
-                page = browser.new_page()
-                page.goto("https://pika.art/login")
-                page.get_by_text("Sign in with an email").click()
-                page.wait_for_timeout(1000)
-                page.get_by_placeholder("example@gmail.com").fill(self.email)
-                page.wait_for_timeout(1000)
-                page.get_by_placeholder("Your password").fill(self.password)
-                page.wait_for_timeout(1000)
-                page.get_by_role("button", name="Sign in").click()
-                page.wait_for_timeout(2000)
-                cookies = page.context.cookies()
-                browser.close()
+                browser = await p.chromium.launch(headless=True)
+                page = await browser.new_page()
+                await page.goto("https://pika.art/login")
+                await page.get_by_text("Sign in with an email").click()
+                await page.wait_for_timeout(1000)
+                await page.get_by_placeholder("example@gmail.com").fill(self.email)
+                await page.wait_for_timeout(1000)
+                await page.get_by_placeholder("Your password").fill(self.password)
+                await page.wait_for_timeout(1000)
+                await page.get_by_role("button", name="Sign in").click()
+                await page.wait_for_timeout(2000)
+                cookies = await page.context.cookies()
+                await browser.close()
             except Exception as e:
-                print(f"An error occurred: {e}")
+                logger.error(f"An error occurred during Pika login: {e}")
                 return ""
         if not cookies:
             raise Exception("Login failed, cookie not found.")
@@ -45,15 +64,17 @@ class PikaAPI(APIBase):
                 break
         self.token = token
         return token
-    
-    def download_video(self, video_url: str | int, output_path: str) -> None:
+
+    async def download_video(self, video_url: str | int, output_path: str) -> None:
         if not video_url or not isinstance(video_url, str):
             raise ValueError("Video URL is empty or invalid.")
-        response = requests.get(video_url)
-        if response.status_code != 200:
-            raise Exception(f"Failed to download video: {response.status_code}")
-        with open(output_path, "wb") as f:
-            f.write(response.content)
+        result = await download_to_file(video_url, output_path, http_session=self.http_session)
+        logger.info(f"Video downloaded: {result}")
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
 
     def parse_token(self, cookie: str) -> tuple[str, str]:
         if not cookie:
@@ -70,12 +91,22 @@ class PikaAPI(APIBase):
                     user_id = decode_jwt["user"]["id"]
             self.access_token = access_token
             self.user_id = user_id
+            self.expires_at = decode_jwt.get("expires_at") or self._jwt_expiry(access_token)
             return access_token, user_id
         except Exception as e:
-            print(f"Failed to decode JWT: {e}")
+            logger.error(f"Failed to decode JWT: {e}")
             return "", ""
 
-    def generate_video(
+    @staticmethod
+    def _jwt_expiry(access_token: str) -> float | None:
+        try:
+            payload = access_token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return claims.get("exp")
+        except (IndexError, ValueError, AttributeError):
+            return None
+
+    async def generate_video(
         self,
         access_token: str,
         images_path: Optional[list[str]] = None,
@@ -88,133 +119,230 @@ class PikaAPI(APIBase):
     ) -> str:
         if (images_path is None and image_content is None) or (images_path and image_content):
             raise ValueError("Exactly one of images_path or image_content must be provided")
-        
+
         headers = {
             "Authorization": f"Bearer {access_token}",
         }
-        files: dict[str, Any] = {
-            "frameDurations": (None, json.dumps(frame_durations)),
-            "transitionPrompts": (None, json.dumps(frame_prompts)),
-            "resolution": (None, "1080p"),
-            "contentType": (None, "pikaframes"),
-            "loop": (None, loop),
-            "model": (None, "2.2"),
-            "options": (None, json.dumps(options)),
-            "userId": (None, user_id),
-        }
-
         if images_path:
-            for i, image_path in enumerate(images_path):
-                files[f"frame-{i + 1}"] = (image_path, open(image_path, "rb"), "image/png")
-            files["contentType"] = (None, "i2v")
-            files["image"] = (images_path[0], open(images_path[0], "rb"), "image/png")
-        elif image_content:
+            names = list(images_path)
+            image_content = [await asyncio.to_thread(self._read_file, path) for path in images_path]
+        else:
+            names = [f"image_{i + 1}.png" for i in range(len(image_content))]
             for i, content in enumerate(image_content):
                 if not content:
                     raise ValueError(f"Image content at index {i} is empty")
-                files[f"frame-{i + 1}"] = (f"image_{i + 1}.png", content, "image/png")
-            files["contentType"] = (None, "i2v")
-            files["image"] = (f"image_1.png", image_content[0], "image/png")
-
-        response = requests.post("https://api.pika.art/generate/v2",
-                                headers=headers,
-                                files=files)
-        data = response.json()
+
+        form = aiohttp.FormData()
+        form.add_field("frameDurations", json.dumps(frame_durations))
+        form.add_field("transitionPrompts", json.dumps(frame_prompts))
+        form.add_field("resolution", "1080p")
+        form.add_field("loop", loop)
+        form.add_field("model", "2.2")
+        form.add_field("options", json.dumps(options))
+        form.add_field("userId", user_id)
+        for i, (name, content) in enumerate(zip(names, image_content)):
+            form.add_field(f"frame-{i + 1}", content, filename=name, content_type="image/png")
+        form.add_field("contentType", "i2v")
+        form.add_field("image", image_content[0], filename=names[0], content_type="image/png")
+
+        async with circuit_guard("pika-generate"):
+            session = await self.http_session.get()
+            async with (
+                self.limiters.limit("pika-generate", self.email),
+                session.post(f"{PIKA_API_URL}/generate/v2", headers=headers, data=form) as response,
+            ):
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"Pika generate request failed: {response.status} - {digest(error_text)}")
+                    raise response_error(f"Pika generate request failed: {response.status}", response)
+                data = await response.json(content_type=None)
+        metrics.inc("bot_bytes_total", sum(len(content) for content in image_content), direction="upload", target="pika")
         if not data.get("success"):
             raise Exception(f"Failed to generate video: {data}")
         return data.get("data", {}).get("id", "")
-    
-    def get_video(self, token: str, video_id: str) -> dict[str, Union[str, int]]:
-        cookies = {"sb-login-auth-token": token}
-        headers = {"Next-Action": "a4f7d00566d7755f69cb53e2b2bbaf32236f107e"}
-        data = json.dumps([{"ids": [video_id]}])
-        
-        response = requests.post(
-            "https://pika.art/library",
-            cookies=cookies,
-            headers=headers,
-            data=data
-        )
-        logger.debug(f"get_video response for video_id={video_id}: status={response.status_code}, text={response.text}")
-        
-        if response.status_code != 200:
-            logger.error(f"Failed to get video status: HTTP {response.status_code}")
+
+    async def get_videos(self, token: str, video_ids: list[str]) -> dict[str, dict[str, Union[str, int]]]:
+        headers = {
+            "Next-Action": "a4f7d00566d7755f69cb53e2b2bbaf32236f107e",
+            "Cookie": f"sb-login-auth-token={token}",
+        }
+        data = json.dumps([{"ids": list(video_ids)}])
+
+        async with circuit_guard("pika-library"):
+            session = await self.http_session.get()
+            async with (
+                self.limiters.limit("pika-library", self.email),
+                session.post(PIKA_LIBRARY_URL, headers=headers, data=data) as response,
+            ):
+                status = response.status
+                text = await response.text()
+            if status >= 500 or status == 429:
+                raise response_error(f"Pika library request failed: {status}", response)
+        if status != 200:
+            logger.error(f"Failed to get video status: HTTP {status}")
             return {}
-        
+
         try:
             # Парсинг ответа с защитой от неожиданного формата
-            lines = response.text.split("\n")
-            logger.debug(f"Response lines: {lines}")
+            lines = text.split("\n")
             if len(lines) < 2:
                 raise ValueError("Response does not contain enough lines")
             json_data = lines[1][2:]  # Убираем префикс
             data = json.loads(json_data)
-            video = data["data"]["results"][0]["videos"][0]
-            return video
-        except (IndexError, json.JSONDecodeError, KeyError) as e:
-            logger.error(f"Error parsing video response: {e}, raw response: {response.text}")
+            entries = []
+            for result in data["data"]["results"]:
+                result_videos = result.get("videos") or []
+                video = result_videos[0] if result_videos else None
+                entries.append((result.get("id") or (video or {}).get("id"), video))
+            # По порядку результаты сопоставляются с запросом, только если ни один id ответа
+            # не совпал с запрошенными, а число результатов совпадает; смешивать два способа нельзя
+            positional = len(entries) == len(video_ids) and not any(
+                result_id in video_ids for result_id, _ in entries
+            )
+            videos = {}
+            for index, (result_id, video) in enumerate(entries):
+                if video is None:
+                    continue
+                if positional:
+                    result_id = video_ids[index]
+                # Уже сопоставленный статус не перезаписывается чужим результатом
+                if result_id and result_id not in videos:
+                    videos[result_id] = video
+            missing = [video_id for video_id in video_ids if video_id not in videos]
+            if missing:
+                logger.warning(f"Pika library response has no status for {len(missing)} of {len(video_ids)} videos: {missing}")
+            return videos
+        except (IndexError, json.JSONDecodeError, KeyError, ValueError, AttributeError, TypeError) as e:
+            logger.error(f"Error parsing video response: {e}, raw response: {digest(text)}")
             return {}
 
-    def poll_and_download_video(self, token: str, video_id: str, output_path: str) -> None:
-        max_attempts = 30  # Ограничение на количество попыток (5 минут с интервалом 10 сек)
-        attempt = 0
-        
-        while attempt < max_attempts:
-            video = self.get_video(token, video_id)
-            status = video.get("status", "unknown")
-            logger.info(f"Polling video_id={video_id}, attempt={attempt + 1}/{max_attempts}, status={status}")
-            
-            if not video:
-                logger.warning("Empty video response, checking token...")
-                token = self.login()  # Обновляем токен, если запрос не удался
-                self.parse_token(token[7:])
-                continue
-            
-            if status == "finished":
-                self.download_video(video.get("sharingUrl", ""), output_path)
-                logger.info(f"Video downloaded to {output_path}")
-                return
-            elif status in ["failed", "error"]:
-                raise Exception(f"Video generation failed with status: {status}")
-            
-            sleep(10)
-            attempt += 1
-        
-        raise TimeoutError(f"Video status polling timed out after {max_attempts} attempts")
+    async def get_video(self, token: str, video_id: str) -> dict[str, Union[str, int]]:
+        videos = await self.get_videos(token, [video_id])
+        return videos.get(video_id, {})
 
-    def send_request(
+    @metrics.track("poll_and_download", "pika")
+    async def poll_and_download_video(self, token: str, video_id: str, output_path: str) -> None:
+        video = await self.status_aggregator.wait(self, video_id)
+        await self.download_video(video.get("sharingUrl", ""), output_path)
+        logger.info(f"Video downloaded to {output_path}")
+
+    @metrics.track("send_request", "pika")
+    @retry_request(timeout=900, backoff_factor=2, provider="pika")
+    async def send_request(
         self,
         image_paths: Optional[list[str]] = None,
         image_content: Optional[list[bytes]] = None,
         prompt: str = "",
         params: dict[str, Any] = None,
-        output_path: str = "output.mp4"
+        output_path: str = "output.mp4",
+        submission_key: tuple[str, str] = None
     ) -> str:
         if (image_paths is None and image_content is None) or (image_paths and image_content):
             raise ValueError("Exactly one of image_paths or image_content must be provided")
 
         if not self.token:
-            self.token = self.login()
-            logger.info("Logged in and token obtained")
-        
+            self.token = await self.token_store.get_token(self)
+            logger.info("Pika token obtained")
+
         access_token, user_id = self.parse_token(self.token[7:])
         if not access_token or not user_id:
             raise ValueError("Failed to parse token")
-        
-        gen_video_id = self.generate_video(
-            access_token=access_token,
-            images_path=image_paths,
-            image_content=image_content,
-            frame_durations=params.get("frame_durations", [2]),
-            frame_prompts=params.get("frame_prompts", [prompt]),
-            options=params.get("options", {}),
-            user_id=user_id,
-            loop=params.get("loop", "false"),
-        )
+
+        # Повтор продолжает ждать уже запущенное видео; новая генерация — только после
+        # статуса failed/error от Pika
+        gen_video_id = self.submissions.resume(submission_key)
         if not gen_video_id:
-            logger.error("Video generation failed: no video ID returned")
-            return ""
-        
-        logger.info(f"Video generation started, video_id={gen_video_id}")
-        self.poll_and_download_video(self.token, gen_video_id, output_path)
-        return output_path
\ No newline at end of file
+            gen_video_id = await self.generate_video(
+                access_token=access_token,
+                images_path=image_paths,
+                image_content=image_content,
+                frame_durations=params.get("frame_durations", [2]),
+                frame_prompts=params.get("frame_prompts", [prompt]),
+                options=params.get("options", {}),
+                user_id=user_id,
+                loop=params.get("loop", "false"),
+            )
+            if not gen_video_id:
+                logger.error("Video generation failed: no video ID returned")
+                return ""
+
+            logger.info(f"Video generation started, video_id={gen_video_id}")
+            self.submissions.submitted(submission_key, "pika", gen_video_id)
+
+        try:
+            await self.poll_and_download_video(self.token, gen_video_id, output_path)
+        except Exception as e:
+            self.submissions.settle(submission_key, e)
+            raise
+        self.submissions.settle(submission_key)
+        return output_path
+
+# Синхронная обёртка над AsyncPikaAPI для кода вне event loop. Все вызовы выполняются в одном
+# долгоживущем event loop в отдельном потоке. Объекты asyncio привязаны к своему циклу, поэтому
+# HTTP-сессия, хранилище токенов, агрегатор статусов и лимитеры у обёртки собственные, а не общие
+# синглтоны бота; токены при этом общие через файл кэша.
+class PikaAPI(APIBase):
+    def __init__(self, email: str = PIKA_EMAIL, password: str = PIKA_PASSWORD, params: Any = "", http_session: Any = None,
+                 token_store: PikaTokenStore = None, limiters: RateLimiters = None):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="pika-sync", daemon=True)
+        self._thread.start()
+        self.async_api = AsyncPikaAPI(email, password, params, http_session=SharedSession(),
+                                      token_store=token_store or PikaTokenStore(),
+                                      status_aggregator=PikaStatusAggregator(),
+                                      limiters=limiters or RateLimiters())
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.async_api, name)
+
+    def _run(self, coro) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def close(self) -> None:
+        if self._loop.is_closed():
+            return
+        async def shutdown():
+            await self.async_api.status_aggregator.close()
+            await self.async_api.token_store.close()
+            await self.async_api.http_session.close()
+        self._run(shutdown())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def login(self) -> str:
+        return self._run(self.async_api.login())
+
+    def download_video(self, video_url: str | int, output_path: str) -> None:
+        return self._run(self.async_api.download_video(video_url, output_path))
+
+    def parse_token(self, cookie: str) -> tuple[str, str]:
+        return self.async_api.parse_token(cookie)
+
+    def generate_video(self, access_token: str, **kwargs) -> str:
+        return self._run(self.async_api.generate_video(access_token, **kwargs))
+
+    def get_video(self, token: str, video_id: str) -> dict[str, Union[str, int]]:
+        return self._run(self.async_api.get_video(token, video_id))
+
+    def get_videos(self, token: str, video_ids: list[str]) -> dict[str, dict[str, Union[str, int]]]:
+        return self._run(self.async_api.get_videos(token, video_ids))
+
+    def poll_and_download_video(self, token: str, video_id: str, output_path: str) -> None:
+        return self._run(self.async_api.poll_and_download_video(token, video_id, output_path))
+
+    def send_request(
+        self,
+        image_paths: Optional[list[str]] = None,
+        image_content: Optional[list[bytes]] = None,
+        prompt: str = "",
+        params: dict[str, Any] = None,
+        output_path: str = "output.mp4"
+    ) -> str:
+        return self._run(self.async_api.send_request(
+            image_paths=image_paths,
+            image_content=image_content,
+            prompt=prompt,
+            params=params,
+            output_path=output_path,
+        ))
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from circuit_breaker import CircuitOpenError
+from retry_util import TaskFailedError
+from metrics import metrics
+from tracing import tracer
+from config import PIKA_STATUS_INTERVAL, PIKA_STATUS_MAX_ATTEMPTS
+
+logger = logging.getLogger(__name__)
+
+class _PendingVideo:
+    def __init__(self, api, video_id: str, future: asyncio.Future):
+        self.api = api
+        self.video_id = video_id
+        self.future = future
+        self.attempts = 0
+
+# Собирает все ожидающие видео Pika и раз в тик опрашивает их одним запросом к
+# pika.art/library на аккаунт, раздавая статусы ожидающим заданиям. Число запросов
+# растёт с числом тиков, а не с числом одновременных заданий.
+class PikaStatusAggregator:
+    def __init__(self, interval: float = PIKA_STATUS_INTERVAL, max_attempts: int = PIKA_STATUS_MAX_ATTEMPTS):
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._pending: dict[str, _PendingVideo] = {}
+        self._task = None
+        self._stats = {"ticks": 0, "requests": 0, "max_batch": 0, "relogins": 0}
+
+    async def wait(self, api, video_id: str) -> dict:
+        pending = self._pending.get(video_id)
+        if pending is None:
+            pending = _PendingVideo(api, video_id, asyncio.get_running_loop().create_future())
+            self._pending[video_id] = pending
+            if self._task is None or self._task.done():
+                self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            return await asyncio.shield(pending.future)
+        except asyncio.CancelledError:
+            if not pending.future.done():
+                self._pending.pop(video_id, None)
+                pending.future.cancel()
+            raise
+        finally:
+            # Число опросов попадает в спан задания, а не в строку лога на каждый тик
+            tracer.annotate(polls=pending.attempts)
+
+    async def _run(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.interval)
+            self._stats["ticks"] += 1
+            groups: dict[str, list[_PendingVideo]] = {}
+            for pending in self._pending.values():
+                groups.setdefault(pending.api.email, []).append(pending)
+            await asyncio.gather(*(self._poll_group(group) for group in groups.values()))
+
+    async def _poll_group(self, group: list[_PendingVideo]) -> None:
+        api = group[0].api
+        video_ids = [p.video_id for p in group]
+        self._stats["requests"] += 1
+        metrics.inc("bot_polls_total", provider="pika")
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(video_ids))
+        try:
+            token = await api.token_store.get_token(api)
+            videos = await api.get_videos(token, video_ids)
+            if not videos:
+                # Пустой ответ обычно означает просроченный токен; попытка всё равно засчитывается
+                logger.warning(f"Empty library response for {len(video_ids)} videos, refreshing token...")
+                self._stats["relogins"] += 1
+                await api.token_store.get_token(api, force_refresh=True, stale_token=token)
+        except CircuitOpenError as e:
+            # Библиотека Pika недоступна — не тратим оставшиеся попытки ожидающих заданий
+            logger.error(f"Pika status request rejected: {e}")
+            for pending in group:
+                self._finish(pending, exception=e)
+            return
+        except Exception as e:
+            logger.error(f"Pika status request failed: {e}")
+            videos = {}
+
+        for pending in group:
+            pending.attempts += 1
+            video = videos.get(pending.video_id, {})
+            status = video.get("status", "unknown")
+            logger.debug(f"Polling video_id={pending.video_id}, attempt={pending.attempts}/{self.max_attempts}, status={status}")
+            if status in ("finished", "failed", "error"):
+                logger.info(f"Video {pending.video_id} finished with status {status} after {pending.attempts} polls")
+            if status == "finished":
+                self._finish(pending, result=video)
+            elif status in ["failed", "error"]:
+                self._finish(pending, exception=TaskFailedError(f"Video generation failed with status: {status}"))
+            elif pending.attempts >= self.max_attempts:
+                self._finish(pending, exception=TimeoutError(
+                    f"Video status polling timed out after {self.max_attempts} attempts"
+                ))
+
+    def _finish(self, pending: _PendingVideo, result: dict = None, exception: Exception = None) -> None:
+        self._pending.pop(pending.video_id, None)
+        if pending.future.done():
+            return
+        if exception is not None:
+            pending.future.set_exception(exception)
+        else:
+            pending.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._pending)}
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for pending in list(self._pending.values()):
+            if not pending.future.done():
+                pending.future.cancel()
+        self._pending.clear()
+
+pika_status_aggregator = PikaStatusAggregator()
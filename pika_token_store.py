@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from config import PIKA_TOKEN_CACHE_PATH, PIKA_TOKEN_REFRESH_MARGIN, PIKA_TOKEN_DEFAULT_TTL
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+# Общий для процесса (и для нескольких процессов через файл) кэш токенов Pika по email.
+# Срок действия берётся из parse_token; параллельные обновления одного аккаунта
+# схлопываются в один вход через браузер, а фоновая задача обновляет токен до истечения.
+class PikaTokenStore:
+    def __init__(self, path: str = PIKA_TOKEN_CACHE_PATH, refresh_margin: float = PIKA_TOKEN_REFRESH_MARGIN,
+                 default_ttl: float = PIKA_TOKEN_DEFAULT_TTL):
+        self.path = path
+        self.refresh_margin = refresh_margin
+        self.default_ttl = default_ttl
+        self._entries: dict[str, dict] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._clients: dict[str, object] = {}
+        self._refresher = None
+        self._stats = {"hits": 0, "logins": 0, "shared_refreshes": 0}
+
+    def _lock(self, email: str = None):
+        # Без email — блокировка файла кэша целиком, с email — только входа в этот аккаунт
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        suffix = f".{hashlib.sha256(email.encode('utf-8')).hexdigest()[:16]}" if email else ""
+        lock_file = open(f"{self.path}{suffix}.lock", "a+")
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        return lock_file
+
+    @staticmethod
+    def _unlock(lock_file) -> None:
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            lock_file.close()
+
+    def _read_all(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to read Pika token cache {self.path}: {e}")
+            return {}
+
+    def _write_entry(self, email: str, entry: dict) -> None:
+        # Файл общий для всех аккаунтов: общая блокировка держится только на чтение-изменение-запись
+        lock_file = self._lock()
+        try:
+            entries = self._read_all()
+            entries[email] = entry
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        finally:
+            self._unlock(lock_file)
+
+    def _is_fresh(self, entry: dict | None) -> bool:
+        return bool(entry and entry.get("token")) and entry.get("expires_at", 0) - self.refresh_margin > time.time()
+
+    def _load_entry(self, email: str) -> dict | None:
+        entry = self._entries.get(email)
+        if self._is_fresh(entry):
+            return entry
+        entry = self._read_all().get(email)
+        if self._is_fresh(entry):
+            self._entries[email] = entry
+            return entry
+        return None
+
+    async def get_token(self, api, force_refresh: bool = False, stale_token: str = None) -> str:
+        self._clients[api.email] = api
+        if not force_refresh:
+            entry = self._load_entry(api.email)
+            if entry is not None:
+                self._stats["hits"] += 1
+                return entry["token"]
+        return await self.refresh(api, stale_token=stale_token)
+
+    async def refresh(self, api, stale_token: str = None) -> str:
+        task = self._inflight.get(api.email)
+        if task is not None:
+            self._stats["shared_refreshes"] += 1
+            return await asyncio.shield(task)
+        task = asyncio.get_running_loop().create_task(self._refresh(api, stale_token))
+        self._inflight[api.email] = task
+        task.add_done_callback(lambda _: self._inflight.pop(api.email, None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, api, stale_token: str | None) -> str:
+        # Вход в аккаунт идёт под блокировкой этого аккаунта: медленный вход не задерживает
+        # обновление токенов остальных аккаунтов
+        lock_file = await asyncio.to_thread(self._lock, api.email)
+        try:
+            # Пока ждали блокировку, токен мог обновить другой процесс
+            entry = self._read_all().get(api.email)
+            if self._is_fresh(entry) and entry["token"] != stale_token:
+                self._entries[api.email] = entry
+                return entry["token"]
+
+            token = await api.login()
+            if not token:
+                raise Exception("Pika login failed: no auth token")
+            self._stats["logins"] += 1
+            api.parse_token(token[7:])
+            expires_at = api.expires_at or time.time() + self.default_ttl
+            entry = {"token": token, "expires_at": expires_at}
+            self._entries[api.email] = entry
+            await asyncio.to_thread(self._write_entry, api.email, entry)
+            logger.info(f"Pika token refreshed for {api.email}, expires in {expires_at - time.time():.0f}s")
+            return token
+        finally:
+            self._unlock(lock_file)
+
+    def start_refresher(self) -> None:
+        if self._refresher is None or self._refresher.done():
+            self._refresher = asyncio.get_running_loop().create_task(self._run_refresher())
+
+    async def _run_refresher(self) -> None:
+        while True:
+            now = time.time()
+            deadlines = [
+                (self._entries.get(email) or {}).get("expires_at", now) - self.refresh_margin
+                for email in self._clients
+            ]
+            delay = min(deadlines, default=now + 60) - now
+            await asyncio.sleep(min(max(delay, 10), 60))
+            for email, api in list(self._clients.items()):
+                if self._load_entry(email) is None:
+                    try:
+                        await self.refresh(api)
+                    except Exception as e:
+                        logger.error(f"Background Pika token refresh failed for {email}: {e}")
+
+    async def close(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+pika_token_store = PikaTokenStore()
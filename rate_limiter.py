@@ -0,0 +1,93 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import time
+from config import RATE_LIMITS, RATE_LIMIT_DEFAULT
+
+logger = logging.getLogger(__name__)
+
+# Ограничитель запросов одного провайдера (и одного ключа API): token bucket задаёт
+# среднюю частоту и допустимый всплеск, семафор — число одновременных запросов.
+# Время ожидания копится в статистике, чтобы подбирать квоты по данным.
+class RateLimiter:
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self._in_flight = 0
+        self._stats = {"acquired": 0, "waited": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    async def _take_token(self) -> None:
+        # Ожидающие обслуживаются по очереди захвата блокировки
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @contextlib.asynccontextmanager
+    async def limit(self):
+        started = time.monotonic()
+        async with self._semaphore:
+            await self._take_token()
+            waited = time.monotonic() - started
+            self._stats["acquired"] += 1
+            self._stats["wait_total"] += waited
+            self._stats["wait_max"] = max(self._stats["wait_max"], waited)
+            if waited > 0.01:
+                self._stats["waited"] += 1
+                logger.debug(f"Rate limiter {self.name}: waited {waited:.2f}s")
+            self._in_flight += 1
+            try:
+                yield waited
+            finally:
+                self._in_flight -= 1
+
+    def stats(self) -> dict:
+        acquired = self._stats["acquired"]
+        return {
+            **self._stats,
+            "wait_total": round(self._stats["wait_total"], 2),
+            "wait_max": round(self._stats["wait_max"], 2),
+            "wait_avg": round(self._stats["wait_total"] / acquired, 3) if acquired else 0.0,
+            "in_flight": self._in_flight,
+        }
+
+class RateLimiters:
+    def __init__(self, limits: dict[str, tuple[float, int, int]] = None,
+                 default: tuple[float, int, int] = RATE_LIMIT_DEFAULT):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.default = default
+        self._limiters: dict[str, RateLimiter] = {}
+
+    @staticmethod
+    def key_id(key: str) -> str:
+        # В имени ограничителя и статистике — отпечаток ключа, а не сам ключ
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+    def get(self, provider: str, key: str = None) -> RateLimiter:
+        name = provider if not key else f"{provider}:{self.key_id(key)}"
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            rate, burst, concurrency = self.limits.get(provider, self.default)
+            limiter = RateLimiter(name, rate, burst, concurrency)
+            self._limiters[name] = limiter
+        return limiter
+
+    def limit(self, provider: str, key: str = None):
+        return self.get(provider, key).limit()
+
+    def stats(self) -> dict[str, dict]:
+        return {name: limiter.stats() for name, limiter in self._limiters.items()}
+
+rate_limiters = RateLimiters()
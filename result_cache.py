@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from api_base import APIBase
+from download_util import download_to_file
+from http_session import SharedSession, shared_session
+from config import RESULT_CACHE_DIR, RESULT_CACHE_TTL, RESULT_CACHE_MAX_BYTES, RESULT_URL_LIFETIME
+
+logger = logging.getLogger(__name__)
+
+# Дисковый кэш результатов генерации изображений. Ключ — хэш (сеть, промпт, sha256
+# входных изображений, нормализованные параметры); хранится URL результата и его байты.
+# Записи старше ttl не выдаются, при превышении max_bytes вытесняются давно не читанные.
+# Выданный из кэша URL уходит следующему провайдеру, поэтому ttl не больше половины срока
+# жизни ссылки: её хватает на всё задание, запросившее результат.
+class ResultCache:
+    def __init__(self, directory: str = RESULT_CACHE_DIR, ttl: float = RESULT_CACHE_TTL,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES, http_session: SharedSession = None,
+                 url_lifetime: float = RESULT_URL_LIFETIME):
+        self.directory = directory
+        self.ttl = min(ttl, url_lifetime / 2)
+        self.max_bytes = max_bytes
+        self.http_session = http_session or shared_session
+        self._index: OrderedDict[str, dict] = None
+        self._by_url: dict[str, str] = {}
+        self._url_hashes: OrderedDict[str, str] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def make_key(network: str, prompt: str, input_hashes: list[str], params: dict) -> str:
+        material = json.dumps([network, prompt, input_hashes, params], sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self.directory, f"{key}.json"), os.path.join(self.directory, f"{key}.bin")
+
+    def _load_index(self) -> OrderedDict:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            meta_path, data_path = self._paths(name[:-5])
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                # Время последнего чтения хранится в mtime файла с данными
+                meta["last_access"] = os.path.getmtime(data_path)
+                entries.append(meta)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Dropping broken result cache entry {meta_path}: {e}")
+                self._remove_files(name[:-5])
+        entries.sort(key=lambda meta: meta["last_access"])
+        return OrderedDict((meta["key"], meta) for meta in entries)
+
+    async def _ensure_index(self) -> None:
+        if self._index is None:
+            self._index = await asyncio.to_thread(self._load_index)
+            for key, meta in self._index.items():
+                self._by_url[meta["url"]] = key
+                self._remember_hash(meta["url"], meta["sha256"])
+
+    def _remember_hash(self, url: str, sha256: str) -> None:
+        self._url_hashes[url] = sha256
+        self._url_hashes.move_to_end(url)
+        while len(self._url_hashes) > 10000:
+            self._url_hashes.popitem(last=False)
+
+    async def known_hash(self, url: str) -> str | None:
+        # sha256 результата, который кэш сохранял сам; входы не скачиваются ради хэша
+        await self._ensure_index()
+        return self._url_hashes.get(url)
+
+    async def get(self, key: str) -> dict | None:
+        await self._ensure_index()
+        meta = self._index.get(key)
+        if meta is None:
+            self._stats["misses"] += 1
+            return None
+        if time.time() - meta["created_at"] > self.ttl:
+            self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            await self._evict(key)
+            return None
+        self._stats["hits"] += 1
+        self._index.move_to_end(key)
+        meta["last_access"] = time.time()
+        await asyncio.to_thread(os.utime, self._paths(key)[1])
+        return meta
+
+    async def put(self, key: str, network: str, url: str) -> dict:
+        await self._ensure_index()
+        meta_path, data_path = self._paths(key)
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        result = await download_to_file(url, tmp_path, http_session=self.http_session)
+        await asyncio.to_thread(os.replace, tmp_path, data_path)
+        meta = {"key": key, "network": network, "url": url, "size": result.size, "sha256": result.sha256,
+                "created_at": time.time()}
+        await asyncio.to_thread(self._write_meta, meta_path, meta)
+        meta["last_access"] = meta["created_at"]
+        self._index[key] = meta
+        self._index.move_to_end(key)
+        self._by_url[url] = key
+        self._remember_hash(url, result.sha256)
+        self._stats["stores"] += 1
+        await self._enforce_limit()
+        return meta
+
+    @staticmethod
+    def _write_meta(path: str, meta: dict) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    async def _enforce_limit(self) -> None:
+        total = sum(meta["size"] for meta in self._index.values())
+        while total > self.max_bytes and len(self._index) > 1:
+            key, meta = next(iter(self._index.items()))
+            total -= meta["size"]
+            self._stats["evictions"] += 1
+            await self._evict(key)
+
+    async def _evict(self, key: str) -> None:
+        meta = self._index.pop(key, None)
+        if meta is not None and self._by_url.get(meta["url"]) == key:
+            del self._by_url[meta["url"]]
+        await asyncio.to_thread(self._remove_files, key)
+
+    def _remove_files(self, key: str) -> None:
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def read_content(self, url: str) -> bytes | None:
+        # Байты результата по его URL: ссылки провайдера со временем истекают, а кэш — нет
+        if self._index is None:
+            return None
+        key = self._by_url.get(url)
+        if key is None or key not in self._index:
+            return None
+        try:
+            return await asyncio.to_thread(self._read_file, self._paths(key)[1])
+        except FileNotFoundError:
+            await self._evict(key)
+            return None
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def fetch(self, key: str, network: str, produce) -> str:
+        meta = await self.get(key)
+        if meta is not None:
+            logger.info(f"Result cache hit for {network}: {key[:12]}")
+            return meta["url"]
+        # Одинаковые запросы из параллельных заданий выполняются один раз
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._produce(key, network, produce))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _produce(self, key: str, network: str, produce) -> str:
+        url = await produce()
+        try:
+            await self.put(key, network, url)
+        except Exception as e:
+            logger.warning(f"Failed to store {network} result in cache: {e}")
+        return url
+
+    def stats(self) -> dict:
+        entries = self._index or {}
+        return {**self._stats, "entries": len(entries), "bytes": sum(meta["size"] for meta in entries.values())}
+
+# Обёртка клиента gen-api (GptImageAPI, FluxAPI), которая отвечает из ResultCache,
+# если такой же запрос уже выполнялся. Хэши входных изображений берутся из артефактов
+# задания (ArtifactStore) или из самого кэша; вход с неизвестным хэшем идёт мимо кэша.
+class CachedImageAPI(APIBase):
+    ignored_params = {"callback_url", "is_sync", "prompt", "image"}
+
+    def __init__(self, api: APIBase, network: str, cache: ResultCache, artifacts=None):
+        self.api = api
+        self.network = network
+        self.cache = cache
+        self.artifacts = artifacts
+
+    def __getattr__(self, name: str):
+        return getattr(self.api, name)
+
+    async def send_request(self, **kwargs):
+        prompt = kwargs.get("prompt")
+        image_urls = list(kwargs.get("image_urls") or [])
+        if kwargs.get("image_url"):
+            image_urls.append(kwargs["image_url"])
+        input_hashes = []
+        for url in image_urls:
+            artifact = self.artifacts.find(url) if self.artifacts is not None else None
+            sha256 = artifact.sha256 if artifact is not None else await self.cache.known_hash(url)
+            if sha256 is None:
+                logger.debug(f"Unknown {self.network} input {url}, bypassing result cache")
+                return await self.api.send_request(**kwargs)
+            input_hashes.append(sha256)
+
+        params = {**vars(self.api.params), **kwargs.get("params", {})}
+        params = {name: value for name, value in params.items() if name not in self.ignored_params}
+        key = self.cache.make_key(self.network, prompt, input_hashes, params)
+        return await self.cache.fetch(key, self.network, lambda: self.api.send_request(**kwargs))
+
+result_cache = ResultCache()
@@ -1,23 +1,229 @@
 import asyncio
+import contextlib
 import functools
 import logging
-from aiohttp import ClientSession
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+import aiohttp
+from circuit_breaker import CircuitOpenError, circuit_breakers
+from config import (
+    RETRY_MAX_ATTEMPTS, RETRY_PROVIDER_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+    RETRY_MAX_RETRY_AFTER, RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN, RETRY_BUDGET_WINDOW,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def retry_request(max_retries=0, timeout=300, backoff_factor=2):
+# Ошибка HTTP-ответа провайдера: статус и Retry-After нужны для решения о повторе
+class APIError(Exception):
+    def __init__(self, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+# Задача у провайдера завершилась со статусом error (в том числе отказ модерации)
+class TaskFailedError(Exception):
+    pass
+
+# Задача не завершилась за срок опроса: повторная попытка ждала бы ту же самую задачу
+class PollTimeoutError(TimeoutError):
+    pass
+
+FATAL_MARKERS = ("moderation", "safety", "nsfw", "content policy", "prohibited", "inappropriate")
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def response_error(message: str, response: aiohttp.ClientResponse) -> APIError:
+    return APIError(message, status=response.status,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After")))
+
+def _causes(exc: BaseException):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+def _retryable_status(status: int) -> bool:
+    # Остальные 4xx — ошибка самого запроса, повтор ничего не изменит
+    return status in (408, 425, 429) or status >= 500
+
+def classify(exc: BaseException) -> tuple[bool, float | None]:
+    # (можно ли повторить, Retry-After). Клиенты оборачивают ошибки в Exception,
+    # поэтому решение принимается по первой распознанной причине в цепочке
+    for cause in _causes(exc):
+        if isinstance(cause, (CircuitOpenError, PollTimeoutError)):
+            return False, None
+        if isinstance(cause, APIError) and cause.status is not None:
+            if _retryable_status(cause.status):
+                return True, cause.retry_after
+            return False, None
+        if isinstance(cause, aiohttp.ClientResponseError):
+            if _retryable_status(cause.status):
+                return True, parse_retry_after((cause.headers or {}).get("Retry-After"))
+            return False, None
+        if isinstance(cause, TaskFailedError):
+            return not any(marker in str(cause).lower() for marker in FATAL_MARKERS), None
+        if isinstance(cause, (asyncio.TimeoutError, TimeoutError, aiohttp.ClientConnectionError,
+                              aiohttp.ClientPayloadError)):
+            return True, None
+        if isinstance(cause, (ValueError, TypeError, KeyError)):
+            return False, None
+    if any(marker in str(exc).lower() for marker in FATAL_MARKERS):
+        return False, None
+    return True, None
+
+# Политика повторов одного провайдера: экспоненциальная задержка с джиттером и
+# бюджет повторов — за окно budget_window повторов не больше budget_ratio от числа
+# запросов (но не меньше budget_min), чтобы при отказе провайдера не умножать нагрузку.
+class RetryPolicy:
+    def __init__(self, provider: str, max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, max_retry_after: float = RETRY_MAX_RETRY_AFTER,
+                 budget_ratio: float = RETRY_BUDGET_RATIO, budget_min: int = RETRY_BUDGET_MIN,
+                 budget_window: float = RETRY_BUDGET_WINDOW):
+        self.provider = provider
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self.budget_window = budget_window
+        self._requests: deque[float] = deque()
+        self._retries: deque[float] = deque()
+        self._stats = {"requests": 0, "retries": 0, "fatal": 0, "exhausted": 0, "budget_denied": 0}
+
+    def _trim(self, now: float) -> None:
+        for events in (self._requests, self._retries):
+            while events and now - events[0] > self.budget_window:
+                events.popleft()
+
+    def record_request(self) -> None:
+        self._requests.append(time.monotonic())
+        self._stats["requests"] += 1
+
+    def allow_retry(self) -> bool:
+        now = time.monotonic()
+        self._trim(now)
+        if len(self._retries) >= max(self.budget_min, self.budget_ratio * len(self._requests)):
+            self._stats["budget_denied"] += 1
+            return False
+        self._retries.append(now)
+        self._stats["retries"] += 1
+        return True
+
+    def backoff(self, attempt: int, retry_after: float = None, factor: float = 2) -> float:
+        delay = min(self.max_delay, self.base_delay * factor ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def count(self, event: str) -> None:
+        self._stats[event] += 1
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+_policies: dict[str, RetryPolicy] = {}
+
+def get_policy(provider: str) -> RetryPolicy:
+    policy = _policies.get(provider)
+    if policy is None:
+        policy = RetryPolicy(provider, max_attempts=RETRY_PROVIDER_ATTEMPTS.get(provider, RETRY_MAX_ATTEMPTS))
+        _policies[provider] = policy
+    return policy
+
+def retry_stats() -> dict[str, dict]:
+    return {provider: policy.stats() for provider, policy in _policies.items()}
+
+@contextlib.asynccontextmanager
+async def circuit_guard(name: str):
+    # Вызов через предохранитель эндпоинта: при разомкнутой цепи сразу CircuitOpenError,
+    # иначе результат и длительность вызова учитываются в окне предохранителя
+    breaker = circuit_breakers.get(name)
+    breaker.before_call()
+    started = time.monotonic()
+    try:
+        yield
+    except CircuitOpenError:
+        breaker.release_probe()
+        raise
+    except BaseException as e:
+        retryable, _ = classify(e) if isinstance(e, Exception) else (False, None)
+        if retryable:
+            breaker.record(True, time.monotonic() - started)
+        else:
+            # Отказ по вине запроса (4xx, модерация) или отмена — не признак сбоя провайдера
+            breaker.release_probe()
+        raise
+    breaker.record(False, time.monotonic() - started)
+
+async def call_with_retry(func, provider: str, timeout: float = None, max_attempts: int = None,
+                          backoff_factor: float = 2, circuit: str = None):
+    policy = get_policy(provider)
+    attempts = policy.max_attempts if max_attempts is None else max_attempts
+    attempt = 0
+    while True:
+        attempt += 1
+        policy.record_request()
+        try:
+            async with contextlib.AsyncExitStack() as stack:
+                if circuit is not None:
+                    await stack.enter_async_context(circuit_guard(circuit))
+                if timeout is None:
+                    return await func()
+                async with asyncio.timeout(timeout):
+                    return await func()
+        except Exception as e:
+            retryable, retry_after = classify(e)
+            if not retryable:
+                policy.count("fatal")
+                logger.error(f"{provider}: non-retryable error on attempt {attempt}: {e}")
+                raise
+            if attempt >= attempts:
+                policy.count("exhausted")
+                logger.error(f"{provider}: giving up after {attempt} attempts: {e}")
+                raise
+            if retry_after is not None and retry_after > policy.max_retry_after:
+                logger.error(f"{provider}: Retry-After {retry_after:.0f}s exceeds limit, giving up: {e}")
+                raise
+            if not policy.allow_retry():
+                logger.error(f"{provider}: retry budget exhausted, giving up: {e}")
+                raise
+            delay = policy.backoff(attempt - 1, retry_after, backoff_factor)
+            logger.warning(f"{provider}: attempt {attempt}/{attempts} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+def retry_request(max_retries=None, timeout=300, backoff_factor=2, provider="default", circuit=None):
+    # max_retries=None — число попыток берётся из политики провайдера;
+    # circuit — имя предохранителя (circuit_breaker), через который идёт каждая попытка
     def decorator(func):
         @functools.wraps(func)
         async def wrapper(*args, **kwargs):
             try:
-                async with asyncio.timeout(timeout):
-                    return await func(*args, **kwargs)
-            except asyncio.TimeoutError:
+                return await call_with_retry(
+                    lambda: func(*args, **kwargs), provider, timeout=timeout,
+                    max_attempts=None if max_retries is None else max_retries + 1,
+                    backoff_factor=backoff_factor, circuit=circuit,
+                )
+            except asyncio.TimeoutError as e:
                 logger.warning(f"Request timed out after {timeout}s")
-                raise Exception("Request timed out")
+                raise Exception("Request timed out") from e
             except Exception as e:
                 logger.error(f"Error during request: {e}")
-                raise Exception(f"Request failed: {e}")
+                raise Exception(f"Request failed: {e}") from e
         return wrapper
-    return decorator
\ No newline at end of file
+    return decorator
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from config import SCENARIO_CACHE_PATH, SCENARIO_CACHE_MAX_ENTRIES, SCENARIO_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Кэш сценариев o3: по подписи и file_unique_id фотографий хранит разобранные промпты
+# и число сцен, чтобы повторная отправка тех же фото не ждала рассуждающую модель.
+# Вытеснение — LRU по max_entries и TTL; содержимое сохраняется в JSON-файл.
+class ScenarioCache:
+    def __init__(self, path: str = SCENARIO_CACHE_PATH, max_entries: int = SCENARIO_CACHE_MAX_ENTRIES,
+                 ttl: float = SCENARIO_CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, dict] = None
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    @staticmethod
+    def make_key(caption: str, file_unique_ids: list[str]) -> str:
+        material = json.dumps([caption.strip(), sorted(file_unique_ids)])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _load(self) -> OrderedDict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return OrderedDict()
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Failed to read scenario cache {self.path}: {e}")
+            return OrderedDict()
+        return OrderedDict(sorted(entries.items(), key=lambda item: item[1]["last_access"]))
+
+    def _save(self, entries: dict) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    async def _ensure_loaded(self) -> None:
+        if self._entries is None:
+            self._entries = await asyncio.to_thread(self._load)
+
+    async def get(self, key: str) -> tuple[dict, int] | None:
+        if not self.enabled:
+            return None
+        await self._ensure_loaded()
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry["created_at"] > self.ttl:
+            self._stats["expired"] += 1
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        entry["last_access"] = time.time()
+        self._entries.move_to_end(key)
+        return dict(entry["prompts"]), entry["num_scenes"]
+
+    async def put(self, key: str, prompts: dict, num_scenes: int) -> None:
+        if not self.enabled:
+            return
+        await self._ensure_loaded()
+        now = time.time()
+        self._entries[key] = {"prompts": prompts, "num_scenes": num_scenes, "created_at": now, "last_access": now}
+        self._entries.move_to_end(key)
+        self._stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+        try:
+            await asyncio.to_thread(self._save, dict(self._entries))
+        except OSError as e:
+            logger.warning(f"Failed to write scenario cache {self.path}: {e}")
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries or {}),
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+scenario_cache = ScenarioCache()
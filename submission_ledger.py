@@ -0,0 +1,88 @@
+import logging
+import time
+from retry_util import TaskFailedError
+from job_store import JobStore, job_store
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class Submission:
+    def __init__(self, network: str, request_id: str):
+        self.network = network
+        self.request_id = request_id
+        self.state = PENDING
+        self.submitted_at = time.time()
+        self.resumes = 0
+
+# Журнал отправленных задач по ключу (job_id, этап). Повтор запроса продолжает
+# опрашивать уже созданную задачу; новая отправка — только после того, как провайдер
+# подтвердил, что задача завершилась ошибкой (TaskFailedError). Таймауты опроса и
+# сетевые ошибки не считаются провалом: задача у провайдера может ещё выполняться.
+# Записи дублируются в JobStore, чтобы после перезапуска продолжить опрос тех же задач.
+class SubmissionLedger:
+    def __init__(self, store: JobStore = None):
+        self.store = store
+        self._submissions: dict[tuple[str, str], Submission] = {}
+        self._stats = {"submitted": 0, "resumed": 0, "resubmitted": 0, "failed": 0}
+
+    def resume(self, key: tuple[str, str] | None) -> str | None:
+        submission = self._submissions.get(key) if key is not None else None
+        if submission is None or submission.state == FAILED:
+            return None
+        submission.resumes += 1
+        self._stats["resumed"] += 1
+        logger.info(f"Resuming {submission.network} task {submission.request_id} for {key[0]}/{key[1]} instead of resubmitting")
+        return submission.request_id
+
+    def lookup(self, key: tuple[str, str] | None) -> Submission | None:
+        return self._submissions.get(key) if key is not None else None
+
+    def submitted(self, key: tuple[str, str] | None, network: str, request_id: str) -> None:
+        if key is None:
+            return
+        if key in self._submissions:
+            self._stats["resubmitted"] += 1
+        self._submissions[key] = Submission(network, request_id)
+        self._stats["submitted"] += 1
+        self._persist(key)
+
+    def settle(self, key: tuple[str, str] | None, error: BaseException = None) -> None:
+        submission = self._submissions.get(key) if key is not None else None
+        if submission is None:
+            return
+        if error is None:
+            submission.state = SUCCEEDED
+            self._persist(key)
+            return
+        cause = error
+        while cause is not None and not isinstance(cause, TaskFailedError):
+            cause = cause.__cause__ or cause.__context__
+        if cause is not None:
+            submission.state = FAILED
+            self._stats["failed"] += 1
+            self._persist(key)
+            logger.warning(f"{submission.network} task {submission.request_id} failed, next attempt will resubmit")
+
+    def _persist(self, key: tuple[str, str]) -> None:
+        if self.store is not None:
+            submission = self._submissions[key]
+            self.store.save_submission(key[0], key[1], submission.network, submission.request_id, submission.state)
+
+    def restore(self, job_id: str, rows: list[tuple[str, str, str, str]]) -> None:
+        # Задачи, отправленные до перезапуска: повтор продолжит их опрашивать
+        for stage, network, request_id, state in rows:
+            submission = Submission(network, request_id)
+            submission.state = state
+            self._submissions[(job_id, stage)] = submission
+
+    def forget_job(self, job_id: str) -> None:
+        for key in [key for key in self._submissions if key[0] == job_id]:
+            del self._submissions[key]
+
+    def stats(self) -> dict:
+        return {**self._stats, "tracked": len(self._submissions)}
+
+submission_ledger = SubmissionLedger(job_store)
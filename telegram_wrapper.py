@@ -13,22 +13,3 @@ class TelegramHandler:
         path = os.path.join(self.temp_dir, f"{user_id}.jpg")
         await file.download_to_drive(path)
         return path
-
-    def cleanup_temp_files(self, user_id: int, num_scenes: int = 4) -> None:
-        paths = [
-            os.path.join(self.temp_dir, f"{user_id}.jpg"),
-            os.path.join(self.temp_dir, f"generated_{user_id}.png"),
-            os.path.join(self.temp_dir, f"enhanced_{user_id}.png")
-        ]
-        for scene in range(1, num_scenes + 1):
-            paths.extend([
-                os.path.join(self.temp_dir, f"generated_{user_id}_scene_{scene}.png"),
-                os.path.join(self.temp_dir, f"enhanced_{user_id}_scene_{scene}.png"),
-                os.path.join(self.temp_dir, f"video_{user_id}_scene_{scene}.mp4")
-            ])
-        paths.append(os.path.join(self.temp_dir, f"generated_{user_id}_final_frame.png"))
-        paths.append(os.path.join(self.temp_dir, f"enhanced_{user_id}_final_frame.png"))
-
-        for path in paths:
-            if os.path.exists(path):
-                os.remove(path)
\ No newline at end of file
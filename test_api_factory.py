@@ -0,0 +1,12 @@
+from api_factory import APIFactory
+from credential_pool import Credential, CredentialPool, CredentialPools
+
+async def test_sync_pika_client_is_reused_and_closed():
+    pools = CredentialPools({"pika": CredentialPool("pika", [Credential("pika", ("user@example.com", "secret"), "p1")])})
+    factory = APIFactory(credentials=pools)
+    first = await factory.get_api("pika_sync")
+    second = await factory.get_api("pika_sync")
+    assert first is second
+    await factory.close()
+    assert first._loop.is_closed()
+    assert not first._thread.is_alive()
@@ -0,0 +1,96 @@
+import asyncio
+import contextlib
+import socket
+import aiohttp
+import genapi_poller
+from callback_server import CallbackReceiver
+from fake_genapi import FakeGenApi
+from genapi_poller import GenApiPoller
+from http_session import SharedSession
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# FakeGenApi, GenApiPoller и CallbackReceiver на локальных портах; callback_fallback_interval
+# задаёт, через сколько poller сам опросит задачу, если callback не пришёл
+@contextlib.asynccontextmanager
+async def _services(monkeypatch, callback_fallback_interval: float = 30.0):
+    fake = FakeGenApi(port=_free_port(), latency=0.2, jitter=0.0, seed=1)
+    await fake.start()
+    monkeypatch.setattr(genapi_poller, "STATUS_URL", fake.base_url + "/api/v1/request/get/{request_id}")
+    session = SharedSession()
+    poller = GenApiPoller(http_session=session, first_check=0.05, min_interval=0.05,
+                          callback_fallback_interval=callback_fallback_interval)
+    port = _free_port()
+    receiver = CallbackReceiver(poller=poller, public_url=f"http://127.0.0.1:{port}", port=port)
+    await receiver.start()
+    try:
+        yield fake, poller, receiver
+    finally:
+        await receiver.stop()
+        await poller.close()
+        await session.close()
+        await fake.stop()
+
+async def _submit(fake: FakeGenApi, callback_url: str) -> str:
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{fake.base_url}/api/v1/networks/gpt-image-1",
+                                json={"callback_url": callback_url}) as response:
+            return (await response.json())["request_id"]
+
+async def test_callback_before_wait(monkeypatch):
+    async with _services(monkeypatch) as (fake, poller, receiver):
+        token, callback_url = receiver.new_callback()
+        request_id = await _submit(fake, callback_url)
+        receiver.bind(token, request_id)
+        while fake.stats["callbacks_sent"] == 0:
+            await asyncio.sleep(0.02)
+        data = await poller.wait(request_id, "gpt-image-1", {}, callback=True)
+        assert data["status"] == "success"
+        assert fake.stats["polls"] == 0
+        assert poller.stats()["callbacks"] == 1
+
+async def test_callback_before_bind(monkeypatch):
+    async with _services(monkeypatch) as (fake, poller, receiver):
+        token, callback_url = receiver.new_callback()
+        request_id = await _submit(fake, callback_url)
+        while fake.stats["callbacks_sent"] == 0:
+            await asyncio.sleep(0.02)
+        # request_id стал известен клиенту уже после callback
+        receiver.bind(token, request_id)
+        data = await poller.wait(request_id, "gpt-image-1", {}, callback=True)
+        assert data["status"] == "success"
+        assert fake.stats["polls"] == 0
+
+async def test_callback_after_wait(monkeypatch):
+    async with _services(monkeypatch) as (fake, poller, receiver):
+        token, callback_url = receiver.new_callback()
+        request_id = await _submit(fake, callback_url)
+        receiver.bind(token, request_id)
+        data = await poller.wait(request_id, "gpt-image-1", {}, callback=True)
+        assert data["status"] == "success"
+        assert fake.stats["polls"] == 0
+        assert poller.stats()["callbacks"] == 1
+        assert poller.stats()["in_flight"] == 0
+
+async def test_callback_for_unknown_token_is_rejected(monkeypatch):
+    async with _services(monkeypatch) as (fake, poller, receiver):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{receiver.public_url}/genapi/callback/unknown",
+                                    json={"request_id": "1", "status": "success"}) as response:
+                assert response.status == 404
+        assert poller.stats()["callbacks"] == 0
+        assert not poller._early_results
+
+async def test_poll_fallback_when_callback_is_lost(monkeypatch):
+    async with _services(monkeypatch, callback_fallback_interval=0.3) as (fake, poller, receiver):
+        token, callback_url = receiver.new_callback()
+        # Токен освобождён до прихода callback: результат можно получить только опросом
+        receiver.release(token)
+        request_id = await _submit(fake, callback_url)
+        data = await poller.wait(request_id, "gpt-image-1", {}, callback=True)
+        assert data["status"] == "success"
+        assert fake.stats["polls"] >= 1
+        assert poller.stats()["callbacks"] == 0
@@ -0,0 +1,101 @@
+import functools
+import time
+import pytest
+import retry_util
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakers, CircuitOpenError
+from retry_util import APIError, call_with_retry, circuit_guard, classify
+
+_breaker = functools.partial(CircuitBreaker, "test", window=60, min_calls=4, failure_ratio=0.5, slow_ratio=0.5,
+                             slow_call_seconds=10, open_seconds=0.05, half_open_probes=1)
+
+def _trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.min_calls):
+        breaker.before_call()
+        breaker.record(True, 0.1)
+
+def test_stays_closed_below_min_calls():
+    breaker = _breaker()
+    for _ in range(breaker.min_calls - 1):
+        breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+
+def test_opens_on_failure_ratio_and_rejects_calls():
+    breaker = _breaker()
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    breaker.record(True, 0.1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.info()["rejected"] == 1
+
+def test_opens_on_slow_calls():
+    breaker = _breaker()
+    for _ in range(breaker.min_calls):
+        breaker.record(False, 11)
+    assert breaker.state == OPEN
+
+def test_half_open_probe_success_closes():
+    breaker = _breaker()
+    _trip(breaker)
+    time.sleep(breaker.open_seconds)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # Пробных вызовов не больше half_open_probes
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.info()["calls"] == 0
+
+def test_half_open_probe_failure_reopens():
+    breaker = _breaker()
+    _trip(breaker)
+    time.sleep(breaker.open_seconds)
+    breaker.before_call()
+    breaker.record(True, 0.1)
+    assert breaker.state == OPEN
+    assert breaker.info()["opened"] == 2
+
+def test_released_probe_can_be_retried():
+    breaker = _breaker()
+    _trip(breaker)
+    time.sleep(breaker.open_seconds)
+    breaker.before_call()
+    breaker.release_probe()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+
+def test_unavailable_lists_only_open_circuits():
+    breakers = CircuitBreakers()
+    breakers._breakers["down"] = _breaker(open_seconds=60)
+    breakers._breakers["up"] = _breaker()
+    _trip(breakers._breakers["down"])
+    assert breakers.unavailable(["down", "up", "unknown"]) == ["down"]
+
+async def test_circuit_open_is_not_retried(monkeypatch):
+    breakers = CircuitBreakers()
+    breakers._breakers["test"] = _breaker(open_seconds=60)
+    _trip(breakers._breakers["test"])
+    monkeypatch.setattr(retry_util, "circuit_breakers", breakers)
+    calls = []
+
+    async def call():
+        calls.append(1)
+
+    with pytest.raises(CircuitOpenError):
+        await call_with_retry(call, "test", circuit="test")
+    assert calls == []
+    assert classify(CircuitOpenError("test", 10)) == (False, None)
+
+async def test_guard_ignores_client_errors(monkeypatch):
+    breakers = CircuitBreakers()
+    breakers._breakers["test"] = _breaker()
+    monkeypatch.setattr(retry_util, "circuit_breakers", breakers)
+    for _ in range(breakers._breakers["test"].min_calls):
+        with pytest.raises(APIError):
+            async with circuit_guard("test"):
+                raise APIError("bad request", status=400)
+    assert breakers._breakers["test"].state == CLOSED
@@ -0,0 +1,32 @@
+import asyncio
+from credential_pool import Credential, CredentialPool, CredentialPools, JobCredentials
+
+def _pools(max_jobs: int) -> CredentialPools:
+    return CredentialPools({"genapi": CredentialPool("genapi", [Credential("genapi", "k1", "k1")], max_jobs=max_jobs)})
+
+async def test_concurrent_leases_in_one_job_share_one_credential():
+    pools = _pools(max_jobs=1)
+    job = JobCredentials(pools)
+    credentials = await asyncio.wait_for(asyncio.gather(*(job.lease("genapi") for _ in range(5))), 1)
+    assert len({id(credential) for credential in credentials}) == 1
+    assert pools.get("genapi").primary.in_use == 1
+    job.release()
+    assert pools.get("genapi").primary.in_use == 0
+
+async def test_parallel_jobs_on_contended_pool_do_not_deadlock():
+    async def job(pools: CredentialPools) -> None:
+        credentials = JobCredentials(pools)
+        try:
+            # Три параллельные сцены одного задания, как в режиме parallel
+            async with asyncio.TaskGroup() as tg:
+                for _ in range(3):
+                    tg.create_task(credentials.lease("genapi"))
+            await asyncio.sleep(0.01)
+        finally:
+            credentials.release()
+
+    pools = _pools(max_jobs=1)
+    await asyncio.wait_for(asyncio.gather(job(pools), job(pools)), 2)
+    credential = pools.get("genapi").primary
+    assert credential.in_use == 0
+    assert credential.leases == 2
@@ -0,0 +1,29 @@
+import asyncio
+from hedging import HedgePolicies, HedgedImageAPI
+
+class SlowAPI:
+    def __init__(self):
+        self.cancelled = 0
+
+    async def send_request(self, **kwargs):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+async def test_cancel_during_hedge_delay_cancels_primary():
+    policies = HedgePolicies(networks=["flux"])
+    policy = policies.get("flux")
+    for _ in range(policy.min_samples):
+        policy.record_latency(5.0)
+    api = SlowAPI()
+    task = asyncio.ensure_future(HedgedImageAPI(api, "flux", policies).send_request(prompt="p"))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await asyncio.sleep(0)
+    assert api.cancelled == 1
@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import pytest
+from job_scheduler import JobScheduler, SchedulerFull
+
+_scheduler = functools.partial(JobScheduler, max_concurrent=1, max_per_user=1, max_queue=100, weights={},
+                               default_weight=1.0, starvation_timeout=3600)
+
+async def _order(scheduler: JobScheduler, jobs: list[tuple[int, str]]) -> list[str]:
+    # Порядок, в котором планировщик выдал бы задания воркерам
+    for user_id, name in jobs:
+        async def job(name=name):
+            return name
+        scheduler.submit(user_id, job)
+    order = []
+    while scheduler.queued():
+        order.append(await scheduler._next_job().run())
+    return order
+
+async def test_users_are_interleaved():
+    jobs = [(1, "a1"), (1, "a2"), (1, "a3"), (1, "a4"), (2, "b1"), (2, "b2")]
+    assert await _order(_scheduler(), jobs) == ["a1", "b1", "a2", "b2", "a3", "a4"]
+
+async def test_weights_share_slots_proportionally():
+    jobs = [(1, f"a{i}") for i in range(1, 5)] + [(2, f"b{i}") for i in range(1, 3)]
+    order = await _order(_scheduler(weights={1: 2.0}), jobs)
+    assert order == ["a1", "a2", "b1", "a3", "a4", "b2"]
+
+async def test_fractional_weight_waits_for_enough_deficit():
+    jobs = [(1, "a1"), (1, "a2"), (2, "b1"), (2, "b2"), (2, "b3")]
+    order = await _order(_scheduler(weights={1: 0.5}), jobs)
+    assert order == ["b1", "a1", "b2", "b3", "a2"]
+
+async def test_starving_job_runs_first():
+    scheduler = _scheduler(starvation_timeout=10)
+    for name in ("a1", "a2", "a3"):
+        async def job(name=name):
+            return name
+        scheduler.submit(1, job)
+
+    async def starving():
+        return "b1"
+    scheduler.submit(2, starving)
+    scheduler._queues[2][0].enqueued_at -= 60
+    first = await scheduler._next_job().run()
+    assert first == "b1"
+    assert scheduler.stats()["starvation_promotions"] == 1
+
+async def test_full_queue_rejects_jobs():
+    scheduler = _scheduler(max_queue=2)
+
+    async def job():
+        pass
+    assert scheduler.submit(1, job) == 0
+    scheduler.submit(2, job)
+    with pytest.raises(SchedulerFull):
+        scheduler.submit(3, job)
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.queued() == 2
+
+async def test_workers_respect_per_user_limit():
+    scheduler = _scheduler(max_concurrent=3, max_per_user=1)
+    running: dict[int, int] = {}
+    peak: dict[int, int] = {}
+    done = asyncio.Event()
+    finished = []
+
+    def make(user_id: int):
+        async def job():
+            running[user_id] = running.get(user_id, 0) + 1
+            peak[user_id] = max(peak.get(user_id, 0), running[user_id])
+            await asyncio.sleep(0.01)
+            running[user_id] -= 1
+            finished.append(user_id)
+            if len(finished) == 6:
+                done.set()
+        return job
+
+    scheduler.start()
+    try:
+        for user_id in (1, 1, 1, 1, 2, 2):
+            scheduler.submit(user_id, make(user_id))
+        await asyncio.wait_for(done.wait(), 2)
+    finally:
+        await scheduler.close()
+    assert peak == {1: 1, 2: 1}
+    assert scheduler.stats()["completed"] == 6
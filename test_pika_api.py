@@ -0,0 +1,91 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from aiohttp import web
+import pika_api
+from http_session import SharedSession
+from pika_api import AsyncPikaAPI, PikaAPI
+
+async def _get_videos(monkeypatch, results: list[dict], video_ids: list[str]) -> dict:
+    async def library(request: web.Request) -> web.Response:
+        text = '0:["$@1",["test",null]]\n1:' + json.dumps({"data": {"results": results}}) + "\n"
+        return web.Response(text=text, content_type="text/x-component")
+
+    app = web.Application()
+    app.router.add_post("/library", library)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(pika_api, "PIKA_LIBRARY_URL", f"http://127.0.0.1:{port}/library")
+    session = SharedSession()
+    try:
+        return await AsyncPikaAPI("user@example.com", "secret", http_session=session).get_videos("token", video_ids)
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+async def test_results_are_matched_by_id(monkeypatch):
+    results = [{"id": "b", "videos": [{"status": "finished"}]}, {"id": "a", "videos": [{"status": "queued"}]}]
+    videos = await _get_videos(monkeypatch, results, ["a", "b"])
+    assert videos["a"]["status"] == "queued"
+    assert videos["b"]["status"] == "finished"
+
+async def test_results_without_matching_ids_fall_back_to_order(monkeypatch):
+    results = [{"id": "r1", "videos": [{"status": "finished"}]}, {"videos": [{"status": "queued"}]}]
+    videos = await _get_videos(monkeypatch, results, ["a", "b"])
+    assert videos["a"]["status"] == "finished"
+    assert videos["b"]["status"] == "queued"
+
+async def test_partial_match_does_not_fall_back_to_order(monkeypatch):
+    results = [{"id": "b", "videos": [{"status": "finished", "sharingUrl": "b.mp4"}]},
+               {"id": "zz", "videos": [{"status": "queued"}]}]
+    videos = await _get_videos(monkeypatch, results, ["a", "b"])
+    assert videos["b"] == {"status": "finished", "sharingUrl": "b.mp4"}
+    assert "a" not in videos
+
+async def test_duplicate_id_does_not_overwrite_status(monkeypatch):
+    results = [{"id": "a", "videos": [{"status": "finished"}]}, {"id": "a", "videos": [{"status": "queued"}]}]
+    videos = await _get_videos(monkeypatch, results, ["a", "b"])
+    assert videos["a"]["status"] == "finished"
+    assert "b" not in videos
+
+async def test_missing_video_is_logged(monkeypatch, caplog):
+    results = [{"id": "a", "videos": [{"status": "finished"}]}]
+    videos = await _get_videos(monkeypatch, results, ["a", "b"])
+    assert set(videos) == {"a"}
+    assert "no status for 1 of 2 videos" in caplog.text
+
+def test_sync_wrapper_reuses_one_loop(monkeypatch):
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            ids = json.loads(self.rfile.read(int(self.headers["Content-Length"])))[0]["ids"]
+            results = [{"id": video_id, "videos": [{"status": "finished"}]} for video_id in ids]
+            body = ('0:["$@1",["test",null]]\n1:' + json.dumps({"data": {"results": results}}) + "\n").encode()
+            requests.append(self.path)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(pika_api, "PIKA_LIBRARY_URL", f"http://127.0.0.1:{server.server_address[1]}/library")
+    api = PikaAPI("user@example.com", "secret")
+    try:
+        # Несколько вызовов подряд работают в одном цикле с одной и той же сессией
+        assert api.get_video("token", "a")["status"] == "finished"
+        session = api.async_api.http_session._session
+        assert api.get_videos("token", ["b", "c"]).keys() == {"b", "c"}
+        assert api.async_api.http_session._session is session
+        assert len(requests) == 2
+    finally:
+        api.close()
+        server.shutdown()
+    assert api._loop.is_closed()
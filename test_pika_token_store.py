@@ -0,0 +1,38 @@
+import asyncio
+import time
+from pika_token_store import PikaTokenStore
+
+class FakePikaAccount:
+    def __init__(self, email: str, delay: float, finished: list[str]):
+        self.email = email
+        self.delay = delay
+        self.finished = finished
+        self.expires_at = None
+        self.logins = 0
+
+    async def login(self) -> str:
+        self.logins += 1
+        await asyncio.sleep(self.delay)
+        self.finished.append(self.email)
+        return f"Bearer token-{self.email}"
+
+    def parse_token(self, token: str) -> None:
+        self.expires_at = time.time() + 3600
+
+async def test_slow_login_does_not_block_other_accounts(tmp_path):
+    store = PikaTokenStore(path=str(tmp_path / "tokens.json"))
+    finished = []
+    slow = FakePikaAccount("slow@example.com", 0.5, finished)
+    fast = FakePikaAccount("fast@example.com", 0.01, finished)
+    slow_task = asyncio.ensure_future(store.get_token(slow))
+    await asyncio.sleep(0.05)
+    started = time.monotonic()
+    await store.get_token(fast)
+    assert time.monotonic() - started < 0.3
+    await slow_task
+    assert finished == ["fast@example.com", "slow@example.com"]
+    # Оба токена записаны в общий файл и читаются новым экземпляром без входа
+    reloaded = PikaTokenStore(path=str(tmp_path / "tokens.json"))
+    assert await reloaded.get_token(slow) == "Bearer token-slow@example.com"
+    assert await reloaded.get_token(fast) == "Bearer token-fast@example.com"
+    assert (slow.logins, fast.logins) == (1, 1)
@@ -0,0 +1,54 @@
+import hashlib
+import types
+import result_cache
+from artifact_store import Artifact
+from result_cache import CachedImageAPI, ResultCache
+
+class FakeImageAPI:
+    params = types.SimpleNamespace(size="1024x1536")
+
+    def __init__(self):
+        self.calls = 0
+
+    async def send_request(self, **kwargs):
+        self.calls += 1
+        return f"https://cdn.example/result-{self.calls}.png"
+
+class FakeArtifacts:
+    def __init__(self, artifacts: list[Artifact]):
+        self.artifacts = artifacts
+
+    def find(self, url: str) -> Artifact | None:
+        return next((artifact for artifact in self.artifacts if artifact.url == url), None)
+
+def _cache(tmp_path, monkeypatch) -> ResultCache:
+    async def download_to_file(url, path, http_session=None):
+        # Без сети: результат провайдера «скачивается» в указанный файл
+        with open(path, "wb") as f:
+            f.write(url.encode())
+        return types.SimpleNamespace(size=len(url), sha256=hashlib.sha256(url.encode()).hexdigest())
+    monkeypatch.setattr(result_cache, "download_to_file", download_to_file)
+    return ResultCache(directory=str(tmp_path))
+
+def test_ttl_is_bounded_by_url_lifetime(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), ttl=24 * 3600, url_lifetime=6 * 3600)
+    assert cache.ttl == 3 * 3600
+
+async def test_inputs_are_hashed_from_job_artifacts(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, monkeypatch)
+    artifacts = FakeArtifacts([Artifact("photo_0", 3, "a" * 64, data=b"abc", url="https://tg.example/photo.jpg")])
+    api = FakeImageAPI()
+    cached = CachedImageAPI(api, "gpt-image-1", cache, artifacts=artifacts)
+    first = await cached.send_request(prompt="p", image_urls=["https://tg.example/photo.jpg"])
+    second = await cached.send_request(prompt="p", image_urls=["https://tg.example/photo.jpg"])
+    assert first == second
+    assert api.calls == 1
+
+async def test_unknown_input_bypasses_cache(tmp_path, monkeypatch):
+    cache = _cache(tmp_path, monkeypatch)
+    api = FakeImageAPI()
+    cached = CachedImageAPI(api, "gpt-image-1", cache, artifacts=FakeArtifacts([]))
+    await cached.send_request(prompt="p", image_urls=["https://tg.example/unknown.jpg"])
+    await cached.send_request(prompt="p", image_urls=["https://tg.example/unknown.jpg"])
+    assert api.calls == 2
+    assert cache.stats()["hits"] == 0
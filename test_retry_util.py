@@ -0,0 +1,120 @@
+import asyncio
+import aiohttp
+import pytest
+import retry_util
+from download_util import DownloadError
+from retry_util import APIError, PollTimeoutError, RetryPolicy, TaskFailedError, call_with_retry, classify
+
+def _wrapped(cause: BaseException, explicit: bool = True) -> Exception:
+    # Клиенты оборачивают ошибку в Exception: через raise ... from e или внутри except
+    try:
+        try:
+            raise cause
+        except BaseException as e:
+            if explicit:
+                raise Exception(f"Client error: {e}") from e
+            raise Exception(f"Client error: {e}")
+    except Exception as e:
+        return e
+
+def test_retryable_statuses_keep_retry_after():
+    assert classify(APIError("busy", status=429, retry_after=7.0)) == (True, 7.0)
+    assert classify(APIError("down", status=503)) == (True, None)
+    assert classify(APIError("timeout", status=408)) == (True, None)
+
+def test_client_errors_are_fatal():
+    assert classify(APIError("bad request", status=400)) == (False, None)
+    assert classify(APIError("forbidden", status=403)) == (False, None)
+
+def test_cause_is_found_through_explicit_chain():
+    assert classify(_wrapped(APIError("bad request", status=400))) == (False, None)
+    assert classify(_wrapped(APIError("busy", status=429, retry_after=3.0))) == (True, 3.0)
+
+def test_cause_is_found_through_implicit_context():
+    assert classify(_wrapped(APIError("bad request", status=400), explicit=False)) == (False, None)
+
+def test_transport_errors_are_retryable():
+    assert classify(_wrapped(asyncio.TimeoutError())) == (True, None)
+    assert classify(_wrapped(aiohttp.ClientConnectionError("reset"))) == (True, None)
+
+def test_poll_deadline_is_fatal():
+    assert classify(_wrapped(PollTimeoutError("Polling timeout for flux task 1"))) == (False, None)
+
+def test_task_failures_depend_on_moderation_markers():
+    assert classify(TaskFailedError("task 1 failed: internal error")) == (True, None)
+    assert classify(_wrapped(TaskFailedError("task 1 failed: rejected by moderation"))) == (False, None)
+
+def test_programming_errors_are_fatal():
+    assert classify(_wrapped(KeyError("result"))) == (False, None)
+
+def test_unknown_errors_are_retryable_unless_marked_fatal():
+    assert classify(Exception("something odd")) == (True, None)
+    assert classify(Exception("blocked by content policy")) == (False, None)
+
+def test_cyclic_chain_terminates():
+    first, second = Exception("first"), Exception("second")
+    first.__cause__, second.__cause__ = second, first
+    assert classify(first) == (True, None)
+
+def test_download_client_errors_are_fatal():
+    assert classify(_wrapped(DownloadError("Failed to download x: 404", status=404))) == (False, None)
+    assert classify(_wrapped(DownloadError("Failed to download x: 503", status=503))) == (True, None)
+
+def test_response_errors_follow_status():
+    not_found = aiohttp.ClientResponseError(None, (), status=404)
+    busy = aiohttp.ClientResponseError(None, (), status=429, headers={"Retry-After": "4"})
+    assert classify(_wrapped(not_found)) == (False, None)
+    assert classify(_wrapped(busy)) == (True, 4.0)
+
+def test_backoff_grows_exponentially_up_to_max_delay():
+    policy = RetryPolicy("test", base_delay=1, max_delay=30)
+    for attempt in range(8):
+        delay = min(30, 2 ** attempt)
+        assert delay / 2 <= policy.backoff(attempt) <= delay
+
+def test_backoff_honours_retry_after():
+    policy = RetryPolicy("test", base_delay=1, max_delay=30)
+    assert policy.backoff(0, retry_after=12) == 12
+
+async def _call(monkeypatch, policy: RetryPolicy, error: Exception, max_attempts: int = 5) -> tuple[int, list[float]]:
+    # call_with_retry без реального ожидания: задержки только записываются
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+    monkeypatch.setitem(retry_util._policies, policy.provider, policy)
+    monkeypatch.setattr(retry_util.asyncio, "sleep", sleep)
+    calls = 0
+
+    async def func():
+        nonlocal calls
+        calls += 1
+        raise error
+    with pytest.raises(type(error)):
+        await call_with_retry(func, policy.provider, max_attempts=max_attempts)
+    return calls, delays
+
+async def test_retry_after_is_waited_before_next_attempt(monkeypatch):
+    policy = RetryPolicy("test-retry-after", base_delay=0.01, max_retry_after=60)
+    calls, delays = await _call(monkeypatch, policy, APIError("busy", status=429, retry_after=20), 3)
+    assert calls == 3
+    assert delays == [20, 20]
+
+async def test_retry_after_above_limit_gives_up(monkeypatch):
+    policy = RetryPolicy("test-retry-after-limit", base_delay=0.01, max_retry_after=60)
+    calls, delays = await _call(monkeypatch, policy, APIError("busy", status=429, retry_after=600))
+    assert calls == 1
+    assert delays == []
+
+async def test_fatal_error_is_not_retried(monkeypatch):
+    policy = RetryPolicy("test-fatal", base_delay=0.01)
+    calls, _ = await _call(monkeypatch, policy, DownloadError("Failed to download x: 404", status=404))
+    assert calls == 1
+    assert policy.stats()["fatal"] == 1
+
+async def test_retry_budget_exhaustion_stops_retries(monkeypatch):
+    policy = RetryPolicy("test-budget", base_delay=0.01, budget_ratio=0, budget_min=2)
+    calls, delays = await _call(monkeypatch, policy, APIError("down", status=503))
+    assert calls == 3
+    assert len(delays) == 2
+    assert policy.stats()["budget_denied"] == 1
@@ -0,0 +1,186 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import logging
+import random
+import time
+from config import TRACE_SAMPLE_RATE, TRACE_MAX_SPANS, TRACE_BODY_PREVIEW, TRACE_LOG_PATH
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+# Краткое описание тела запроса или ответа для трассы: размер, sha256 и начало текста
+def digest(body, preview: int = TRACE_BODY_PREVIEW) -> dict | None:
+    if body is None:
+        return None
+    if isinstance(body, (bytes, bytearray)):
+        data, text = bytes(body), None
+    else:
+        text = body if isinstance(body, str) else json.dumps(body, ensure_ascii=False, default=str)
+        data = text.encode("utf-8")
+    summary = {"bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()[:16]}
+    if text is not None and preview:
+        summary["preview"] = text[:preview] + ("..." if len(text) > preview else "")
+    return summary
+
+class Span:
+    def __init__(self, trace: "Trace", span_id: int, name: str, parent_id: int | None, attrs: dict):
+        self.trace = trace
+        self.span_id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.started = time.monotonic()
+        self.finished = None
+        self.error = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def fail(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {str(error)[:TRACE_BODY_PREVIEW]}"
+
+    def record(self) -> dict:
+        record = {
+            "job_id": self.trace.job_id,
+            "span": self.span_id,
+            "parent": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.root.started) * 1000),
+            "duration_ms": round(((self.finished or time.monotonic()) - self.started) * 1000),
+            "status": "error" if self.error else "ok",
+        }
+        if self.error:
+            record["error"] = self.error
+        if self.attrs:
+            record["attrs"] = self.attrs
+        return record
+
+# Трасса одного задания: корневой спан и не больше max_spans дочерних. Спаны сверх лимита
+# (например, повторы опроса) только суммируются по имени, поэтому объём записей на задание
+# ограничен независимо от того, сколько длится опрос.
+class Trace:
+    def __init__(self, job_id: str, sampled: bool, max_spans: int, attrs: dict):
+        self.job_id = job_id
+        self.sampled = sampled
+        self.max_spans = max_spans
+        self.spans: list[Span] = []
+        self.overflow: dict[str, list] = {}
+        self._next_id = 0
+        self.root = self.new_span("job", None, attrs)
+        self.token = None
+
+    def new_span(self, name: str, parent_id: int | None, attrs: dict) -> Span:
+        self._next_id += 1
+        return Span(self, self._next_id, name, parent_id, attrs)
+
+    def add(self, span: Span) -> bool:
+        if len(self.spans) < self.max_spans:
+            self.spans.append(span)
+            return True
+        # [количество, суммарная длительность, ошибки]
+        overflow = self.overflow.setdefault(span.name, [0, 0.0, 0])
+        overflow[0] += 1
+        overflow[1] += span.finished - span.started
+        overflow[2] += 1 if span.error else 0
+        return False
+
+    def summary(self) -> dict:
+        root = self.root.record()
+        return {
+            **root,
+            "event": "job_summary",
+            "sampled": self.sampled,
+            "timeline": [
+                {key: value for key, value in span.record().items() if key not in ("job_id", "attrs")}
+                for span in sorted(self.spans, key=lambda span: span.started)
+            ],
+            "overflow": {
+                name: {"count": count, "duration_ms": round(total * 1000), "errors": errors}
+                for name, (count, total, errors) in self.overflow.items()
+            },
+        }
+
+# Трассировка заданий: спан на задание, дочерние спаны на этапы конвейера и вызовы провайдеров.
+# Текущий спан хранится в contextvars и наследуется задачами TaskGroup, поэтому параллельные
+# сцены попадают в трассу своего задания. Для доли TRACE_SAMPLE_RATE заданий каждый завершённый
+# спан пишется отдельной JSON-строкой; для всех заданий в конце пишется сводка с хронологией.
+class Tracer:
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, max_spans: int = TRACE_MAX_SPANS,
+                 log_path: str = TRACE_LOG_PATH):
+        self.sample_rate = sample_rate
+        self.max_spans = max_spans
+        self.log_path = log_path
+        self._output = None
+        self._stats = {"jobs": 0, "sampled": 0, "spans": 0, "overflow": 0, "records": 0}
+
+    def _logger(self) -> logging.Logger:
+        if self._output is None:
+            output = logging.getLogger("trace")
+            handler = logging.FileHandler(self.log_path, encoding="utf-8") if self.log_path else logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            output.addHandler(handler)
+            output.setLevel(logging.INFO)
+            # JSON-строки не дублируются в общий текстовый лог
+            output.propagate = False
+            self._output = output
+        return self._output
+
+    def _emit(self, record: dict) -> None:
+        self._stats["records"] += 1
+        self._logger().info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def start(self, job_id: str, **attrs) -> Trace:
+        sampled = random.random() < self.sample_rate
+        trace = Trace(job_id, sampled, self.max_spans, attrs)
+        trace.token = _current_span.set(trace.root)
+        self._stats["jobs"] += 1
+        self._stats["sampled"] += 1 if sampled else 0
+        return trace
+
+    def finish(self, trace: Trace, error: BaseException = None) -> None:
+        trace.root.finished = time.monotonic()
+        if error is not None:
+            trace.root.fail(error)
+        # Задания выполняются в общих воркерах планировщика: контекст возвращается к прежнему
+        _current_span.reset(trace.token)
+        self._emit(trace.summary())
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        parent = _current_span.get()
+        if parent is None:
+            # Вне задания (фоновые опросы, кэш) спаны не создаются
+            yield None
+            return
+        span = parent.trace.new_span(name, parent.span_id, attrs)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finished = time.monotonic()
+            self._stats["spans"] += 1
+            if not span.trace.add(span):
+                self._stats["overflow"] += 1
+            elif span.trace.sampled:
+                self._emit(span.record())
+
+    def annotate(self, **attrs) -> None:
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attrs)
+
+    def fail(self, error: BaseException) -> None:
+        # Ошибка, перехваченная внутри этапа, всё равно отмечается в его спане
+        span = _current_span.get()
+        if span is not None:
+            span.fail(error)
+
+    def stats(self) -> dict:
+        return dict(self._stats)
+
+tracer = Tracer()
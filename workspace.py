@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from config import WORKSPACE_ROOT, WORKSPACE_QUOTA_BYTES, WORKSPACE_SWEEP_INTERVAL, WORKSPACE_ORPHAN_AGE
+
+logger = logging.getLogger(__name__)
+
+# Рабочий каталог одного задания: все промежуточные файлы задания лежат только в нём
+class Workspace:
+    def __init__(self, job_id: str, path: str):
+        self.job_id = job_id
+        self.path = path
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+def _disk_usage(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+def _remove(path: str) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+# Менеджер рабочих каталогов: выдаёт каталог заданию, удаляет его в фоне после завершения,
+# держит общий объём под квотой (вытесняя давно не использованные каталоги без активного
+# задания) и периодически убирает файлы, оставшиеся после падений.
+class WorkspaceManager:
+    def __init__(self, root: str = WORKSPACE_ROOT, quota_bytes: int = WORKSPACE_QUOTA_BYTES,
+                 sweep_interval: float = WORKSPACE_SWEEP_INTERVAL, orphan_age: float = WORKSPACE_ORPHAN_AGE):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.sweep_interval = sweep_interval
+        self.orphan_age = orphan_age
+        self._active: dict[str, Workspace] = {}
+        self._cleanups: set[asyncio.Task] = set()
+        self._sweeper = None
+        self._stats = {"created": 0, "removed": 0, "evicted": 0, "swept": 0, "cleanup_errors": 0, "usage": 0}
+
+    def create(self, job_id: str) -> Workspace:
+        path = os.path.join(self.root, job_id)
+        # Продолженное после перезапуска задание получает свой прежний каталог
+        os.makedirs(path, exist_ok=True)
+        workspace = Workspace(job_id, path)
+        self._active[job_id] = workspace
+        self._stats["created"] += 1
+        return workspace
+
+    def release(self, workspace: Workspace) -> None:
+        self._active.pop(workspace.job_id, None)
+        task = asyncio.get_running_loop().create_task(self._cleanup(workspace.path))
+        self._cleanups.add(task)
+        task.add_done_callback(self._cleanups.discard)
+
+    async def _cleanup(self, path: str, attempts: int = 3) -> None:
+        for attempt in range(attempts):
+            try:
+                await asyncio.to_thread(_remove, path)
+                self._stats["removed"] += 1
+                logger.debug(f"Workspace {path} removed")
+                return
+            except PermissionError as e:
+                # Файл ещё открыт (например, отправляемое видео) — пробуем позже
+                logger.warning(f"Failed to remove workspace {path} on attempt {attempt + 1}: {e}")
+                await asyncio.sleep(5 * (attempt + 1))
+            except OSError as e:
+                logger.error(f"Failed to remove workspace {path}: {e}")
+                break
+        # Остаток удалит сборщик или вытеснение по квоте
+        self._stats["cleanup_errors"] += 1
+
+    def _scan(self) -> list[tuple[str, float, int]]:
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                entries.append((name, os.path.getmtime(path), _disk_usage(path)))
+            except OSError:
+                continue
+        return entries
+
+    async def enforce_quota(self) -> None:
+        entries = await asyncio.to_thread(self._scan)
+        usage = sum(size for _, _, size in entries)
+        self._stats["usage"] = usage
+        if usage <= self.quota_bytes:
+            return
+        # Каталоги активных заданий не трогаем; остальные — от давно не использованных
+        candidates = sorted((entry for entry in entries if entry[0] not in self._active), key=lambda entry: entry[1])
+        for name, _, size in candidates:
+            if usage <= self.quota_bytes:
+                break
+            try:
+                await asyncio.to_thread(_remove, os.path.join(self.root, name))
+            except OSError as e:
+                logger.warning(f"Failed to evict {name} from {self.root}: {e}")
+                continue
+            usage -= size
+            self._stats["evicted"] += 1
+        self._stats["usage"] = usage
+        if usage > self.quota_bytes:
+            logger.warning(f"Workspace usage {usage} bytes exceeds quota {self.quota_bytes} with {len(self._active)} active jobs")
+
+    async def sweep(self) -> None:
+        entries = await asyncio.to_thread(self._scan)
+        now = time.time()
+        for name, mtime, _ in entries:
+            if name in self._active or now - mtime < self.orphan_age:
+                continue
+            try:
+                await asyncio.to_thread(_remove, os.path.join(self.root, name))
+                self._stats["swept"] += 1
+                logger.info(f"Removed orphaned {name} from {self.root}")
+            except OSError as e:
+                logger.warning(f"Failed to remove orphaned {name}: {e}")
+        await self.enforce_quota()
+
+    def start_sweeper(self) -> None:
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._run_sweeper())
+
+    async def _run_sweeper(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Workspace sweep failed: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    def stats(self) -> dict:
+        return {**self._stats, "active": len(self._active), "pending_cleanups": len(self._cleanups)}
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        if self._cleanups:
+            await asyncio.gather(*self._cleanups, return_exceptions=True)
+
+workspace_manager = WorkspaceManager()